@@ -0,0 +1,141 @@
+import random
+import time
+from datetime import date as date_cls, time as time_cls
+
+from django.db import IntegrityError, OperationalError, transaction
+
+from users.models import User
+from .call_tokens import call_tokens
+from .models import BOOKED_STATUSES, Appointment
+
+# A write that loses a race (unique constraint hit, lock timeout, deadlock)
+# is retried this many times, re-running the conflict check each time
+MAX_BOOKING_ATTEMPTS = 4
+RETRY_BACKOFF = 0.05
+
+
+# SQLSTATEs of a lost race: unique violation, serialization failure, deadlock, lock not available
+RACE_SQLSTATES = {'23505', '40001', '40P01', '55P03'}
+
+
+class BookingConflict(Exception):
+    """The requested slot cannot be booked"""
+
+
+def lost_race(error):
+    """Whether a failed write collided with a concurrent booking, as opposed to being invalid.
+
+    Unique constraint hits, lock timeouts and deadlocks are races worth
+    retrying; other integrity errors, such as a NOT NULL column left
+    empty, fail the same way every time.
+    """
+    cause = error.__cause__
+    code = getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+    if code:
+        return code in RACE_SQLSTATES
+    message = str(error).lower()
+    if isinstance(error, IntegrityError):
+        return 'unique' in message or 'duplicate' in message
+    return 'lock' in message
+
+
+def _as_date(value):
+    return date_cls.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _as_time(value):
+    return time_cls.fromisoformat(value) if isinstance(value, str) else value
+
+
+def check_conflicts(appointment):
+    """Raise BookingConflict if the doctor's or the patient's time is taken.
+
+    Reads the database rather than the slot index, so call it inside the
+    booking transaction.
+    """
+    doctor_bookings = Appointment.objects.filter(
+        doctor_id=appointment.doctor_id,
+        date=appointment.date,
+        time=appointment.time,
+        status__in=BOOKED_STATUSES
+    ).exclude(pk=appointment.pk)
+    if doctor_bookings.exists():
+        raise BookingConflict("Doctor already has an appointment at this time.")
+
+    patient_bookings = Appointment.objects.filter(
+        patient_id=appointment.patient_id,
+        date=appointment.date,
+        time=appointment.time,
+        status__in=BOOKED_STATUSES
+    ).exclude(pk=appointment.pk)
+    if patient_bookings.exists():
+        raise BookingConflict("Patient already has an appointment at this time.")
+
+
+def book(appointment):
+    """Save ``appointment`` into its slot, or raise BookingConflict.
+
+    Bookings for the same doctor are serialized on the doctor's row; the
+    ``appointments_doctor_slot_uniq`` constraint catches anything that
+    slips past, and the losing write is retried so it fails with the real
+    conflict (or succeeds if the winner rolled back).
+    """
+    appointment.date = _as_date(appointment.date)
+    appointment.time = _as_time(appointment.time)
+    adding = appointment._state.adding
+    for attempt in range(1, MAX_BOOKING_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                list(User.objects.select_for_update().filter(id=appointment.doctor_id).values_list('id'))
+                if appointment.status in BOOKED_STATUSES:
+                    check_conflicts(appointment)
+                    if appointment.call_token and attempt > 1:
+                        # The failed write may have been a call token collision
+                        call_tokens.reassign_if_taken(appointment)
+                appointment.save()
+            return appointment
+        except (IntegrityError, OperationalError) as e:
+            if not lost_race(e):
+                raise
+            if attempt == MAX_BOOKING_ATTEMPTS:
+                raise BookingConflict("This slot was just taken. Please choose another time.")
+            if adding:
+                # The rolled-back insert may already have assigned a pk
+                appointment.pk = None
+                appointment._state.adding = True
+            time.sleep(RETRY_BACKOFF * attempt * random.uniform(0.5, 1.5))
+
+
+def reschedule(appointment, new_date, new_time):
+    """Move a doctor's appointment to a new slot, keeping the original time on record"""
+    if not new_date or not new_time:
+        raise ValueError("A new date and time are required.")
+    if not appointment.original_date:
+        appointment.original_date = appointment.date
+        appointment.original_time = appointment.time
+    appointment.date = new_date
+    appointment.time = new_time
+    appointment.modified_by_doctor = True
+    appointment.status = Appointment.Status.RESCHEDULED
+    return book(appointment)
+
+
+def approve_request(appointment_request):
+    """Book the appointment an approved request asks for, with a fresh call token"""
+    appointment = Appointment(
+        doctor=appointment_request.doctor,
+        patient=appointment_request.patient,
+        hospital=appointment_request.doctor.hospital,
+        date=appointment_request.requested_date,
+        time=appointment_request.requested_time,
+        notes=appointment_request.message,
+        created_by=appointment_request.requested_by,
+        call_token=call_tokens.allocate()
+    )
+    with transaction.atomic():
+        book(appointment)
+        appointment_request.status = 'approved'
+        appointment_request.approved_date = appointment_request.requested_date
+        appointment_request.approved_time = appointment_request.requested_time
+        appointment_request.save()
+    return appointment
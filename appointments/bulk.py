@@ -0,0 +1,179 @@
+import random
+import time
+from collections import namedtuple
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.utils.dateparse import parse_date, parse_time
+
+from doctors.models import Availability
+from notifications.reminders import publish_change
+from users.models import User
+from .booking import MAX_BOOKING_ATTEMPTS, RETRY_BACKOFF, BookingConflict, lost_race
+from .models import BOOKED_STATUSES, Appointment
+from .slots import on_commit, slot_index, within_windows
+
+MAX_BATCH_ROWS = 1000
+
+BatchRow = namedtuple('BatchRow', ['doctor_id', 'patient_id', 'date', 'time', 'notes'])
+
+
+def _parse_id(value, label):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {label}.")
+
+
+def parse_row(row):
+    """Turn ``{doctor, patient, date, time, notes}`` into a BatchRow, or raise ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError("Invalid row.")
+    try:
+        day = parse_date(str(row.get('date') or ''))
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError("Invalid date.")
+    try:
+        start = parse_time(str(row.get('time') or ''))
+    except ValueError:
+        start = None
+    if start is None:
+        raise ValueError("Invalid time.")
+    return BatchRow(
+        doctor_id=_parse_id(row.get('doctor'), 'doctor'),
+        patient_id=_parse_id(row.get('patient'), 'patient'),
+        date=day,
+        time=start,
+        notes=str(row.get('notes') or ''),
+    )
+
+
+def _accepted(number, appointment_id=None):
+    return {'row': number, 'status': 'accepted', 'appointment_id': appointment_id, 'error': ''}
+
+
+def _rejected(number, error):
+    return {'row': number, 'status': 'rejected', 'appointment_id': None, 'error': error}
+
+
+def _validate(parsed, created_by, report):
+    """Check every parsed row against the database and the rows before it.
+
+    Runs a fixed number of queries whatever the batch size. Writes a report
+    entry for each row and returns ``(row_index, Appointment)`` for the
+    accepted ones.
+    """
+    doctor_ids = sorted({row.doctor_id for row in parsed.values()})
+    patient_ids = {row.patient_id for row in parsed.values()}
+    days = {row.date for row in parsed.values()}
+
+    # Lock the doctors in id order, as book() does one at a time, so batches
+    # and single bookings for the same doctor are serialized
+    doctors = dict(User.objects.select_for_update().filter(
+        id__in=doctor_ids,
+        role='doctor'
+    ).order_by('id').values_list('id', 'hospital_id'))
+    patients = dict(User.objects.filter(
+        id__in=patient_ids,
+        role='patient'
+    ).values_list('id', 'hospital_id'))
+
+    windows = {}
+    for doctor_id, day, start_time, end_time in Availability.objects.filter(
+        doctor_id__in=doctors,
+        is_available=True
+    ).values_list('doctor_id', 'day_of_week', 'start_time', 'end_time'):
+        windows.setdefault(doctor_id, []).append((day, start_time, end_time))
+
+    booked = Appointment.objects.filter(date__in=days, status__in=BOOKED_STATUSES)
+    doctor_times = set(booked.filter(doctor_id__in=doctors).values_list('doctor_id', 'date', 'time'))
+    patient_times = set(booked.filter(patient_id__in=patients).values_list('patient_id', 'date', 'time'))
+
+    restrict_hospital = created_by is not None and created_by.role == 'admin'
+    accepted = []
+    for index, row in parsed.items():
+        number = index + 1
+        if row.doctor_id not in doctors:
+            report[index] = _rejected(number, "Unknown doctor.")
+        elif doctors[row.doctor_id] is None:
+            report[index] = _rejected(number, "Doctor has no hospital.")
+        elif row.patient_id not in patients:
+            report[index] = _rejected(number, "Unknown patient.")
+        elif restrict_hospital and patients[row.patient_id] != created_by.hospital_id:
+            report[index] = _rejected(number, "Patient is not registered at your hospital.")
+        elif not within_windows(windows.get(row.doctor_id, ()), row.date, row.time):
+            report[index] = _rejected(number, "Doctor is not available at this time.")
+        elif (row.doctor_id, row.date, row.time) in doctor_times:
+            report[index] = _rejected(number, "Doctor already has an appointment at this time.")
+        elif (row.patient_id, row.date, row.time) in patient_times:
+            report[index] = _rejected(number, "Patient already has an appointment at this time.")
+        else:
+            doctor_times.add((row.doctor_id, row.date, row.time))
+            patient_times.add((row.patient_id, row.date, row.time))
+            report[index] = _accepted(number)
+            accepted.append((index, Appointment(
+                doctor_id=row.doctor_id,
+                patient_id=row.patient_id,
+                hospital_id=doctors[row.doctor_id],
+                date=row.date,
+                time=row.time,
+                notes=row.notes,
+                created_by=created_by,
+                # bulk_create skips Appointment.save, which normally sets this
+                is_cross_hospital=patients[row.patient_id] != doctors[row.doctor_id],
+            )))
+    return accepted
+
+
+def _index_created(appointments):
+    for appointment in appointments:
+        slot_index.appointment_saved(
+            appointment.id, appointment.doctor_id, appointment.date, appointment.time, appointment.status
+        )
+        publish_change(appointment.id, appointment.date, appointment.time, appointment.status)
+
+
+def schedule_batch(rows, created_by=None, dry_run=False):
+    """Validate and book a batch of appointments, returning a per-row report.
+
+    ``rows`` are dicts with doctor and patient ids, ``date`` (YYYY-MM-DD),
+    ``time`` (HH:MM) and optional ``notes``. Rows that pass are inserted
+    with one ``bulk_create`` in the same transaction as the checks; rows
+    that fail are reported with the reason. Admins may only book their own
+    hospital's patients, as with ``AppointmentForm``. With ``dry_run`` the
+    report is produced but nothing is written.
+    """
+    if len(rows) > MAX_BATCH_ROWS:
+        raise ValueError(f"A batch can hold at most {MAX_BATCH_ROWS} appointments.")
+    report = [None] * len(rows)
+    parsed = {}
+    for index, row in enumerate(rows):
+        try:
+            parsed[index] = parse_row(row)
+        except ValueError as e:
+            report[index] = _rejected(index + 1, str(e))
+    if not parsed:
+        return report
+
+    for attempt in range(1, MAX_BOOKING_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                accepted = _validate(parsed, created_by, report)
+                if accepted and not dry_run:
+                    created = Appointment.objects.bulk_create([appointment for _, appointment in accepted])
+                    # bulk_create sends no post_save, so update the slot index and reminders here
+                    on_commit(_index_created, created)
+            break
+        except (IntegrityError, OperationalError) as e:
+            # Something booked one of the slots between our checks and the insert
+            if not lost_race(e):
+                raise
+            if attempt == MAX_BOOKING_ATTEMPTS:
+                raise BookingConflict("Some of these slots were just taken. Please try again.")
+            time.sleep(RETRY_BACKOFF * attempt * random.uniform(0.5, 1.5))
+
+    if not dry_run:
+        for index, appointment in accepted:
+            report[index]['appointment_id'] = appointment.id
+    return report
@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+from collections import deque
+
+from .models import BOOKED_STATUSES, Appointment
+
+# Call tokens are the 4-digit codes patients and doctors type to join a call
+FIRST_CALL_TOKEN = 1000
+LAST_CALL_TOKEN = 9999
+
+# Tokens taken or released by other processes reach this pool after at most this long
+CALL_TOKEN_POOL_TTL = 60
+
+
+class CallTokensExhausted(Exception):
+    """Every call token is held by an active appointment"""
+
+
+def by_call_token(token, prefix=''):
+    """Lookup kwargs for the active appointment holding ``token``.
+
+    Served by the index on ``call_token``; at most one active appointment
+    matches thanks to the ``appointments_active_call_token_uniq`` partial
+    index. ``prefix`` is for lookups through a relation, e.g. ``'appointment__'``.
+    """
+    return {f'{prefix}call_token': token, f'{prefix}status__in': BOOKED_STATUSES}
+
+
+class CallTokenPool:
+    """Per-process pool of call tokens not held by any active appointment.
+
+    Tokens are handed out from a shuffled free queue and go to the back of
+    it when their appointment is done or cancelled, so a released token is
+    not reused straight away. The partial unique index on active
+    appointments' tokens is the source of truth: a token another process
+    handed out in the meantime fails the insert, and ``reassign_if_taken``
+    picks a new one on retry.
+    """
+
+    def __init__(self, ttl=CALL_TOKEN_POOL_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # token -> appointment id holding it (None while allocated but not yet saved)
+        self._holders = None
+        self._free = deque()
+        self._loaded_at = 0.0
+
+    def _load(self):
+        holders = dict(Appointment.objects.filter(
+            status__in=BOOKED_STATUSES,
+            call_token__isnull=False
+        ).values_list('call_token', 'id'))
+        free = [
+            token for token in map(str, range(FIRST_CALL_TOKEN, LAST_CALL_TOKEN + 1))
+            if token not in holders
+        ]
+        random.shuffle(free)
+        self._holders = holders
+        self._free = deque(free)
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._holders is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._load()
+
+    def allocate(self):
+        """Return a token no active appointment holds, as far as this process knows"""
+        with self._lock:
+            self._ensure_loaded()
+            for reload in (False, True):
+                if reload:
+                    # Reserved tokens that were never saved come back with a fresh load
+                    self._load()
+                while self._free:
+                    token = self._free.popleft()
+                    # Tokens claimed since they were queued are skipped here rather than
+                    # searched for in the queue
+                    if token not in self._holders:
+                        self._holders[token] = None
+                        return token
+        raise CallTokensExhausted("All call tokens are in use.")
+
+    def claim(self, token, appointment_id):
+        with self._lock:
+            if self._holders is not None:
+                self._holders[token] = appointment_id
+
+    def release(self, token, appointment_id):
+        """Return ``token`` to the pool if ``appointment_id`` still holds it"""
+        with self._lock:
+            if self._holders is None or self._holders.get(token, appointment_id) != appointment_id:
+                return
+            self._holders.pop(token, None)
+            if token.isdigit() and FIRST_CALL_TOKEN <= int(token) <= LAST_CALL_TOKEN:
+                self._free.append(token)
+
+    def reassign_if_taken(self, appointment):
+        """Give ``appointment`` a new token if another active appointment holds its current one"""
+        token = appointment.call_token
+        while True:
+            holder = Appointment.objects.filter(**by_call_token(token)).exclude(
+                pk=appointment.pk
+            ).values_list('id', flat=True).first()
+            if holder is None:
+                break
+            self.claim(token, holder)
+            token = self.allocate()
+        appointment.call_token = token
+
+    def invalidate(self):
+        with self._lock:
+            self._holders = None
+
+
+call_tokens = CallTokenPool()
@@ -0,0 +1,53 @@
+from collections import namedtuple
+from .models import Appointment
+
+# Everything a realtime consumer needs about its appointment, resolved once on connect
+AppointmentContext = namedtuple('AppointmentContext', [
+    'appointment_id',
+    'doctor_id',
+    'patient_id',
+    'chat_room_id',
+    'call_token',
+    'status',
+    'user_role',
+])
+
+
+def resolve_appointment_context(user, create_chat_room=False, **lookup):
+    """Resolve the appointment matching ``lookup`` for ``user``.
+
+    Returns None if the appointment does not exist or the user is neither
+    its doctor nor its patient.
+    """
+    from chat.models import ChatRoom
+
+    appointment = Appointment.objects.filter(**lookup).values(
+        'id', 'doctor_id', 'patient_id', 'call_token', 'status'
+    ).first()
+    if appointment is None:
+        return None
+
+    if user.id == appointment['doctor_id']:
+        user_role = 'doctor'
+    elif user.id == appointment['patient_id']:
+        user_role = 'patient'
+    else:
+        return None
+
+    if create_chat_room:
+        chat_room, created = ChatRoom.objects.get_or_create(appointment_id=appointment['id'])
+        chat_room_id = chat_room.id
+    else:
+        chat_room_id = ChatRoom.objects.filter(
+            appointment_id=appointment['id']
+        ).values_list('id', flat=True).first()
+
+    return AppointmentContext(
+        appointment_id=appointment['id'],
+        doctor_id=appointment['doctor_id'],
+        patient_id=appointment['patient_id'],
+        chat_room_id=chat_room_id,
+        call_token=appointment['call_token'],
+        status=appointment['status'],
+        user_role=user_role,
+    )
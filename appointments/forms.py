@@ -1,9 +1,8 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Appointment
+from .models import BOOKED_STATUSES, Appointment
 from users.models import User
-from doctors.models import Availability
-from datetime import datetime, time
+from .slots import slot_index
 
 class AppointmentForm(forms.ModelForm):
     doctor = forms.ModelChoiceField(
@@ -68,34 +67,13 @@ class AppointmentForm(forms.ModelForm):
         appointment_time = cleaned_data.get('time')
 
         if doctor and patient and date and appointment_time:
-            # Check if doctor is available on this day/time
-            day_of_week = date.weekday()  # 0=Monday, 6=Sunday
+            # Availability and the doctor's bookings come from the slot index
+            problem = slot_index.check(doctor.id, date, appointment_time, exclude=self.instance.pk)
 
-            # Get doctor's availability for this day
-            availabilities = Availability.objects.filter(
-                doctor=doctor,
-                day_of_week=day_of_week,
-                is_available=True
-            )
-
-            time_available = False
-            for availability in availabilities:
-                if availability.start_time <= appointment_time <= availability.end_time:
-                    time_available = True
-                    break
-
-            if not time_available:
+            if problem == 'unavailable':
                 raise ValidationError("Doctor is not available at this time.")
 
-            # Check for conflicting appointments
-            conflicting_appointment = Appointment.objects.filter(
-                doctor=doctor,
-                date=date,
-                time=appointment_time,
-                status__in=['scheduled', 'completed']
-            ).exclude(pk=self.instance.pk if self.instance else None)
-
-            if conflicting_appointment.exists():
+            if problem == 'booked':
                 raise ValidationError("Doctor already has an appointment at this time.")
 
             # Ensure patient doesn't have conflicting appointment
@@ -103,7 +81,7 @@ class AppointmentForm(forms.ModelForm):
                 patient=patient,
                 date=date,
                 time=appointment_time,
-                status__in=['scheduled', 'completed']
+                status__in=BOOKED_STATUSES
             ).exclude(pk=self.instance.pk if self.instance else None)
 
             if patient_conflict.exists():
@@ -0,0 +1,58 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from appointments.booking import BookingConflict
+from appointments.bulk import schedule_batch
+from users.models import User
+
+REPORT_FIELDS = ['row', 'status', 'appointment_id', 'error']
+
+
+class Command(BaseCommand):
+    help = (
+        "Book a batch of appointments from a CSV (doctor,patient,date,time,notes) "
+        "or JSON file and print a per-row CSV report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or .json file, or - to read CSV from stdin")
+        parser.add_argument('--created-by', help='Username recorded as creator; admins are limited to their hospital')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without booking anything')
+
+    def read_rows(self, path):
+        if path == '-':
+            return list(csv.DictReader(sys.stdin))
+        with open(path, newline='', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                data = json.load(f)
+                return data.get('appointments', []) if isinstance(data, dict) else data
+            return list(csv.DictReader(f))
+
+    def handle(self, *args, **options):
+        created_by = None
+        if options['created_by']:
+            created_by = User.objects.filter(username=options['created_by']).first()
+            if created_by is None:
+                raise CommandError(f"No user named {options['created_by']}")
+
+        try:
+            rows = self.read_rows(options['path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+        if not isinstance(rows, list):
+            raise CommandError("Expected a list of appointments")
+
+        try:
+            report = schedule_batch(rows, created_by=created_by, dry_run=options['dry_run'])
+        except (ValueError, BookingConflict) as e:
+            raise CommandError(str(e))
+
+        writer = csv.DictWriter(self.stdout, fieldnames=REPORT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(report)
+        accepted = sum(1 for row in report if row['status'] == 'accepted')
+        verb = 'would be booked' if options['dry_run'] else 'booked'
+        self.stderr.write(f'{accepted} {verb}, {len(report) - accepted} rejected', style_func=self.style.SUCCESS)
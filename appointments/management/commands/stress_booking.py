@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import time as time_cls, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from appointments.booking import BookingConflict, book
+from appointments.models import BOOKED_STATUSES, Appointment
+from hospitals.models import Hospital
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire parallel bookings at a handful of slots through the booking service "
+        "and check that no slot or patient ends up double-booked"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--bookings', type=int, default=25, help='Booking attempts per thread')
+        parser.add_argument('--slots', type=int, default=10, help='Distinct 15-minute slots to contend for')
+        parser.add_argument('--patients', type=int, default=20)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated hospital, users and appointments')
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        hospital = Hospital.objects.create(
+            name=f'Booking stress {run}',
+            address='-',
+            contact_email='stress@example.com',
+            phone_number='0'
+        )
+        try:
+            self.stress(hospital, run, options)
+        finally:
+            if not options['keep']:
+                hospital.delete()
+
+    def stress(self, hospital, run, options):
+        # bulk_create skips the profile signals; the fixtures need no profiles
+        doctor = User.objects.bulk_create([
+            User(username=f'stress-doctor-{run}', role=User.Roles.DOCTOR, hospital=hospital)
+        ])[0]
+        patients = User.objects.bulk_create([
+            User(username=f'stress-patient-{run}-{i}', role=User.Roles.PATIENT, hospital=hospital)
+            for i in range(options['patients'])
+        ])
+        day = timezone.localdate() + timedelta(days=365)
+        times = [time_cls(9 + slot * 15 // 60, slot * 15 % 60) for slot in range(options['slots'])]
+
+        outcomes = Counter()
+        lock = threading.Lock()
+        start = threading.Barrier(options['threads'])
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                start.wait()
+                for _ in range(options['bookings']):
+                    appointment = Appointment(
+                        doctor=doctor,
+                        patient=rng.choice(patients),
+                        hospital=hospital,
+                        date=day,
+                        time=rng.choice(times)
+                    )
+                    try:
+                        book(appointment)
+                        outcome = 'booked'
+                    except BookingConflict:
+                        outcome = 'conflict'
+                    except Exception as e:
+                        outcome = f'error: {type(e).__name__}'
+                    with lock:
+                        outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        began = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        booked = list(Appointment.objects.filter(
+            doctor=doctor,
+            status__in=BOOKED_STATUSES
+        ).values_list('patient_id', 'date', 'time'))
+        doctor_overlaps = sum(
+            count - 1 for count in Counter((day, start) for _, day, start in booked).values() if count > 1
+        )
+        patient_overlaps = sum(count - 1 for count in Counter(booked).values() if count > 1)
+
+        attempts = options['threads'] * options['bookings']
+        self.stdout.write(
+            f'{attempts} attempts from {options["threads"]} threads in {elapsed:.2f}s: '
+            + ', '.join(f'{outcome} {count}' for outcome, count in sorted(outcomes.items()))
+        )
+        self.stdout.write(f'{len(booked)} appointments hold {options["slots"]} contended slots')
+        if doctor_overlaps or patient_overlaps:
+            raise CommandError(
+                f'Double bookings found: {doctor_overlaps} doctor overlaps, {patient_overlaps} patient overlaps'
+            )
+        self.stdout.write(self.style.SUCCESS('No overlapping bookings'))
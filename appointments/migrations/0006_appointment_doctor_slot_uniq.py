@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:49
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+BOOKED_STATUSES = ['scheduled', 'rescheduled', 'completed']
+
+
+def cancel_double_bookings(apps, schema_editor):
+    """Keep the earliest booking of each doubly booked slot and cancel the rest, noting why on each"""
+    Appointment = apps.get_model('appointments', 'Appointment')
+    booked = Appointment.objects.filter(status__in=BOOKED_STATUSES)
+    clashes = booked.values('doctor_id', 'date', 'time').annotate(bookings=Count('id')).filter(bookings__gt=1)
+    for clash in clashes:
+        kept, *extra = booked.filter(**{key: clash[key] for key in ('doctor_id', 'date', 'time')}).order_by('created_at', 'id')
+        for appointment in extra:
+            appointment.status = 'cancelled'
+            appointment.notes = (
+                f'{appointment.notes}\n\n' if appointment.notes else ''
+            ) + f'Cancelled automatically: the doctor was double-booked with appointment #{kept.id}.'
+            appointment.save(update_fields=['status', 'notes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_appointment_call_token'),
+        ('hospitals', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_double_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['scheduled', 'rescheduled', 'completed'])), fields=('doctor', 'date', 'time'), name='appointments_doctor_slot_uniq'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:54
+
+import random
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+BOOKED_STATUSES = ['scheduled', 'rescheduled', 'completed']
+
+
+def reassign_duplicate_call_tokens(apps, schema_editor):
+    """Give every active appointment sharing a call token, except the earliest, a fresh one"""
+    Appointment = apps.get_model('appointments', 'Appointment')
+    active = Appointment.objects.filter(status__in=BOOKED_STATUSES, call_token__isnull=False)
+    duplicated = list(active.values('call_token').annotate(holders=Count('id')).filter(
+        holders__gt=1
+    ).values_list('call_token', flat=True))
+    if not duplicated:
+        return
+    used = set(active.values_list('call_token', flat=True))
+    free = [token for token in map(str, range(1000, 10000)) if token not in used]
+    random.shuffle(free)
+    for token in duplicated:
+        for appointment in active.filter(call_token=token).order_by('created_at', 'id')[1:]:
+            appointment.call_token = free.pop() if free else None
+            appointment.save(update_fields=['call_token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_appointment_doctor_slot_uniq'),
+        ('hospitals', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='call_token',
+            field=models.CharField(blank=True, db_index=True, help_text='4-digit token for video call', max_length=4, null=True),
+        ),
+        migrations.RunPython(reassign_duplicate_call_tokens, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['scheduled', 'rescheduled', 'completed'])), fields=('call_token',), name='appointments_active_call_token_uniq'),
+        ),
+    ]
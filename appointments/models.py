@@ -50,12 +50,33 @@ class Appointment(models.Model):
     original_date = models.DateField(null=True, blank=True)
     original_time = models.TimeField(null=True, blank=True)
     modified_by_doctor = models.BooleanField(default=False)
-    call_token = models.CharField(max_length=4, blank=True, null=True, help_text='4-digit token for video call')
+    call_token = models.CharField(max_length=4, blank=True, null=True, db_index=True, help_text='4-digit token for video call')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['date', 'time']
+        constraints = [
+            # Backstop for appointments.booking: one live booking per doctor per start time
+            models.UniqueConstraint(
+                fields=['doctor', 'date', 'time'],
+                condition=models.Q(status__in=['scheduled', 'rescheduled', 'completed']),
+                name='appointments_doctor_slot_uniq',
+            ),
+            # Call tokens are recycled, so they only need to be unique among live appointments
+            models.UniqueConstraint(
+                fields=['call_token'],
+                condition=models.Q(status__in=['scheduled', 'rescheduled', 'completed']),
+                name='appointments_active_call_token_uniq',
+            ),
+        ]
+        indexes = [
+            # Keyset pagination of the appointment lists in users.views, newest first, per role
+            models.Index(fields=['date', 'time', 'id'], name='appt_date_time_id_idx'),
+            models.Index(fields=['hospital', 'date', 'time', 'id'], name='appt_hospital_date_idx'),
+            models.Index(fields=['doctor', 'date', 'time', 'id'], name='appt_doctor_date_idx'),
+            models.Index(fields=['patient', 'date', 'time', 'id'], name='appt_patient_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient} with {self.doctor} on {self.date}"
@@ -66,6 +87,9 @@ class Appointment(models.Model):
             self.is_cross_hospital = True
         super().save(*args, **kwargs)
 
+# Appointments in these statuses hold their slot and their call token
+BOOKED_STATUSES = (Appointment.Status.SCHEDULED, Appointment.Status.RESCHEDULED, Appointment.Status.COMPLETED)
+
 class AppointmentRequest(models.Model):
     class Status(models.TextChoices):
         PENDING = "pending", "Pending"
@@ -0,0 +1,59 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from doctors.models import Availability
+from .call_tokens import call_tokens
+from .models import BOOKED_STATUSES, Appointment
+from .slots import on_commit, slot_index
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidate_appointment_context(sender, instance, **kwargs):
+    """Tell connected chat and call consumers to re-resolve their context once the change commits"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    on_commit(_send_appointment_changed, channel_layer, instance.id, instance.call_token)
+
+
+def _send_appointment_changed(channel_layer, appointment_id, call_token):
+    event = {'type': 'appointment_changed', 'appointment_id': appointment_id}
+    group_send = async_to_sync(channel_layer.group_send)
+    group_send(f'chat_{appointment_id}', event)
+    if call_token:
+        group_send(f'video_call_{call_token}', event)
+
+
+@receiver(post_save, sender=Appointment)
+def update_slot_index(sender, instance, **kwargs):
+    on_commit(slot_index.appointment_saved, instance.id, instance.doctor_id, instance.date, instance.time, instance.status)
+
+
+@receiver(post_delete, sender=Appointment)
+def release_slot(sender, instance, **kwargs):
+    on_commit(slot_index.appointment_deleted, instance.id)
+
+
+@receiver(post_save, sender=Appointment)
+def track_call_token(sender, instance, **kwargs):
+    """Keep the token pool in step: done and cancelled appointments hand their token back"""
+    if not instance.call_token:
+        return
+    if instance.status in BOOKED_STATUSES:
+        on_commit(call_tokens.claim, instance.call_token, instance.id)
+    else:
+        on_commit(call_tokens.release, instance.call_token, instance.id)
+
+
+@receiver(post_delete, sender=Appointment)
+def release_call_token(sender, instance, **kwargs):
+    if instance.call_token:
+        on_commit(call_tokens.release, instance.call_token, instance.id)
+
+
+@receiver(post_save, sender=Availability)
+@receiver(post_delete, sender=Availability)
+def invalidate_doctor_slots(sender, instance, **kwargs):
+    on_commit(slot_index.invalidate, instance.doctor_id)
@@ -0,0 +1,265 @@
+import threading
+import time
+from collections import Counter
+from datetime import date as date_cls, datetime, time as time_cls, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from doctors.models import Availability
+from .models import BOOKED_STATUSES, Appointment
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+
+# Other workers' changes reach this process's index after at most this long
+SLOT_INDEX_TTL = 60
+
+# How far ahead next_free_slots looks before giving up
+SEARCH_HORIZON_DAYS = 90
+
+
+def _upcoming_bookings(**filters):
+    # Past bookings cannot collide with new ones, so they are not indexed
+    return Appointment.objects.filter(
+        status__in=BOOKED_STATUSES,
+        date__gte=timezone.localdate(),
+        **filters
+    )
+
+
+def slot_of(value):
+    """Index of the slot within its day that ``value`` (a time) falls in"""
+    return (value.hour * 60 + value.minute) // SLOT_MINUTES
+
+
+def slot_time(slot):
+    return time_cls(*divmod(slot * SLOT_MINUTES, 60))
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute + (value.second > 0 or value.microsecond > 0)
+
+
+def within_windows(windows, day, start):
+    """Whether ``start`` on ``day`` falls in one of the ``(day_of_week, start_time, end_time)`` windows.
+
+    Both ends of a window are bookable, as ``AppointmentForm`` has always allowed.
+    """
+    weekday = day.weekday()
+    return any(window_day == weekday and start_time <= start <= end_time for window_day, start_time, end_time in windows)
+
+
+def weekly_mask(availabilities):
+    """Bitmap of the week's slots that start inside a ``(day_of_week, start_time, end_time)`` window.
+
+    Bit ``day * SLOTS_PER_DAY + slot`` is set when that slot's start time is
+    bookable under ``within_windows``, so every slot offered from the mask
+    passes the exact check.
+    """
+    mask = 0
+    for day, start_time, end_time in availabilities:
+        first = -(-_minutes(start_time) // SLOT_MINUTES)
+        last = (end_time.hour * 60 + end_time.minute) // SLOT_MINUTES
+        if last >= first:
+            mask |= ((1 << (last - first + 1)) - 1) << (day * SLOTS_PER_DAY + first)
+    return mask
+
+
+class DoctorSlots:
+    """One doctor's availability windows and booked start times by date"""
+
+    def __init__(self, windows, bookings):
+        self.windows = list(windows)
+        self.week = weekly_mask(self.windows)
+        self.loaded_at = time.monotonic()
+        # appointment_id -> (date, time); booked[date] counts appointments per start time
+        self.bookings = {}
+        self.booked = {}
+        for appointment_id, day, start in bookings:
+            self.add(appointment_id, day, start)
+
+    def day_mask(self, day):
+        return (self.week >> (day.weekday() * SLOTS_PER_DAY)) & DAY_MASK
+
+    def available(self, day, start):
+        return within_windows(self.windows, day, start)
+
+    def add(self, appointment_id, day, start):
+        self.remove(appointment_id)
+        self.bookings[appointment_id] = (day, start)
+        self.booked.setdefault(day, Counter())[start] += 1
+
+    def remove(self, appointment_id):
+        booking = self.bookings.pop(appointment_id, None)
+        if booking is None:
+            return
+        day, start = booking
+        counts = self.booked[day]
+        counts[start] -= 1
+        if counts[start] <= 0:
+            del counts[start]
+            if not counts:
+                del self.booked[day]
+
+    def is_booked(self, day, start, exclude=None):
+        count = self.booked.get(day, {}).get(start, 0)
+        if exclude is not None and self.bookings.get(exclude) == (day, start):
+            count -= 1
+        return count > 0
+
+    def free_mask(self, day):
+        # A slot holding any booking is not offered, even one at a different minute
+        mask = self.day_mask(day)
+        for start in self.booked.get(day, ()):
+            mask &= ~(1 << slot_of(start))
+        return mask
+
+
+class SlotIndex:
+    """Per-process index of every doctor's availability and bookings.
+
+    Built lazily per doctor from ``Availability`` and booked appointments,
+    then kept current by the model signals in ``appointments.signals``. So
+    checking a time or finding the next free 15-minute slot needs no
+    queries. Entries are rebuilt after ``SLOT_INDEX_TTL`` to pick up writes
+    made by other processes.
+    """
+
+    def __init__(self, ttl=SLOT_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._doctors = {}
+        # appointment_id -> doctor_id, so an edit that changes doctor frees the old slot
+        self._owners = {}
+
+    def _load(self, doctor_id):
+        windows = Availability.objects.filter(
+            doctor_id=doctor_id,
+            is_available=True
+        ).values_list('day_of_week', 'start_time', 'end_time')
+        bookings = _upcoming_bookings(doctor_id=doctor_id).values_list('id', 'date', 'time')
+        return DoctorSlots(windows, bookings)
+
+    def doctor(self, doctor_id):
+        with self._lock:
+            slots = self._doctors.get(doctor_id)
+        if slots is None or time.monotonic() - slots.loaded_at > self.ttl:
+            slots = self._load(doctor_id)
+            with self._lock:
+                self._store(doctor_id, slots)
+        return slots
+
+    def _store(self, doctor_id, slots):
+        self._doctors[doctor_id] = slots
+        for appointment_id in slots.bookings:
+            self._owners[appointment_id] = doctor_id
+
+    def load_many(self, doctor_ids):
+        """Warm the index for several doctors with two queries in total"""
+        windows = {}
+        for doctor_id, day, start_time, end_time in Availability.objects.filter(
+            doctor_id__in=doctor_ids,
+            is_available=True
+        ).values_list('doctor_id', 'day_of_week', 'start_time', 'end_time'):
+            windows.setdefault(doctor_id, []).append((day, start_time, end_time))
+        bookings = {}
+        for appointment_id, doctor_id, day, start in _upcoming_bookings(
+            doctor_id__in=doctor_ids
+        ).values_list('id', 'doctor_id', 'date', 'time'):
+            bookings.setdefault(doctor_id, []).append((appointment_id, day, start))
+        with self._lock:
+            for doctor_id in doctor_ids:
+                self._store(doctor_id, DoctorSlots(windows.get(doctor_id, ()), bookings.get(doctor_id, ())))
+
+    def warm(self, doctor_ids):
+        """Make sure every doctor in ``doctor_ids`` has a fresh entry, loading stale ones in bulk"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [
+                doctor_id for doctor_id in doctor_ids
+                if doctor_id not in self._doctors or now - self._doctors[doctor_id].loaded_at > self.ttl
+            ]
+        if stale:
+            self.load_many(stale)
+
+    def check(self, doctor_id, day, start, exclude=None):
+        """Return why ``start`` on ``day`` cannot be booked, or None if it is free.
+
+        ``start`` must lie within an availability window, ends included, and
+        the doctor must not already have a booking at exactly that time (the
+        rule ``appointments_doctor_slot_uniq`` enforces).
+        """
+        slots = self.doctor(doctor_id)
+        if not slots.available(day, start):
+            return 'unavailable'
+        if slots.is_booked(day, start, exclude):
+            return 'booked'
+        return None
+
+    def next_free_slots(self, doctor_id, count, after=None, until=None):
+        """Return up to ``count`` free slot start datetimes, earliest first.
+
+        Searches from ``after`` (default: now) up to ``until`` or the search
+        horizon.
+        """
+        after = after or timezone.now()
+        if timezone.is_aware(after):
+            after = timezone.localtime(after).replace(tzinfo=None)
+        until = until or after.date() + timedelta(days=SEARCH_HORIZON_DAYS)
+        slots = self.doctor(doctor_id)
+        found = []
+        if not slots.week:
+            return found
+        day = after.date()
+        while day <= until and len(found) < count:
+            mask = slots.free_mask(day)
+            if day == after.date():
+                # Only slots starting after ``after``
+                mask &= ~((1 << -(-(after.hour * 60 + after.minute) // SLOT_MINUTES)) - 1)
+            while mask and len(found) < count:
+                lowest = mask & -mask
+                found.append(datetime.combine(day, slot_time(lowest.bit_length() - 1)))
+                mask ^= lowest
+            day += timedelta(days=1)
+        return found
+
+    def first_free_slot(self, doctor_id, after=None, until=None):
+        found = self.next_free_slots(doctor_id, 1, after, until)
+        return found[0] if found else None
+
+    def appointment_saved(self, appointment_id, doctor_id, day, start, status):
+        with self._lock:
+            self.appointment_deleted(appointment_id)
+            slots = self._doctors.get(doctor_id)
+            if slots is None or status not in BOOKED_STATUSES:
+                return
+            if isinstance(day, str):
+                day = date_cls.fromisoformat(day)
+            if isinstance(start, str):
+                start = time_cls.fromisoformat(start)
+            slots.add(appointment_id, day, start)
+            self._owners[appointment_id] = doctor_id
+
+    def appointment_deleted(self, appointment_id):
+        with self._lock:
+            slots = self._doctors.get(self._owners.pop(appointment_id, None))
+            if slots is not None:
+                slots.remove(appointment_id)
+
+    def invalidate(self, doctor_id=None):
+        with self._lock:
+            if doctor_id is None:
+                self._doctors.clear()
+                self._owners.clear()
+            else:
+                self._doctors.pop(doctor_id, None)
+
+
+slot_index = SlotIndex()
+
+
+def on_commit(func, *args):
+    """Apply an index update once the surrounding transaction commits"""
+    transaction.on_commit(lambda: func(*args))
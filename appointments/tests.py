@@ -0,0 +1,52 @@
+from datetime import date, datetime, time
+
+from django.test import TestCase
+
+from doctors.models import Availability
+from hospitals.models import Hospital
+from users.models import User
+from .models import Appointment
+from .slots import SlotIndex, weekly_mask
+
+# A Monday
+DAY = date(2030, 1, 7)
+
+
+class SlotIndexCheckTests(TestCase):
+    """``SlotIndex.check`` applies the booking rules ``AppointmentForm`` has always had"""
+
+    def setUp(self):
+        hospital = Hospital.objects.create(
+            name='General', address='1 Main St', contact_email='general@example.com', phone_number='555'
+        )
+        self.doctor, self.patient = User.objects.bulk_create([
+            User(username='dr_slots', role='doctor', hospital=hospital),
+            User(username='patient_slots', role='patient', hospital=hospital),
+        ])
+        Availability.objects.create(doctor=self.doctor, day_of_week=DAY.weekday(), start_time=time(9), end_time=time(11))
+        self.booked = Appointment.objects.bulk_create([Appointment(
+            doctor=self.doctor, patient=self.patient, hospital=hospital, date=DAY, time=time(10)
+        )])[0]
+        self.index = SlotIndex()
+
+    def check(self, start, exclude=None):
+        return self.index.check(self.doctor.id, DAY, start, exclude=exclude)
+
+    def test_both_ends_of_a_window_are_bookable(self):
+        self.assertIsNone(self.check(time(9)))
+        self.assertIsNone(self.check(time(11)))
+        self.assertEqual(self.check(time(8, 55)), 'unavailable')
+        self.assertEqual(self.check(time(11, 1)), 'unavailable')
+
+    def test_only_the_exact_time_conflicts(self):
+        self.assertEqual(self.check(time(10)), 'booked')
+        self.assertIsNone(self.check(time(10, 5)))
+        self.assertIsNone(self.check(time(10), exclude=self.booked.id))
+
+    def test_offered_slots_start_inside_a_window(self):
+        # 9:10-9:40 offers 9:15 and 9:30, never the 9:00 slot it overlaps
+        self.assertEqual(weekly_mask([(0, time(9, 10), time(9, 40))]), 0b11 << 37)
+        self.assertEqual(
+            [slot.time() for slot in self.index.next_free_slots(self.doctor.id, 3, after=datetime(2030, 1, 6, 12))],
+            [time(9), time(9, 15), time(9, 30)],
+        )
@@ -2,9 +2,20 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime
+from telemedicine.jsoncodec import JsonResponse, loads
 from .models import Appointment, AppointmentRequest
+from .booking import BookingConflict, approve_request, book
+from .bulk import schedule_batch
+from .call_tokens import CallTokensExhausted
 from .forms import AppointmentForm
+from .slots import slot_index
 from users.models import User
+from notifications.models import Notification
+from notifications.stream import appointment_notifications, publish, request_notifications
+
+MAX_FREE_SLOTS = 50
 
 @login_required
 def create_appointment(request):
@@ -20,9 +31,13 @@ def create_appointment(request):
             # Set hospital based on doctor
             appointment.hospital = appointment.doctor.hospital
             appointment.created_by = request.user
-            appointment.save()
-            messages.success(request, f"Appointment created successfully for {appointment.patient.get_full_name() or appointment.patient.username} with Dr. {appointment.doctor.get_full_name() or appointment.doctor.username}.")
-            return redirect('appointment_list')
+            try:
+                book(appointment)
+            except BookingConflict as e:
+                form.add_error(None, str(e))
+            else:
+                messages.success(request, f"Appointment created successfully for {appointment.patient.get_full_name() or appointment.patient.username} with Dr. {appointment.doctor.get_full_name() or appointment.doctor.username}.")
+                return redirect('appointment_list')
     else:
         form = AppointmentForm(user=request.user)
 
@@ -49,9 +64,13 @@ def edit_appointment(request, appointment_id):
         if form.is_valid():
             appointment = form.save(commit=False)
             appointment.hospital = appointment.doctor.hospital
-            appointment.save()
-            messages.success(request, "Appointment updated successfully.")
-            return redirect('appointment_list')
+            try:
+                book(appointment)
+            except BookingConflict as e:
+                form.add_error(None, str(e))
+            else:
+                messages.success(request, "Appointment updated successfully.")
+                return redirect('appointment_list')
     else:
         form = AppointmentForm(instance=appointment, user=request.user)
 
@@ -83,6 +102,7 @@ def cancel_appointment(request, appointment_id):
     if request.method == 'POST':
         appointment.status = 'cancelled'
         appointment.save()
+        publish(appointment_notifications(appointment, Notification.Kind.APPOINTMENT_CANCELLED, actor=request.user))
         messages.success(request, "Appointment cancelled successfully.")
         return redirect('appointment_list')
 
@@ -137,27 +157,14 @@ def handle_request(request, request_id):
         action = request.POST.get('action')
         
         if action == 'approve':
-            # Generate 4-digit token
-            call_token = str(random.randint(1000, 9999))
-            
-            # Create actual appointment
-            appointment = Appointment.objects.create(
-                doctor=appointment_request.doctor,
-                patient=appointment_request.patient,
-                hospital=appointment_request.doctor.hospital,
-                date=appointment_request.requested_date,
-                time=appointment_request.requested_time,
-                notes=appointment_request.message,
-                created_by=appointment_request.requested_by,
-                call_token=call_token
-            )
-            
-            appointment_request.status = 'approved'
-            appointment_request.approved_date = appointment_request.requested_date
-            appointment_request.approved_time = appointment_request.requested_time
-            appointment_request.save()
-            
-            messages.success(request, 'Appointment request approved!')
+            # Create actual appointment with a call token from the pool
+            try:
+                appointment = approve_request(appointment_request)
+            except (BookingConflict, CallTokensExhausted) as e:
+                messages.error(request, f'Could not approve request: {e}')
+            else:
+                publish(request_notifications(appointment_request, Notification.Kind.REQUEST_APPROVED, appointment))
+                messages.success(request, 'Appointment request approved!')
             
         elif action == 'modify':
             new_date = request.POST.get('new_date')
@@ -169,6 +176,7 @@ def handle_request(request, request_id):
             appointment_request.approved_time = new_time
             appointment_request.doctor_response = doctor_response
             appointment_request.save()
+            publish(request_notifications(appointment_request, Notification.Kind.REQUEST_MODIFIED))
             
             messages.success(request, 'Appointment request modified!')
             
@@ -177,6 +185,7 @@ def handle_request(request, request_id):
             appointment_request.status = 'rejected'
             appointment_request.doctor_response = doctor_response
             appointment_request.save()
+            publish(request_notifications(appointment_request, Notification.Kind.REQUEST_REJECTED))
             
             messages.success(request, 'Appointment request rejected!')
         
@@ -198,10 +207,62 @@ def mark_as_done(request, appointment_id):
         appointment.consultation_notes = consultation_notes
         appointment.status = 'done'
         appointment.save()
+        publish(appointment_notifications(appointment, Notification.Kind.APPOINTMENT_DONE, actor=request.user))
         
         messages.success(request, 'Appointment marked as done!')
         return redirect('dashboard_redirect')
     
     return render(request, 'appointments/mark_as_done.html', {
         'appointment': appointment
-    })
\ No newline at end of file
+    })
+
+@login_required
+def free_slots(request, doctor_id):
+    """Next free slots for a doctor: ``?count=5&after=YYYY-MM-DD``"""
+    doctor = get_object_or_404(User, id=doctor_id, role='doctor')
+    try:
+        count = min(int(request.GET.get('count', 5)), MAX_FREE_SLOTS)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid count'}, status=400)
+    after = None
+    if request.GET.get('after'):
+        after_date = parse_date(request.GET['after'])
+        if after_date is None:
+            return JsonResponse({'error': 'Invalid date'}, status=400)
+        after = max(datetime.combine(after_date, datetime.min.time()), timezone.localtime().replace(tzinfo=None))
+
+    slots = slot_index.next_free_slots(doctor.id, count, after=after)
+    return JsonResponse({
+        'doctor_id': doctor.id,
+        'slots': [{'date': slot.date(), 'time': slot.time().strftime('%H:%M')} for slot in slots],
+    })
+
+
+@login_required
+def bulk_schedule(request):
+    """Book many appointments at once: ``{appointments: [{doctor, patient, date, time, notes}], dry_run}``.
+
+    Responds with an accepted/rejected entry for every row, in order.
+    """
+    if request.user.role not in ['admin', 'superadmin']:
+        return JsonResponse({'success': False, 'error': 'Access denied'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request'})
+    try:
+        data = loads(request.body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get('appointments'), list):
+        return JsonResponse({'success': False, 'error': 'Invalid request'})
+
+    try:
+        report = schedule_batch(data['appointments'], created_by=request.user, dry_run=bool(data.get('dry_run')))
+    except (ValueError, BookingConflict) as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+    accepted = sum(1 for row in report if row['status'] == 'accepted')
+    return JsonResponse({
+        'success': True,
+        'accepted': accepted,
+        'rejected': len(report) - accepted,
+        'rows': report,
+    })
@@ -0,0 +1,275 @@
+"""
+Compare channel layer latency and throughput.
+
+Sends ``--messages`` group_send events to each of ``--rooms`` groups that
+have ``--group-size`` receivers each. Reports delivered messages/s and
+p50/p99 delivery latency. For cross-process layers the receivers are spread
+over ``--processes`` worker processes, like ASGI workers. The in-memory
+layer can only run receivers in the sender's process.
+
+``--profile chat`` sends ChatConsumer ``chat_message`` events to
+``chat_<id>`` groups. ``--profile signal`` sends the VideoCallConsumer mailbox
+mix of SDP offers/answers and small ICE candidates to ``video_call_<token>``
+groups.
+
+Redis layers use ``--redis-url`` (repeat it for more shards). Use
+``--fakeredis N`` to start N in-process fakeredis TCP shards so the
+benchmark also runs offline without redis-server. fakeredis is pure
+Python and emulates blocking pops slowly, so treat its numbers as a
+functional check. Compare layers against a real redis-server.
+
+    python bench_channel_layers.py --layer memory --layer unix
+    python bench_channel_layers.py --layer redis --layer redis-pubsub --fakeredis 2 --profile signal
+"""
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from channels.layers import InMemoryChannelLayer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from telemedicine.channel_layers import UnixSocketChannelLayer  # noqa: E402
+from telemedicine.jsoncodec import dumps  # noqa: E402
+
+CAPACITY = 100000
+LAYERS = ['memory', 'unix', 'redis', 'redis-pubsub']
+
+# Rough sizes of real signaling frames
+SDP_BYTES = 3000
+ICE_CANDIDATE_BYTES = 250
+
+
+def make_layer(name, options):
+    if name == 'memory':
+        return InMemoryChannelLayer(capacity=CAPACITY)
+    if name == 'unix':
+        return UnixSocketChannelLayer(path=options['socket'], capacity=CAPACITY)
+    if name == 'redis':
+        from telemedicine.channel_layers import ShardedRedisChannelLayer
+        return ShardedRedisChannelLayer(hosts=options['redis_urls'], capacity=CAPACITY)
+    if name == 'redis-pubsub':
+        from telemedicine.channel_layers import ShardedRedisPubSubChannelLayer
+        return ShardedRedisPubSubChannelLayer(hosts=options['redis_urls'])
+    raise ValueError(f'Unknown layer {name}')
+
+
+def group_name(profile, room):
+    if profile == 'signal':
+        return f'video_call_{1000 + room}'
+    return f'chat_{room}'
+
+
+def make_event(profile, sequence, payload):
+    if profile == 'signal':
+        # Roughly one offer/answer per ten trickle ICE candidates
+        if sequence % 10 == 0:
+            message = {'type': 'offer' if sequence % 20 == 0 else 'answer', 'sdp': 'v' * SDP_BYTES}
+        else:
+            message = {'type': 'ice-candidate', 'candidate': 'c' * ICE_CANDIDATE_BYTES}
+        return {
+            'type': 'signal_message',
+            'text': dumps({**message, 'seq': sequence, 'sender_id': 1}),
+            'recipient_id': 2,
+            'sender_id': 1,
+            'seq': sequence,
+            'sent': time.time(),
+        }
+    return {
+        'type': 'chat_message',
+        'text': dumps({
+            'message': payload,
+            'username': 'doctor',
+            'user_id': 1,
+            'timestamp': '2026-01-01 09:00:00',
+            'seq': sequence,
+        }),
+        'sent': time.time(),
+    }
+
+
+async def run_receivers(layer, groups, messages, timeout, on_ready=None):
+    """Join one channel per entry in ``groups`` and collect delivery latencies"""
+    channels = []
+    for group in groups:
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        channels.append(channel)
+    if on_ready is not None:
+        on_ready()
+
+    latencies = []
+    last_seen = [0.0]
+
+    async def drain(channel):
+        for _ in range(messages):
+            event = await layer.receive(channel)
+            now = time.time()
+            latencies.append(now - event['sent'])
+            last_seen[0] = max(last_seen[0], now)
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*(drain(channel) for channel in channels)), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return latencies, last_seen[0]
+
+
+def _receiver_process(layer_name, options, groups, messages, timeout, ready, results):
+    async def main():
+        layer = make_layer(layer_name, options)
+        return await run_receivers(layer, groups, messages, timeout, on_ready=lambda: ready.put(True))
+
+    results.put(asyncio.run(main()))
+
+
+async def send_all(layer, profile, rooms, messages, payload, rate=0):
+    start = time.time()
+    targets = [group_name(profile, room) for room in range(rooms)]
+    for sequence in range(messages * rooms):
+        group = targets[sequence % rooms]
+        await layer.group_send(group, make_event(profile, sequence // rooms, payload))
+        if rate:
+            # Pace to the target rate so latency isn't just queueing delay
+            delay = start + (sequence + 1) / rate - time.time()
+            await asyncio.sleep(max(delay, 0))
+        elif sequence % 100 == 0:
+            await asyncio.sleep(0)
+    return start
+
+
+def receiver_groups(profile, rooms, group_size):
+    return [group_name(profile, room) for room in range(rooms) for _ in range(group_size)]
+
+
+async def bench_in_process(layer_name, options, args, group_size, payload):
+    layer = make_layer(layer_name, options)
+    ready = asyncio.Event()
+    groups = receiver_groups(args.profile, args.rooms, group_size)
+    receivers = asyncio.ensure_future(run_receivers(layer, groups, args.messages, args.timeout, on_ready=ready.set))
+    await ready.wait()
+    start = await send_all(layer, args.profile, args.rooms, args.messages, payload, args.rate)
+    latencies, finished = await receivers
+    return start, finished, latencies
+
+
+def bench_multi_process(layer_name, options, args, group_size, payload):
+    context = multiprocessing.get_context('spawn')
+    ready, results = context.Queue(), context.Queue()
+    groups = receiver_groups(args.profile, args.rooms, group_size)
+    shares = [groups[i::args.processes] for i in range(args.processes)]
+    workers = [
+        context.Process(
+            target=_receiver_process,
+            args=(layer_name, options, share, args.messages, args.timeout, ready, results),
+        )
+        for share in shares if share
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get(timeout=30)
+
+    async def send():
+        layer = make_layer(layer_name, options)
+        # Give the layer a moment to register every group_add
+        await asyncio.sleep(0.2)
+        return await send_all(layer, args.profile, args.rooms, args.messages, payload, args.rate)
+
+    start = asyncio.run(send())
+    latencies, finished = [], 0.0
+    for _ in workers:
+        worker_latencies, worker_finished = results.get(timeout=args.timeout + 30)
+        latencies.extend(worker_latencies)
+        finished = max(finished, worker_finished)
+    for worker in workers:
+        worker.join()
+    return start, finished, latencies
+
+
+def start_fakeredis(count):
+    """Start ``count`` fakeredis TCP servers on free ports and return their URLs"""
+    from fakeredis import TcpFakeServer
+
+    urls = []
+    for _ in range(count):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls.append(f'redis://127.0.0.1:{port}')
+    return urls
+
+
+def report(label, profile, rooms, group_size, messages, start, finished, latencies):
+    expected = rooms * group_size * messages
+    prefix = f'{label:<30} {profile:<6} rooms={rooms:<3} group={group_size:<3}'
+    if not latencies:
+        print(f'{prefix} delivered 0/{expected}')
+        return
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    rate = len(latencies) / max(finished - start, 1e-9)
+    print(
+        f'{prefix} delivered {len(latencies)}/{expected} '
+        f'{rate:>10.0f} msg/s  p50 {p50:7.2f} ms  p99 {p99:7.2f} ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layer', action='append', choices=LAYERS,
+                        help='Layer to benchmark (repeatable, default: memory and unix)')
+    parser.add_argument('--profile', action='append', choices=['chat', 'signal'],
+                        help='Traffic shape (repeatable, default: chat)')
+    parser.add_argument('--messages', type=int, default=2000, help='Events sent to each room')
+    parser.add_argument('--rooms', type=int, default=1, help='Number of groups to spread traffic over')
+    parser.add_argument('--group-size', type=int, action='append', help='Receivers per group (repeatable)')
+    parser.add_argument('--processes', type=int, default=2, help='Receiver processes for cross-process layers')
+    parser.add_argument('--payload-bytes', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=0, help='Messages/s to send at (0 = as fast as possible)')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--socket', default=os.path.join(tempfile.mkdtemp(), 'channels.sock'))
+    parser.add_argument('--redis-url', action='append', help='Redis shard URL (repeatable)')
+    parser.add_argument('--fakeredis', type=int, default=0, metavar='N',
+                        help='Start N in-process fakeredis shards instead of using --redis-url')
+    args = parser.parse_args()
+
+    layers = args.layer or ['memory', 'unix']
+    profiles = args.profile or ['chat']
+    group_sizes = args.group_size or [1, 2, 10]
+    payload = 'x' * args.payload_bytes
+
+    if args.fakeredis:
+        redis_urls = start_fakeredis(args.fakeredis)
+    else:
+        redis_urls = args.redis_url or ['redis://localhost:6379']
+    options = {'socket': args.socket, 'redis_urls': redis_urls}
+
+    for layer_name, profile, group_size in itertools.product(layers, profiles, group_sizes):
+        run_args = argparse.Namespace(**{**vars(args), 'profile': profile})
+        if layer_name == 'memory':
+            label = 'memory (1 process)'
+            start, finished, latencies = asyncio.run(
+                bench_in_process(layer_name, options, run_args, group_size, payload)
+            )
+        else:
+            label = f'{layer_name} ({args.processes} processes)'
+            if layer_name.startswith('redis'):
+                label = f'{layer_name} x{len(redis_urls)} ({args.processes} proc)'
+            start, finished, latencies = bench_multi_process(layer_name, options, run_args, group_size, payload)
+        report(label, profile, args.rooms, group_size, args.messages, start, finished, latencies)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import CallParticipant
 
-# Register your models here.
+@admin.register(CallParticipant)
+class CallParticipantAdmin(admin.ModelAdmin):
+    list_display = ('appointment', 'user', 'role', 'created_at')
+    list_filter = ('role',)
+    raw_id_fields = ('appointment', 'user')
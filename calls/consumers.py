@@ -1,31 +1,93 @@
-import json
+import asyncio
+import time
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from appointments.models import Appointment
+from telemedicine.jsoncodec import dumps, loads
+from .participants import resolve_call_context, signal_recipient
+from .presence import presence
+from .telemetry import parse_samples, telemetry
+from .signaling import (
+    ICE_BATCH_TYPE, ICE_COALESCE_WINDOW, ICE_TYPES, MAX_SIGNAL_BYTES,
+    pending_signals, post_signal, room_bucket, send_signal_event, signal_event, validate_signal,
+)
 
 class VideoCallConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_token = self.scope['url_route']['kwargs']['token']
         self.room_group_name = f'video_call_{self.room_token}'
+        self.user = self.scope['user']
+
+        # Only the appointment's doctor, patient and invited participants may join the call
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.context, self.participants = await self.resolve_context()
+        if self.context is None:
+            await self.close()
+            return
         
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        self.in_group = True
         
         await self.accept()
         
+        self.bucket = room_bucket(self.room_token)
+        self.ice_pending = {}
+        self.ice_type = ICE_TYPES[0]
+        self.ice_sender = None
+        self.ice_next_send = 0.0
+        self.forward_lock = asyncio.Lock()
+        self.signals_sent = False
+        self.known_channels = set()
+        
+        # Replay anything queued while this client was away (?cursor=<last seq seen>).
+        # Each sender's frames arrive in seq order, so dedup is tracked per sender.
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            self.signal_cursor = int(query.get('cursor', ['0'])[0])
+        except ValueError:
+            self.signal_cursor = 0
+        self.signal_cursors = {}
+        await self.replay_signals()
+        
+        # Register presence; only this worker persists the transition
+        self.appointment_id = self.context.appointment_id
+        self.role = self.context.user_role
+        self.lobby_state = None
+        if presence.touch(self.room_token, self.channel_name, self.role, self.user.id):
+            presence.record(self.appointment_id, self.room_token, self.role, joined=True)
+        await self.announce_presence('join')
+        
         # Notify others that user joined
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'user_joined',
-                'user_id': self.scope['user'].id if self.scope['user'].is_authenticated else None
+                'text': dumps({'type': 'user_joined', 'user_id': self.user.id})
             }
         )
 
     async def disconnect(self, close_code):
+        ice_sender = getattr(self, 'ice_sender', None)
+        if ice_sender is not None:
+            ice_sender.cancel()
+
+        if getattr(self, 'role', None) is not None:
+            if presence.remove(self.room_token, self.channel_name):
+                presence.record(self.appointment_id, self.room_token, self.role, joined=False)
+            await self.announce_presence('leave')
+
+        # The context may have been dropped by appointment_changed; leave the group regardless
+        if not getattr(self, 'in_group', False):
+            return
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -37,37 +99,187 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 'type': 'user_left',
-                'user_id': self.scope['user'].id if self.scope['user'].is_authenticated else None
+                'text': dumps({'type': 'user_left', 'user_id': self.user.id})
             }
         )
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        message_type = data.get('type')
+        if text_data is None or len(text_data) > MAX_SIGNAL_BYTES:
+            await self.send_error('Signal too large')
+            return
+        try:
+            data = loads(text_data)
+        except ValueError:
+            await self.send_error('Invalid JSON')
+            return
+        message_type = data.get('type') if isinstance(data, dict) else None
+        
+        if message_type == 'heartbeat':
+            presence.touch(self.room_token, self.channel_name, self.role, self.user.id)
+            for role in presence.sweep(self.room_token):
+                presence.record(self.appointment_id, self.room_token, role, joined=False)
+            # Keep this connection alive in the other workers' registries too
+            await self.announce_presence('refresh')
+            return
+        
+        if message_type == 'stats':
+            # Batched getStats() samples for call quality telemetry
+            samples = parse_samples(data.get('samples'))
+            if samples is None:
+                await self.send_error('Invalid stats samples')
+                return
+            telemetry.add(self.appointment_id, samples)
+            return
         
-        # Forward WebRTC signaling messages to other participants
+        error = validate_signal(data)
+        if error:
+            await self.send_error(error)
+            return
+        recipient_id = signal_recipient(self.participants, self.user.id, data.pop('to', None))
+        if recipient_id is None:
+            await self.send_error('Unknown recipient')
+            return
+        
+        if message_type in ICE_TYPES:
+            # Trickle candidates are batched per recipient; see send_ice_candidates
+            self.ice_type = message_type
+            self.ice_pending.setdefault(recipient_id, []).append(data['candidate'])
+            if self.ice_sender is None or self.ice_sender.done():
+                self.ice_sender = asyncio.ensure_future(self.send_ice_candidates())
+            return
+        
+        # Candidates queued so far must reach the peer before this frame
+        if self.ice_pending:
+            await self.flush_ice_candidates()
+        if not self.bucket.try_take():
+            await self.send_error('Rate limit exceeded')
+            return
+        await self.forward_signal(recipient_id, data)
+
+    async def send_ice_candidates(self):
+        """Forward queued candidates, at most one frame per coalescing window.
+
+        The first candidate after a quiet window goes out immediately so call
+        setup is not delayed; the rest of a burst is merged into one frame.
+        Candidates are held back, never dropped, while the room is over its
+        rate limit.
+        """
+        while self.ice_pending:
+            delay = max(self.ice_next_send - time.monotonic(), self.bucket.delay())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self.bucket.try_take()
+            await self.flush_ice_candidates()
+
+    async def flush_ice_candidates(self):
+        pending, self.ice_pending = self.ice_pending, {}
+        self.ice_next_send = time.monotonic() + ICE_COALESCE_WINDOW
+        for recipient_id, candidates in pending.items():
+            if len(candidates) == 1:
+                data = {'type': self.ice_type, 'candidate': candidates[0]}
+            else:
+                data = {'type': ICE_BATCH_TYPE, 'candidates': candidates}
+            await self.forward_signal(recipient_id, data)
+
+    async def forward_signal(self, recipient_id, data):
+        # Serialized so frames reach the peer in mailbox (seq) order, which the
+        # client relies on to skip replays
+        async with self.forward_lock:
+            # Queue in the peer's mailbox first so it survives a missed delivery
+            signal_id, frame = await self.post_signal(recipient_id, data)
+            self.signals_sent = True
+            # Addressed to the recipient's own channels, not fanned out to the room
+            await send_signal_event(
+                self.channel_layer,
+                self.room_token,
+                recipient_id,
+                signal_event(recipient_id, self.user.id, signal_id, frame)
+            )
+
+    async def send_error(self, error):
+        await self.send(text_data=dumps({'type': 'error', 'error': error}))
+
+    async def signal_message(self, event):
+        # Group-routed fallback events reach every participant; direct sends only the recipient
+        if event['recipient_id'] == self.user.id:
+            await self.deliver_signal(event['sender_id'], event['seq'], event['text'])
+
+    async def signal_resync(self, event):
+        # A peer just learned about this connection; fetch what it queued before then
+        await self.replay_signals(event['sender_id'])
+
+    async def replay_signals(self, sender_id=None):
+        cursor = self.signal_cursor if sender_id is None else self.signal_cursors.get(sender_id, self.signal_cursor)
+        for signal_id, sender, frame in await self.get_pending_signals(cursor, sender_id):
+            await self.deliver_signal(sender, signal_id, frame)
+
+    async def deliver_signal(self, sender_id, signal_id, frame):
+        # Live delivery and replays can overlap; send each seq once
+        if signal_id > self.signal_cursors.get(sender_id, self.signal_cursor):
+            self.signal_cursors[sender_id] = signal_id
+            await self.send(text_data=frame)
+
+    async def announce_presence(self, action):
         await self.channel_layer.group_send(
             self.room_group_name,
             {
-                'type': 'webrtc_signal',
-                'message': data,
-                'sender_channel': self.channel_name
+                'type': 'presence_changed',
+                'action': action,
+                'role': self.role,
+                'user_id': self.user.id,
+                'channel': self.channel_name
             }
         )
 
-    async def webrtc_signal(self, event):
-        # Don't send message back to sender
-        if event['sender_channel'] != self.channel_name:
-            await self.send(text_data=json.dumps(event['message']))
+    async def presence_changed(self, event):
+        channel_name = event['channel']
+        if channel_name != self.channel_name:
+            # Mirror connections hosted by other workers
+            if event['action'] == 'leave':
+                presence.remove(self.room_token, channel_name)
+                self.known_channels.discard(channel_name)
+            else:
+                presence.touch(self.room_token, channel_name, event['role'], event['user_id'])
+                if channel_name not in self.known_channels:
+                    self.known_channels.add(channel_name)
+                    if self.signals_sent and event['user_id'] != self.user.id:
+                        # Signals sent before this connection was known only reached the mailbox
+                        await self.channel_layer.send(
+                            channel_name,
+                            {'type': 'signal_resync', 'sender_id': self.user.id}
+                        )
+            if event['action'] == 'join':
+                # Let the newcomer's worker learn about this connection
+                await self.announce_presence('refresh')
+        await self.send_lobby_state()
+
+    async def send_lobby_state(self):
+        state = presence.state(self.room_token)
+        if state is not None and state != self.lobby_state:
+            self.lobby_state = state
+            await self.send(text_data=dumps({'type': 'lobby_state', **state}))
 
     async def user_joined(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_joined',
-            'user_id': event['user_id']
-        }))
+        await self.send(text_data=event['text'])
 
     async def user_left(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_left',
-            'user_id': event['user_id']
-        }))
\ No newline at end of file
+        await self.send(text_data=event['text'])
+
+    async def appointment_changed(self, event):
+        # Appointment was edited, cancelled or rescheduled - re-resolve
+        self.context, self.participants = await self.resolve_context()
+        if self.context is None:
+            await self.close()
+
+    @database_sync_to_async
+    def resolve_context(self):
+        return resolve_call_context(self.user, self.room_token)
+
+    @database_sync_to_async
+    def post_signal(self, recipient_id, data):
+        return post_signal(self.context.appointment_id, self.user.id, recipient_id, data)
+
+    @database_sync_to_async
+    def get_pending_signals(self, cursor, sender_id=None):
+        return pending_signals(self.context.appointment_id, self.user.id, cursor, sender_id)
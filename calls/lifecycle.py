@@ -0,0 +1,56 @@
+from django.db.models import DurationField, ExpressionWrapper, F, Value
+from django.utils import timezone
+
+from appointments.models import Appointment
+from .models import CallSession, VideoCall
+
+OPEN_STATUSES = (VideoCall.Status.INITIATED, VideoCall.Status.ACTIVE)
+
+
+def sync_call_status(appointment_ids):
+    """Move each appointment's VideoCall along with who is in the room.
+
+    Called with the appointments whose presence just changed. A call goes
+    active once both the doctor and the patient are connected (calls started
+    straight from the lobby get a VideoCall here) and ends, with its
+    duration, when either of them leaves.
+    """
+    sessions = CallSession.objects.filter(appointment_id__in=appointment_ids).values_list(
+        'appointment_id', 'doctor_joined', 'patient_joined'
+    )
+    connected = [appointment_id for appointment_id, doctor, patient in sessions if doctor and patient]
+    departed = set(appointment_ids) - set(connected)
+    now = timezone.now()
+
+    if connected:
+        VideoCall.objects.filter(
+            appointment_id__in=connected,
+            status=VideoCall.Status.INITIATED
+        ).update(status=VideoCall.Status.ACTIVE, answered_at=now)
+        open_calls = set(VideoCall.objects.filter(
+            appointment_id__in=connected,
+            status__in=OPEN_STATUSES
+        ).values_list('appointment_id', flat=True))
+        missing = Appointment.objects.filter(
+            id__in=set(connected) - open_calls
+        ).values_list('id', 'doctor_id', 'patient_id')
+        VideoCall.objects.bulk_create([
+            VideoCall(
+                appointment_id=appointment_id,
+                caller_id=doctor_id,
+                receiver_id=patient_id,
+                status=VideoCall.Status.ACTIVE,
+                answered_at=now
+            )
+            for appointment_id, doctor_id, patient_id in missing
+        ])
+
+    if departed:
+        VideoCall.objects.filter(
+            appointment_id__in=departed,
+            status=VideoCall.Status.ACTIVE
+        ).update(
+            status=VideoCall.Status.ENDED,
+            ended_at=now,
+            duration=ExpressionWrapper(Value(now) - F('answered_at'), output_field=DurationField())
+        )
@@ -0,0 +1,56 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from appointments.models import Appointment
+from calls.models import AgoraToken, CallSession
+from calls.tokens import ANY_UID, call_channel_name, token_cache
+
+ACTIVE_STATUSES = [Appointment.Status.SCHEDULED, Appointment.Status.RESCHEDULED]
+
+
+class Command(BaseCommand):
+    help = "Pre-issue Agora tokens and call sessions for a day's scheduled appointments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', default=None, help='Day to prepare (YYYY-MM-DD, default: today)')
+
+    def handle(self, *args, **options):
+        try:
+            day = date.fromisoformat(options['date']) if options['date'] else timezone.localdate()
+        except ValueError:
+            raise CommandError('--date must be YYYY-MM-DD')
+
+        appointments = list(
+            Appointment.objects.filter(date=day, status__in=ACTIVE_STATUSES)
+            .exclude(call_token__isnull=True).exclude(call_token='')
+            .values_list('id', 'call_token', 'doctor_id', 'patient_id')
+        )
+
+        keys = []
+        for _, call_token, doctor_id, patient_id in appointments:
+            channel_name = call_channel_name(call_token)
+            keys.extend([(channel_name, doctor_id), (channel_name, patient_id), (channel_name, ANY_UID)])
+        tokens = token_cache.get_many(keys)
+
+        existing = set(CallSession.objects.filter(
+            appointment_id__in=[appointment_id for appointment_id, _, _, _ in appointments]
+        ).values_list('appointment_id', flat=True))
+        sessions = [
+            CallSession(
+                appointment_id=appointment_id,
+                channel_name=call_channel_name(call_token),
+                agora_token=tokens.get((call_channel_name(call_token), ANY_UID), ''),
+            )
+            for appointment_id, call_token, _, _ in appointments
+            if appointment_id not in existing
+        ]
+        CallSession.objects.bulk_create(sessions, ignore_conflicts=True)
+
+        expired, _ = AgoraToken.objects.filter(expires_at__lt=timezone.now()).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Prepared {len(appointments)} calls for {day}: {len(tokens)} tokens ready, '
+            f'{len(sessions)} sessions created, {expired} expired tokens removed'
+        ))
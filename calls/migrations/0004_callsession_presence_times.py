@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0003_signalmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='callsession',
+            name='doctor_joined_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='callsession',
+            name='doctor_left_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='callsession',
+            name='patient_joined_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='callsession',
+            name='patient_left_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
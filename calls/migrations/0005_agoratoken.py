@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calls', '0004_callsession_presence_times'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgoraToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_name', models.CharField(max_length=200)),
+                ('uid', models.PositiveIntegerField()),
+                ('token', models.TextField()),
+                ('expires_at', models.DateTimeField()),
+                ('issued_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('channel_name', 'uid'), name='calls_agora_token_channel_uid_uniq')],
+            },
+        ),
+    ]
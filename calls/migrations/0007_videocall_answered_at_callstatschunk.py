@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_appointment_call_token'),
+        ('calls', '0006_callparticipant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videocall',
+            name='answered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='CallStatsChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sample_count', models.PositiveIntegerField()),
+                ('first_sample_at', models.DateTimeField()),
+                ('last_sample_at', models.DateTimeField()),
+                ('columns', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='call_stats', to='appointments.appointment')),
+            ],
+        ),
+    ]
@@ -32,6 +32,7 @@ class VideoCall(models.Model):
         default=Status.INITIATED
     )
     started_at = models.DateTimeField(auto_now_add=True)
+    answered_at = models.DateTimeField(null=True, blank=True)
     ended_at = models.DateTimeField(null=True, blank=True)
     duration = models.DurationField(null=True, blank=True)
     
@@ -51,7 +52,109 @@ class CallSession(models.Model):
     agora_token = models.TextField()
     doctor_joined = models.BooleanField(default=False)
     patient_joined = models.BooleanField(default=False)
+    # Last lobby/call join and leave times, persisted in batches from presence
+    doctor_joined_at = models.DateTimeField(null=True, blank=True)
+    doctor_left_at = models.DateTimeField(null=True, blank=True)
+    patient_joined_at = models.DateTimeField(null=True, blank=True)
+    patient_left_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"Session: {self.appointment.call_token} - {self.channel_name}"
+
+class SignalMessage(models.Model):
+    """A WebRTC signaling frame queued for one participant of a call.
+
+    Rows form an ordered per-recipient mailbox (by id) that survives worker
+    hops and reconnects; they are pruned once older than the signaling TTL.
+    """
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name='signals'
+    )
+    sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    recipient = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    kind = models.CharField(max_length=20)
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['appointment', 'recipient', 'id'], name='calls_signal_mailbox_idx'),
+        ]
+
+    def __str__(self):
+        return f"Signal {self.kind}: {self.sender_id} -> {self.recipient_id} (appointment {self.appointment_id})"
+
+class AgoraToken(models.Model):
+    """An issued Agora RTC token, shared by every worker until it nears expiry"""
+    channel_name = models.CharField(max_length=200)
+    uid = models.PositiveIntegerField()
+    token = models.TextField()
+    expires_at = models.DateTimeField()
+    issued_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['channel_name', 'uid'], name='calls_agora_token_channel_uid_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Agora token: {self.channel_name} uid {self.uid} (expires {self.expires_at})"
+
+class CallParticipant(models.Model):
+    """Someone besides the doctor and patient invited to an appointment's call"""
+    class Role(models.TextChoices):
+        INTERPRETER = "interpreter", "Interpreter"
+        SPECIALIST = "specialist", "Specialist"
+
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name='call_participants'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='call_invitations'
+    )
+    role = models.CharField(max_length=20, choices=Role.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['appointment', 'user'], name='calls_participant_appointment_user_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} ({self.role}) in call for appointment {self.appointment_id}"
+
+class CallStatsChunk(models.Model):
+    """A batch of WebRTC ``getStats()`` samples for one call, stored column-wise.
+
+    ``columns`` holds the packed arrays written by ``calls.telemetry.SampleColumns``:
+    the sample timestamps followed by one array per quality metric.
+    """
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name='call_stats'
+    )
+    sample_count = models.PositiveIntegerField()
+    first_sample_at = models.DateTimeField()
+    last_sample_at = models.DateTimeField()
+    columns = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.sample_count} call stats samples for appointment {self.appointment_id}"
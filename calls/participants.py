@@ -0,0 +1,64 @@
+from appointments.call_tokens import by_call_token
+from appointments.context import AppointmentContext, resolve_appointment_context
+from appointments.models import Appointment
+from .models import CallParticipant
+
+
+def call_participants(appointment_id, doctor_id, patient_id):
+    """Map every user allowed in the call to their role"""
+    participants = dict(
+        CallParticipant.objects.filter(appointment_id=appointment_id).values_list('user_id', 'role')
+    )
+    participants[doctor_id] = 'doctor'
+    participants[patient_id] = 'patient'
+    return participants
+
+
+def call_role(appointment, user):
+    """``user``'s role in ``appointment``'s call, or None if they may not join it"""
+    return call_participants(appointment.id, appointment.doctor_id, appointment.patient_id).get(user.id)
+
+
+def resolve_call_context(user, call_token):
+    """Resolve the call's appointment for ``user``, admitting invited participants.
+
+    Returns ``(context, participants)``, or ``(None, {})`` if the user may not
+    join. Invited participants get their ``CallParticipant`` role as
+    ``user_role``.
+    """
+    context = resolve_appointment_context(user, **by_call_token(call_token))
+    if context is None:
+        appointment = Appointment.objects.filter(
+            call_participants__user=user,
+            **by_call_token(call_token)
+        ).values('id', 'doctor_id', 'patient_id', 'status', 'call_participants__role').first()
+        if appointment is None:
+            return None, {}
+        context = AppointmentContext(
+            appointment_id=appointment['id'],
+            doctor_id=appointment['doctor_id'],
+            patient_id=appointment['patient_id'],
+            chat_room_id=None,
+            call_token=call_token,
+            status=appointment['status'],
+            user_role=appointment['call_participants__role'],
+        )
+    return context, call_participants(context.appointment_id, context.doctor_id, context.patient_id)
+
+
+def signal_recipient(participants, sender_id, to=None):
+    """Return the user a signal from ``sender_id`` goes to, or None if invalid.
+
+    Frames name their recipient with ``to``; without one the doctor and
+    patient address each other, as in a two-party call.
+    """
+    if to is None:
+        peer_role = {'doctor': 'patient', 'patient': 'doctor'}.get(participants.get(sender_id))
+        return next((user_id for user_id, role in participants.items() if role == peer_role), None)
+    try:
+        to = int(to)
+    except (TypeError, ValueError):
+        return None
+    if to == sender_id or to not in participants:
+        return None
+    return to
@@ -0,0 +1,172 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from appointments.models import Appointment
+from .lifecycle import sync_call_status
+from .models import CallSession
+from .tokens import call_channel_name
+
+logger = logging.getLogger(__name__)
+
+# Clients send {"type": "heartbeat"} this often; a connection that stays
+# silent for PRESENCE_TTL is treated as gone (e.g. a worker died mid-call)
+PRESENCE_HEARTBEAT_INTERVAL = 15
+PRESENCE_TTL = 45
+
+# Join/leave timestamps are written to CallSession at most this often
+PRESENCE_FLUSH_INTERVAL = 5
+
+ROLES = ('doctor', 'patient')
+
+
+class PresenceRegistry:
+    """In-memory record of who is connected to each call room.
+
+    Entries are keyed by WebSocket channel so several tabs of the same user
+    count once. Every worker hosting a participant of a room mirrors that
+    room's entries from the presence events broadcast to its group, so lobby
+    state is answered from memory and doubles as the room's peer directory
+    for addressing signals. Join/leave transitions are queued and written to
+    ``CallSession`` in batches, which also drives the ``VideoCall`` status.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL, flush_interval=PRESENCE_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._pending = {}
+        self._timer = None
+
+    def _present(self, room, now):
+        return {role for role, _, expires_at in room.values() if expires_at > now}
+
+    def touch(self, token, channel_name, role, user_id):
+        """Add or refresh a connection. Returns True if ``role`` just arrived."""
+        now = time.monotonic()
+        with self._lock:
+            room = self._rooms.setdefault(token, {})
+            arrived = role not in self._present(room, now)
+            room[channel_name] = (role, user_id, now + self.ttl)
+        return arrived
+
+    def remove(self, token, channel_name):
+        """Drop a connection. Returns the role if nobody with it is left."""
+        now = time.monotonic()
+        with self._lock:
+            room = self._rooms.get(token)
+            if not room or channel_name not in room:
+                return None
+            role, _, _ = room.pop(channel_name)
+            return None if role in self._present(room, now) else role
+
+    def sweep(self, token):
+        """Expire silent connections. Returns the roles that are now absent."""
+        now = time.monotonic()
+        with self._lock:
+            room = self._rooms.get(token)
+            if not room:
+                return []
+            before = {role for role, _, _ in room.values()}
+            for channel_name, (role, _, expires_at) in list(room.items()):
+                if expires_at <= now:
+                    del room[channel_name]
+            return sorted(before - self._present(room, now))
+
+    def state(self, token):
+        """Lobby state for a room, or None if this process is not tracking it"""
+        with self._lock:
+            room = self._rooms.get(token)
+            if room is None:
+                return None
+            present = self._present(room, time.monotonic())
+        return {
+            'doctor_joined': 'doctor' in present,
+            'patient_joined': 'patient' in present,
+            'both_joined': present.issuperset(ROLES),
+        }
+
+    def channels_for(self, token, user_id):
+        """Channel names of ``user_id``'s live connections to a room"""
+        now = time.monotonic()
+        with self._lock:
+            room = self._rooms.get(token, {})
+            return [
+                channel_name for channel_name, (_, uid, expires_at) in room.items()
+                if uid == user_id and expires_at > now
+            ]
+
+    def record(self, appointment_id, call_token, role, joined):
+        """Queue a join/leave transition for batched persistence"""
+        if role not in ROLES:
+            # Only the doctor's and patient's attendance is kept on CallSession
+            return
+        fields = {f'{role}_joined': joined, f'{role}_{"joined" if joined else "left"}_at': timezone.now()}
+        with self._lock:
+            _, pending = self._pending.setdefault(appointment_id, (call_token, {}))
+            pending.update(fields)
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    async def flush(self):
+        pending = self._take_pending()
+        if not pending:
+            return
+        try:
+            await database_sync_to_async(self._write)(pending)
+        except Exception:
+            logger.exception("Failed to persist presence for %d calls", len(pending))
+            with self._lock:
+                # Keep newer transitions that arrived while the write was failing
+                for appointment_id, (call_token, fields) in pending.items():
+                    _, current = self._pending.setdefault(appointment_id, (call_token, {}))
+                    self._pending[appointment_id] = (call_token, {**fields, **current})
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    def flush_sync(self):
+        pending = self._take_pending()
+        if pending:
+            self._write(pending)
+
+    @staticmethod
+    def _write(pending):
+        with transaction.atomic():
+            for appointment_id, (call_token, fields) in pending.items():
+                if CallSession.objects.filter(appointment_id=appointment_id).update(**fields):
+                    continue
+                # Skip calls whose appointment was deleted while the batch was pending
+                if Appointment.objects.filter(id=appointment_id).exists():
+                    CallSession.objects.create(
+                        appointment_id=appointment_id,
+                        channel_name=call_channel_name(call_token),
+                        agora_token='',
+                        **fields
+                    )
+            sync_call_status(list(pending))
+
+
+presence = PresenceRegistry()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        presence.flush_sync()
+    except Exception:
+        logger.exception("Failed to persist presence at shutdown")
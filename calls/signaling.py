@@ -0,0 +1,189 @@
+import time
+import weakref
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.utils import timezone
+
+from chat.sync import RoomFeed
+from telemedicine.jsoncodec import dumps, loads
+from .models import SignalMessage
+from .presence import presence
+
+# Signaling frame types and the field each one must carry. Candidates are
+# accepted in both spellings clients use; 'ice_candidates' is a coalesced batch.
+SIGNAL_FIELDS = {
+    'offer': 'offer',
+    'answer': 'answer',
+    'ice_candidate': 'candidate',
+    'ice-candidate': 'candidate',
+    'ice_candidates': 'candidates',
+}
+SIGNAL_TYPES = tuple(SIGNAL_FIELDS)
+ICE_TYPES = ('ice_candidate', 'ice-candidate')
+ICE_BATCH_TYPE = 'ice_candidates'
+MAX_SIGNAL_BYTES = 64 * 1024
+
+# Trickle ICE candidates arriving within this window are sent as one frame
+ICE_COALESCE_WINDOW = 0.05
+
+# Per-room budget for forwarded signaling frames
+ROOM_SIGNAL_RATE = 10
+ROOM_SIGNAL_BURST = 30
+
+# Undelivered signals older than this are useless to a peer and get pruned
+SIGNAL_TTL = timedelta(minutes=10)
+SIGNAL_PRUNE_INTERVAL = 60
+
+# Long-poll fallback: total park time, and how often to re-check the database
+# for signals written by other workers
+SIGNAL_MAX_WAIT = 20
+SIGNAL_RECHECK_INTERVAL = 2
+
+# Wakes long-poll requests in this process when a signal is queued
+signal_feed = RoomFeed()
+
+_last_prune = 0.0
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, holding at most ``burst``"""
+
+    def __init__(self, rate=ROOM_SIGNAL_RATE, burst=ROOM_SIGNAL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self):
+        """Seconds until a token is available"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+# Shared by every consumer of a room in this process; dropped with the last one
+_room_buckets = weakref.WeakValueDictionary()
+
+
+def room_bucket(call_token):
+    bucket = _room_buckets.get(call_token)
+    if bucket is None:
+        bucket = _room_buckets[call_token] = TokenBucket()
+    return bucket
+
+
+def validate_signal(data):
+    """Return an error message if ``data`` is not a well-formed signaling frame"""
+    if not isinstance(data, dict):
+        return 'Signal must be a JSON object'
+    field = SIGNAL_FIELDS.get(data.get('type'))
+    if field is None:
+        return 'Unsupported signal type'
+    if data.get(field) is None:
+        return f'Missing {field}'
+    if data['type'] == ICE_BATCH_TYPE and not isinstance(data['candidates'], list):
+        return 'candidates must be a list'
+    return None
+
+
+def build_frame(signal_id, sender_id, data):
+    """Encode the frame delivered to the recipient, tagged with its mailbox sequence"""
+    return dumps({**data, 'seq': signal_id, 'sender_id': sender_id})
+
+
+def post_signal(appointment_id, sender_id, recipient_id, data):
+    """Append a signal to the recipient's mailbox.
+
+    Returns ``(signal_id, frame)``; the caller is responsible for pushing the
+    frame to a connected recipient.
+    """
+    signal = SignalMessage.objects.create(
+        appointment_id=appointment_id,
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        kind=data['type'],
+        payload=dumps(data),
+    )
+    signal_feed.publish(appointment_id, signal.id)
+    _prune_expired()
+    return signal.id, build_frame(signal.id, sender_id, data)
+
+
+def signal_event(recipient_id, sender_id, signal_id, frame):
+    """Channel layer event that hands a queued frame to the recipient's consumer"""
+    return {
+        'type': 'signal_message',
+        'text': frame,
+        'recipient_id': recipient_id,
+        'sender_id': sender_id,
+        'seq': signal_id,
+    }
+
+
+async def send_signal_event(channel_layer, call_token, recipient_id, event):
+    """Send ``event`` straight to the recipient's connections.
+
+    Falls back to the room group when this process has no directory entry
+    for the recipient (e.g. a WSGI worker); consumers drop frames that are
+    not addressed to them. A recipient with no connection at all picks the
+    signal up from its mailbox on connect.
+    """
+    channels = presence.channels_for(call_token, recipient_id)
+    if channels:
+        for channel_name in channels:
+            await channel_layer.send(channel_name, event)
+    elif presence.state(call_token) is None:
+        await channel_layer.group_send(f'video_call_{call_token}', event)
+
+
+def push_signal(call_token, sender_id, recipient_id, signal_id, frame):
+    """Deliver a queued signal to a recipient connected over WebSocket (sync callers)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not call_token:
+        return
+    async_to_sync(send_signal_event)(
+        channel_layer,
+        call_token,
+        recipient_id,
+        signal_event(recipient_id, sender_id, signal_id, frame)
+    )
+
+
+def pending_signals(appointment_id, recipient_id, cursor=0, sender_id=None):
+    """Return ``(signal_id, sender_id, frame)`` for every live signal after
+    ``cursor``, oldest first, optionally only those from ``sender_id``
+    """
+    signals = SignalMessage.objects.filter(
+        appointment_id=appointment_id,
+        recipient_id=recipient_id,
+        id__gt=cursor,
+        created_at__gte=timezone.now() - SIGNAL_TTL,
+    )
+    if sender_id is not None:
+        signals = signals.filter(sender_id=sender_id)
+    return [
+        (signal_id, sender, build_frame(signal_id, sender, loads(payload)))
+        for signal_id, sender, payload in signals.order_by('id').values_list('id', 'sender_id', 'payload')
+    ]
+
+
+def _prune_expired():
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < SIGNAL_PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    SignalMessage.objects.filter(created_at__lt=timezone.now() - SIGNAL_TTL).delete()
@@ -0,0 +1,269 @@
+import asyncio
+import atexit
+import logging
+import math
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timezone as dt_timezone
+
+from channels.db import database_sync_to_async
+from django.db import DatabaseError, transaction
+
+from .models import CallStatsChunk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# Quality metrics taken from each getStats() sample: round-trip time and
+# jitter in seconds, fraction of packets lost, and inbound bitrate in bits/s
+METRICS = ('rtt', 'jitter', 'packet_loss', 'bitrate')
+PERCENTILES = (50, 95)
+
+MAX_SAMPLES_PER_BATCH = 120
+
+# Client timestamps further than this from the server clock are replaced
+# with the time the batch arrived
+MAX_CLOCK_SKEW = 24 * 60 * 60
+
+# Samples received over WebSocket are buffered per call and written as one
+# chunk at most this often, or sooner once a call has this many pending
+TELEMETRY_FLUSH_INTERVAL = 30
+TELEMETRY_FLUSH_SAMPLES = 600
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return math.nan
+    return float(value)
+
+
+class SampleColumns:
+    """Samples held as one typed array per column rather than one object per row.
+
+    Timestamps are float64 epoch seconds; metrics are float32, with NaN for
+    values the browser did not report. ``to_bytes`` packs the columns back
+    to back in little-endian order.
+    """
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.metrics = {metric: array('f') for metric in METRICS}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, values):
+        self.timestamps.append(timestamp)
+        for metric in METRICS:
+            self.metrics[metric].append(values.get(metric, math.nan))
+
+    def extend(self, other):
+        self.timestamps.extend(other.timestamps)
+        for metric in METRICS:
+            self.metrics[metric].extend(other.metrics[metric])
+
+    def to_bytes(self):
+        columns = [self.timestamps] + [self.metrics[metric] for metric in METRICS]
+        if sys.byteorder == 'big':
+            columns = [array(column.typecode, column) for column in columns]
+            for column in columns:
+                column.byteswap()
+        return b''.join(column.tobytes() for column in columns)
+
+    @classmethod
+    def from_bytes(cls, data, count):
+        columns = cls()
+        data = bytes(data)
+        offset = 0
+        for column in [columns.timestamps] + [columns.metrics[metric] for metric in METRICS]:
+            size = count * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            offset += size
+            if sys.byteorder == 'big':
+                column.byteswap()
+        return columns
+
+
+def parse_samples(samples):
+    """Turn a client batch into ``SampleColumns``, or None if it is malformed.
+
+    Each sample is ``{"timestamp": <ms since epoch>, "rtt": ..., ...}`` as
+    produced from ``RTCPeerConnection.getStats()``; unknown keys are ignored.
+    Missing timestamps, or ones more than ``MAX_CLOCK_SKEW`` from now, are
+    taken as now.
+    """
+    if not isinstance(samples, list) or not 0 < len(samples) <= MAX_SAMPLES_PER_BATCH:
+        return None
+    columns = SampleColumns()
+    now = time.time()
+    for sample in samples:
+        if not isinstance(sample, dict):
+            return None
+        timestamp = _number(sample.get('timestamp')) / 1000
+        columns.append(
+            timestamp if abs(timestamp - now) <= MAX_CLOCK_SKEW else now,
+            {metric: _number(sample.get(metric)) for metric in METRICS}
+        )
+    return columns
+
+
+def _sample_time(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+def store_samples(appointment_id, columns):
+    """Write one chunk of samples for a call"""
+    store_chunks({appointment_id: columns})
+
+
+def _chunk(appointment_id, columns):
+    return CallStatsChunk(
+        appointment_id=appointment_id,
+        sample_count=len(columns),
+        first_sample_at=_sample_time(min(columns.timestamps)),
+        last_sample_at=_sample_time(max(columns.timestamps)),
+        columns=columns.to_bytes(),
+    )
+
+
+def store_chunks(pending):
+    """Write one chunk per call in ``pending``.
+
+    If the combined insert fails, each call is written on its own so one bad
+    chunk (say, for an appointment deleted mid-call) only loses its own
+    samples; those are logged and dropped.
+    """
+    pending = {appointment_id: columns for appointment_id, columns in pending.items() if len(columns)}
+    try:
+        with transaction.atomic():
+            CallStatsChunk.objects.bulk_create([
+                _chunk(appointment_id, columns) for appointment_id, columns in pending.items()
+            ])
+        return
+    except (DatabaseError, ValueError, OverflowError, OSError):
+        if len(pending) == 1:
+            raise
+    for appointment_id, columns in pending.items():
+        try:
+            with transaction.atomic():
+                _chunk(appointment_id, columns).save()
+        except (DatabaseError, ValueError, OverflowError, OSError):
+            logger.exception("Dropped %d call stats samples for appointment %s", len(columns), appointment_id)
+
+
+class TelemetryBuffer:
+    """Per-process buffer for samples streamed over call WebSockets.
+
+    Batches from every call hosted by this worker are appended to in-memory
+    columns and written as one ``CallStatsChunk`` per call per flush.
+    """
+
+    def __init__(self, flush_interval=TELEMETRY_FLUSH_INTERVAL, flush_samples=TELEMETRY_FLUSH_SAMPLES):
+        self.flush_interval = flush_interval
+        self.flush_samples = flush_samples
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def add(self, appointment_id, columns):
+        with self._lock:
+            pending = self._pending.setdefault(appointment_id, SampleColumns())
+            pending.extend(columns)
+            full = len(pending) >= self.flush_samples
+        if full:
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    async def flush(self):
+        pending = self._take_pending()
+        if not pending:
+            return
+        try:
+            await database_sync_to_async(store_chunks)(pending)
+        except Exception:
+            logger.exception("Failed to store call stats for %d calls", len(pending))
+
+    def flush_sync(self):
+        pending = self._take_pending()
+        if pending:
+            store_chunks(pending)
+
+
+telemetry = TelemetryBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        telemetry.flush_sync()
+    except Exception:
+        logger.exception("Failed to store call stats at shutdown")
+
+
+def load_samples(chunks):
+    """Concatenate the columns of a ``CallStatsChunk`` queryset"""
+    columns = SampleColumns()
+    for count, data in chunks.values_list('sample_count', 'columns'):
+        columns.extend(SampleColumns.from_bytes(data, count))
+    return columns
+
+
+def _summarize_column(column):
+    if numpy is not None:
+        values = numpy.frombuffer(column, dtype=numpy.float32).astype(numpy.float64)
+        values = values[~numpy.isnan(values)]
+        if not values.size:
+            return None
+        percentiles = numpy.percentile(values, PERCENTILES)
+        summary = {'mean': float(values.mean()), 'max': float(values.max())}
+        summary.update({f'p{p}': float(value) for p, value in zip(PERCENTILES, percentiles)})
+        return summary
+
+    values = sorted(value for value in column if value == value)
+    if not values:
+        return None
+    summary = {'mean': math.fsum(values) / len(values), 'max': values[-1]}
+    for p in PERCENTILES:
+        # Linear interpolation, matching numpy.percentile's default
+        rank = (len(values) - 1) * p / 100
+        low = math.floor(rank)
+        high = min(low + 1, len(values) - 1)
+        summary[f'p{p}'] = values[low] + (values[high] - values[low]) * (rank - low)
+    return summary
+
+
+def summarize(columns):
+    """Mean, max and percentiles of every metric, skipping unreported values"""
+    return {
+        'samples': len(columns),
+        **{metric: _summarize_column(columns.metrics[metric]) for metric in METRICS},
+    }
+
+
+def call_quality_summary(appointment_id):
+    return summarize(load_samples(CallStatsChunk.objects.filter(appointment_id=appointment_id)))
+
+
+def hospital_quality_summary(hospital_id, since=None):
+    chunks = CallStatsChunk.objects.filter(appointment__hospital_id=hospital_id)
+    if since is not None:
+        chunks = chunks.filter(last_sample_at__gte=since)
+    summary = summarize(load_samples(chunks))
+    summary['calls'] = chunks.values('appointment_id').distinct().count()
+    return summary
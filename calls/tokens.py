@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+
+from .models import AgoraToken
+
+try:
+    from agora_token_builder.RtcTokenBuilder import RtcTokenBuilder
+except ImportError:
+    try:
+        from agora_token_builder import RtcTokenBuilder
+    except ImportError:
+        RtcTokenBuilder = None
+
+logger = logging.getLogger(__name__)
+
+# Agora configuration (replace with your actual credentials)
+APP_ID = 'efd7d3d435314591ac6738f65ad2d308'
+APP_CERTIFICATE = '0b8b98014b0942369266bb794561ca34'
+
+TOKEN_LIFETIME = 3600 * 24  # 24 hours
+# Re-issue once less than this is left, so nobody joins with a token about to lapse
+TOKEN_REFRESH_MARGIN = 3600
+TOKEN_CACHE_SIZE = 4096
+PUBLISHER_ROLE = 1
+
+# uid 0 tokens let Agora assign the uid. They are only kept in memory, since
+# they are not tied to a user
+ANY_UID = 0
+
+CHANNEL_PREFIX = 'room_'
+
+
+def build_token(channel_name, uid, privilege_expired_ts):
+    """Sign an Agora RTC token. Returns None if signing is unavailable."""
+    if RtcTokenBuilder is None:
+        return None
+    try:
+        return RtcTokenBuilder.buildTokenWithUid(
+            APP_ID, APP_CERTIFICATE, channel_name, uid, PUBLISHER_ROLE, privilege_expired_ts
+        )
+    except Exception:
+        logger.exception("Error generating Agora token for %s", channel_name)
+        return None
+
+
+class TokenCache:
+    """Issues Agora tokens per (channel, uid), reusing each until it nears expiry.
+
+    Tokens are kept in a bounded in-process LRU backed by the ``AgoraToken``
+    table, so a token signed by one worker (or pre-issued by the
+    ``preissue_call_tokens`` command) is reused by every other worker.
+    """
+
+    def __init__(self, size=TOKEN_CACHE_SIZE, lifetime=TOKEN_LIFETIME, margin=TOKEN_REFRESH_MARGIN):
+        self.size = size
+        self.lifetime = lifetime
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()
+
+    def _fresh(self, expires_ts):
+        return expires_ts - time.time() > self.margin
+
+    def _remember(self, key, token, expires_ts):
+        with self._lock:
+            self._tokens[key] = (token, expires_ts)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.size:
+                self._tokens.popitem(last=False)
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is not None and self._fresh(entry[1]):
+                self._tokens.move_to_end(key)
+                return entry[0]
+        return None
+
+    def get(self, channel_name, uid):
+        """Return a valid token for ``uid`` on ``channel_name``"""
+        return self.get_many([(channel_name, uid)]).get((channel_name, uid))
+
+    def get_many(self, keys):
+        """Return ``{(channel_name, uid): token}``, signing only what is missing or stale"""
+        tokens = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            token = self._cached(key)
+            if token is None:
+                missing.append(key)
+            else:
+                tokens[key] = token
+        if not missing:
+            return tokens
+
+        stored = AgoraToken.objects.filter(
+            channel_name__in={channel_name for channel_name, _ in missing},
+            uid__in={uid for _, uid in missing},
+        ).values_list('channel_name', 'uid', 'token', 'expires_at')
+        for channel_name, uid, token, expires_at in stored:
+            key = (channel_name, uid)
+            if key in missing and self._fresh(expires_at.timestamp()):
+                self._remember(key, token, expires_at.timestamp())
+                tokens[key] = token
+
+        expires_ts = int(time.time()) + self.lifetime
+        issued = []
+        for key in missing:
+            if key in tokens:
+                continue
+            token = build_token(key[0], key[1], expires_ts)
+            if token is None:
+                continue
+            self._remember(key, token, expires_ts)
+            tokens[key] = token
+            if key[1] == ANY_UID:
+                continue
+            issued.append(AgoraToken(
+                channel_name=key[0],
+                uid=key[1],
+                token=token,
+                expires_at=datetime.fromtimestamp(expires_ts, tz=dt_timezone.utc),
+            ))
+        if issued:
+            AgoraToken.objects.bulk_create(
+                issued,
+                update_conflicts=True,
+                unique_fields=['channel_name', 'uid'],
+                update_fields=['token', 'expires_at', 'issued_at'],
+            )
+        return tokens
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+token_cache = TokenCache()
+
+
+def call_channel_name(call_token):
+    return f'{CHANNEL_PREFIX}{call_token}'
+
+
+def call_token_of(channel_name):
+    """The call token in a ``call_channel_name``, or None if it is not one"""
+    if not channel_name or not channel_name.startswith(CHANNEL_PREFIX):
+        return None
+    return channel_name[len(CHANNEL_PREFIX):] or None
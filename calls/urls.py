@@ -20,8 +20,12 @@ urlpatterns = [
     path('<int:appointment_id>/test/', views.manual_test, name='manual_test'),
     path('<int:appointment_id>/cross-device/', views.cross_device_test, name='cross_device_test'),
     path('initiate/', views.initiate_call, name='initiate_call'),
+    path('signal/', views.send_signal, name='send_signal'),
     path('signal/offer/', views.signal_offer, name='signal_offer'),
     path('signal/answer/', views.signal_answer, name='signal_answer'),
     path('signal/<int:appointment_id>/', views.get_signal, name='get_signal'),
+    path('stats/', views.post_call_stats, name='post_call_stats'),
+    path('<int:appointment_id>/quality/', views.call_quality, name='call_quality'),
+    path('quality/', views.hospital_call_quality, name='hospital_call_quality'),
     path('test/', views.test_connection, name='test_connection'),
 ]
\ No newline at end of file
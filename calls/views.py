@@ -1,44 +1,48 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.core.cache import cache
+from django.db.models import Avg, Count
+from django.http import HttpResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
+from channels.db import database_sync_to_async
+from telemedicine.jsoncodec import JsonResponse, loads
+from appointments.call_tokens import by_call_token
 from appointments.models import Appointment
+from chat.sync import max_wait
+from users.models import User
 from .models import VideoCall, CallSession
-try:
-    from agora_token_builder.RtcTokenBuilder import RtcTokenBuilder
-except ImportError:
-    try:
-        from agora_token_builder import RtcTokenBuilder
-    except ImportError:
-        RtcTokenBuilder = None
-import json
+from .participants import call_participants, call_role, signal_recipient
+from .presence import PRESENCE_HEARTBEAT_INTERVAL, presence
+from .telemetry import call_quality_summary, hospital_quality_summary, parse_samples, store_samples
+from .signaling import (
+    SIGNAL_MAX_WAIT, SIGNAL_RECHECK_INTERVAL,
+    pending_signals, post_signal, push_signal, signal_feed, validate_signal,
+)
+from .tokens import ANY_UID, APP_ID, call_channel_name, call_token_of, token_cache
 import random
 import time
-
-# Agora configuration (replace with your actual credentials)
-APP_ID = 'efd7d3d435314591ac6738f65ad2d308'
-APP_CERTIFICATE = '0b8b98014b0942369266bb794561ca34'
+from datetime import timedelta
 
 @login_required
 def enter_token(request):
     if request.method == 'POST':
         token = request.POST.get('token')
         try:
-            appointment = Appointment.objects.get(call_token=token)
+            appointment = Appointment.objects.get(**by_call_token(token))
             
-            # Check if user is part of this appointment
-            if request.user != appointment.doctor and request.user != appointment.patient:
+            # Check if user is part of this appointment's call
+            if call_role(appointment, request.user) is None:
                 messages.error(request, "Invalid token or access denied.")
                 return redirect('enter_token')
             
-            # Create or get call session
+            # Create or get call session (the token default is only evaluated on create)
+            channel_name = call_channel_name(token)
             session, created = CallSession.objects.get_or_create(
                 appointment=appointment,
                 defaults={
-                    'channel_name': f'room_{token}',
-                    'agora_token': generate_agora_token(f'room_{token}', random.randint(1, 230))
+                    'channel_name': channel_name,
+                    'agora_token': lambda: token_cache.get(channel_name, ANY_UID) or ''
                 }
             )
             
@@ -52,22 +56,26 @@ def enter_token(request):
 @login_required
 def waiting_lobby(request, token):
     try:
-        appointment = get_object_or_404(Appointment, call_token=token)
+        appointment = get_object_or_404(Appointment, **by_call_token(token))
         
         # Check access
-        if request.user != appointment.doctor and request.user != appointment.patient:
+        user_role = call_role(appointment, request.user)
+        if user_role is None:
             messages.error(request, "Access denied.")
             return redirect('enter_token')
         
-        # Create or get session without complex logic
-        user_role = 'doctor' if request.user == appointment.doctor else 'patient'
         other_user = appointment.patient if user_role == 'doctor' else appointment.doctor
         
+        # Initial state only; live updates are pushed over the call WebSocket
+        lobby = presence.state(token) or {'doctor_joined': False, 'patient_joined': False, 'both_joined': False}
+        
         context = {
             'appointment': appointment,
             'user_role': user_role,
             'other_user': other_user,
-            'both_joined': True  # Always allow to proceed
+            'session': lobby,
+            'both_joined': lobby['both_joined'],
+            'heartbeat_interval': PRESENCE_HEARTBEAT_INTERVAL,
         }
         
         return render(request, 'calls/waiting_lobby.html', context)
@@ -79,22 +87,23 @@ def waiting_lobby(request, token):
 @login_required
 def video_room(request, token):
     try:
-        appointment = get_object_or_404(Appointment, call_token=token)
+        appointment = get_object_or_404(Appointment, **by_call_token(token))
         
         # Check access
-        if request.user != appointment.doctor and request.user != appointment.patient:
+        if call_role(appointment, request.user) is None:
             messages.error(request, "Access denied.")
             return redirect('enter_token')
         
-        # Generate Agora token
-        channel_name = f'room_{token}'
-        uid = random.randint(1, 230)
-        agora_token = generate_agora_token(channel_name, uid)
+        # Stable uid per user so reloads reuse the cached token
+        channel_name = call_channel_name(token)
+        uid = request.user.id
+        agora_token = token_cache.get(channel_name, uid)
         
         context = {
             'appointment': appointment,
             'agora_token': agora_token,
             'channel_name': channel_name,
+            'uid': uid,
         }
         
         return render(request, 'calls/simple_webrtc.html', context)
@@ -103,71 +112,72 @@ def video_room(request, token):
         messages.error(request, "Invalid session.")
         return redirect('enter_token')
 
-def generate_agora_token(channel_name, uid):
-    """Generate proper Agora token with specific UID"""
-    if RtcTokenBuilder is None:
-        # Return None if agora_token_builder is not available
-        return None
-        
-    expiration_time_in_seconds = 3600 * 24  # 24 hours
-    current_timestamp = int(time.time())
-    privilege_expired_ts = current_timestamp + expiration_time_in_seconds
-    role = 1  # Publisher role
-    
-    try:
-        token = RtcTokenBuilder.buildTokenWithUid(
-            APP_ID, APP_CERTIFICATE, channel_name, uid, role, privilege_expired_ts
-        )
-        return token
-    except Exception as e:
-        print(f"Error generating Agora token: {e}")
-        return None
-
-@csrf_exempt
 def get_agora_token(request):
-    if request.method == 'GET':
-        channel = request.GET.get('channel')
-        uid = random.randint(1, 230)
-        token = generate_agora_token(channel, uid)
-        return JsonResponse({'token': token, 'uid': uid})
-    return JsonResponse({'error': 'Invalid request'})
+    """Agora token for the caller on ``?channel=room_<call token>``, if they are in that call"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'})
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    channel = request.GET.get('channel')
+    call_token = call_token_of(channel)
+    if not call_token:
+        return JsonResponse({'error': 'Invalid request'})
+    appointment = Appointment.objects.filter(**by_call_token(call_token)).values_list(
+        'id', 'doctor_id', 'patient_id'
+    ).first()
+    if appointment is None or request.user.id not in call_participants(*appointment):
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    token = token_cache.get(channel, request.user.id)
+    return JsonResponse({'token': token, 'uid': request.user.id})
 
 @csrf_exempt
 def check_lobby_status(request, token):
-    """API to check if both users have joined the lobby"""
-    try:
-        appointment = get_object_or_404(Appointment, call_token=token)
-        session = get_object_or_404(CallSession, appointment=appointment)
-        
-        return JsonResponse({
-            'doctor_joined': session.doctor_joined,
-            'patient_joined': session.patient_joined,
-            'both_joined': session.doctor_joined and session.patient_joined
-        })
-    except (Appointment.DoesNotExist, CallSession.DoesNotExist):
+    """API to check if both users have joined the lobby.
+
+    Answered from the in-memory presence registry; the database is only read
+    when this process is not hosting anyone in the room.
+    """
+    state = presence.state(token)
+    if state is not None:
+        return JsonResponse(state)
+
+    session = CallSession.objects.filter(**by_call_token(token, prefix='appointment__')).values(
+        'doctor_joined', 'patient_joined'
+    ).first()
+    if session is None:
         return JsonResponse({'error': 'Invalid token'})
+    return JsonResponse({
+        'doctor_joined': session['doctor_joined'],
+        'patient_joined': session['patient_joined'],
+        'both_joined': session['doctor_joined'] and session['patient_joined']
+    })
 
 @login_required
 def video_call(request, appointment_id):
     appointment = get_object_or_404(Appointment, id=appointment_id)
     
     # Check if user has access to this call
-    if request.user != appointment.doctor and request.user != appointment.patient:
+    participants = call_participants(appointment.id, appointment.doctor_id, appointment.patient_id)
+    user_role = participants.get(request.user.id)
+    if user_role is None:
         messages.error(request, "You don't have access to this call.")
         return redirect('dashboard_redirect')
     
     # Determine the other participant
-    if request.user == appointment.doctor:
-        other_user = appointment.patient
-        user_role = 'doctor'
-    else:
-        other_user = appointment.doctor
-        user_role = 'patient'
+    other_user = appointment.patient if user_role == 'doctor' else appointment.doctor
+    
+    # Everyone else in the call; the page opens one peer connection to each
+    peers = [
+        {'id': peer.id, 'name': peer.get_full_name() or peer.username, 'role': participants[peer.id]}
+        for peer in User.objects.filter(id__in=participants).exclude(id=request.user.id).order_by('id')
+    ]
     
     context = {
         'appointment': appointment,
         'other_user': other_user,
         'user_role': user_role,
+        'peers': peers,
+        'heartbeat_interval': PRESENCE_HEARTBEAT_INTERVAL,
     }
     
     return render(request, 'calls/video_call_webrtc.html', context)
@@ -177,7 +187,7 @@ def diagnostics(request, appointment_id):
     appointment = get_object_or_404(Appointment, id=appointment_id)
     
     # Check if user has access
-    if request.user != appointment.doctor and request.user != appointment.patient:
+    if call_role(appointment, request.user) is None:
         messages.error(request, "You don't have access to this diagnostic.")
         return redirect('dashboard_redirect')
     
@@ -215,32 +225,67 @@ def initiate_call(request):
     
     return JsonResponse({'success': False, 'error': 'Invalid request'})
 
+def _queue_signal(request, appointment_id, data):
+    """Queue ``data`` for its recipient and push it if they are on WebSocket"""
+    try:
+        appointment_id = int(appointment_id)
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Invalid request'})
+    appointment = Appointment.objects.filter(id=appointment_id).values(
+        'doctor_id', 'patient_id', 'call_token'
+    ).first()
+    if appointment is None:
+        return JsonResponse({'success': False, 'error': 'Access denied'})
+    participants = call_participants(appointment_id, appointment['doctor_id'], appointment['patient_id'])
+    if request.user.id not in participants:
+        return JsonResponse({'success': False, 'error': 'Access denied'})
+    error = validate_signal(data)
+    if error:
+        return JsonResponse({'success': False, 'error': error})
+
+    recipient_id = signal_recipient(participants, request.user.id, data.pop('to', None))
+    if recipient_id is None:
+        return JsonResponse({'success': False, 'error': 'Unknown recipient'})
+    signal_id, frame = post_signal(appointment_id, request.user.id, recipient_id, data)
+    push_signal(appointment['call_token'], request.user.id, recipient_id, signal_id, frame)
+    return JsonResponse({'success': True, 'seq': signal_id})
+
+@login_required
+def send_signal(request):
+    """HTTP fallback for sending any signaling frame: ``{appointment_id, type, ...}``"""
+    if request.method == 'POST':
+        try:
+            data = loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'success': False, 'error': 'Signal must be a JSON object'})
+        appointment_id = data.pop('appointment_id', None)
+        return _queue_signal(request, appointment_id, data)
+    return JsonResponse({'success': False})
+
 @login_required
 def signal_offer(request):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        appointment_id = data.get('appointment_id')
-        offer = data.get('offer')
-        
-        # Store offer in cache for the other peer
-        cache_key = f'webrtc_offer_{appointment_id}_{request.user.id}'
-        cache.set(cache_key, offer, timeout=300)  # 5 minutes
-        
-        return JsonResponse({'success': True})
+        try:
+            data = loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'success': False, 'error': 'Signal must be a JSON object'})
+        return _queue_signal(request, data.get('appointment_id'), {'type': 'offer', 'offer': data.get('offer')})
     return JsonResponse({'success': False})
 
 @login_required
 def signal_answer(request):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        appointment_id = data.get('appointment_id')
-        answer = data.get('answer')
-        
-        # Store answer in cache for the other peer
-        cache_key = f'webrtc_answer_{appointment_id}_{request.user.id}'
-        cache.set(cache_key, answer, timeout=300)
-        
-        return JsonResponse({'success': True})
+        try:
+            data = loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'success': False, 'error': 'Signal must be a JSON object'})
+        return _queue_signal(request, data.get('appointment_id'), {'type': 'answer', 'answer': data.get('answer')})
     return JsonResponse({'success': False})
 
 @login_required
@@ -359,33 +404,136 @@ def cross_device_test(request, appointment_id):
     
     return render(request, 'calls/cross_device_test.html', context)
 
+@database_sync_to_async
+def _get_participants(appointment_id):
+    appointment = Appointment.objects.filter(id=appointment_id).values_list('doctor_id', 'patient_id').first()
+    if appointment is None:
+        return None
+    return call_participants(appointment_id, *appointment)
+
+async def get_signal(request, appointment_id):
+    """Long-poll fallback for the signaling mailbox.
+
+    ``?cursor=<last seq seen>&wait=1`` parks until a signal for the caller is
+    queued, for a few seconds at most under WSGI. Returns every pending
+    frame in order plus the new cursor.
+    """
+    is_authenticated = await database_sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    participants = await _get_participants(appointment_id)
+    if participants is None or request.user.id not in participants:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    try:
+        cursor = int(request.GET.get('cursor', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    wait = request.GET.get('wait') in ('1', 'true')
+
+    deadline = time.monotonic() + max_wait(request, SIGNAL_MAX_WAIT)
+    while True:
+        seen = signal_feed.latest(appointment_id) or 0
+        signals = await database_sync_to_async(pending_signals)(appointment_id, request.user.id, cursor)
+        remaining = deadline - time.monotonic()
+        if signals or not wait or remaining <= 0:
+            break
+        # Woken by this worker's writes; re-check periodically for other workers'
+        await signal_feed.wait(appointment_id, seen, timeout=min(SIGNAL_RECHECK_INTERVAL, remaining))
+
+    if signals:
+        cursor = signals[-1][0]
+    # Frames are already encoded; splice them in rather than re-serializing
+    body = '{"signals":[%s],"cursor":%d}' % (','.join(frame for _, _, frame in signals), cursor)
+    return HttpResponse(body, content_type='application/json')
+
+@login_required
+def post_call_stats(request):
+    """HTTP fallback for call telemetry: ``{appointment_id, samples: [...]}``.
+
+    Used when the WebSocket is down and for the final batch as the page
+    unloads; the batch is written straight away as one chunk.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request'})
+    try:
+        data = loads(request.body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return JsonResponse({'success': False, 'error': 'Invalid request'})
+    try:
+        appointment_id = int(data.get('appointment_id'))
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Invalid request'})
+    participants = Appointment.objects.filter(id=appointment_id).values_list('doctor_id', 'patient_id').first()
+    if participants is None or request.user.id not in call_participants(appointment_id, *participants):
+        return JsonResponse({'success': False, 'error': 'Access denied'})
+    samples = parse_samples(data.get('samples'))
+    if samples is None:
+        return JsonResponse({'success': False, 'error': 'Invalid stats samples'})
+    store_samples(appointment_id, samples)
+    return JsonResponse({'success': True, 'samples': len(samples)})
+
+def _duration_seconds(duration):
+    return duration.total_seconds() if duration is not None else None
+
 @login_required
-def get_signal(request, appointment_id):
-    """Get WebRTC signaling data"""
+def call_quality(request, appointment_id):
+    """Quality summary and call history for one appointment"""
     appointment = get_object_or_404(Appointment, id=appointment_id)
-    
-    # Check access
-    if request.user != appointment.doctor and request.user != appointment.patient:
-        return JsonResponse({'offer': None, 'answer': None})
-    
-    # Get the other user's ID
-    other_user_id = appointment.patient.id if request.user == appointment.doctor else appointment.doctor.id
-    
-    # Check for offer from other user
-    offer_key = f'webrtc_offer_{appointment_id}_{other_user_id}'
-    offer = cache.get(offer_key)
-    
-    # Check for answer from other user
-    answer_key = f'webrtc_answer_{appointment_id}_{other_user_id}'
-    answer = cache.get(answer_key)
-    
-    # Clear the signals after reading
-    if offer:
-        cache.delete(offer_key)
-    if answer:
-        cache.delete(answer_key)
-    
+    user = request.user
+    allowed = (
+        user.role == 'superadmin'
+        or (user.role == 'admin' and user.hospital_id == appointment.hospital_id)
+        or user.id in (appointment.doctor_id, appointment.patient_id)
+    )
+    if not allowed:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    calls = [
+        {
+            'status': call['status'],
+            'started_at': call['started_at'],
+            'answered_at': call['answered_at'],
+            'ended_at': call['ended_at'],
+            'duration': _duration_seconds(call['duration']),
+        }
+        for call in appointment.video_calls.values('status', 'started_at', 'answered_at', 'ended_at', 'duration')
+    ]
+    return JsonResponse({
+        'appointment_id': appointment.id,
+        'calls': calls,
+        'quality': call_quality_summary(appointment.id),
+    })
+
+@login_required
+def hospital_call_quality(request):
+    """Quality summary over a hospital's calls in the last ``?days=`` (default 30)"""
+    user = request.user
+    if user.role == 'superadmin':
+        hospital_id = request.GET.get('hospital')
+    elif user.role == 'admin':
+        hospital_id = user.hospital_id
+    else:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    try:
+        hospital_id = int(hospital_id)
+        days = int(request.GET.get('days', 30))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    since = timezone.now() - timedelta(days=days)
+    calls = VideoCall.objects.filter(
+        appointment__hospital_id=hospital_id,
+        status=VideoCall.Status.ENDED,
+        ended_at__gte=since
+    ).aggregate(count=Count('id'), average_duration=Avg('duration'))
     return JsonResponse({
-        'offer': offer,
-        'answer': answer
-    })
\ No newline at end of file
+        'hospital_id': hospital_id,
+        'days': days,
+        'completed_calls': calls['count'],
+        'average_duration': _duration_seconds(calls['average_duration']),
+        'quality': hospital_quality_summary(hospital_id, since=since),
+    })
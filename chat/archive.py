@@ -0,0 +1,192 @@
+import fcntl
+import gzip
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from appointments.models import Appointment
+from .models import ChatArchive, ChatRoom, Message
+
+# Appointments in these states never get new chat traffic
+ARCHIVABLE_STATUSES = [Appointment.Status.DONE, Appointment.Status.CANCELLED]
+
+# Start a new segment file once the current one grows past this size
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+DELETE_BATCH_SIZE = 500
+
+
+class ArchiveWriteFailed(Exception):
+    """A block did not read back as written; the room's rows were kept"""
+
+
+def get_archive_root():
+    # The rows are deleted once archived, so the segments must outlive the container
+    root = getattr(settings, 'CHAT_ARCHIVE_ROOT', None)
+    if not root:
+        raise ImproperlyConfigured('CHAT_ARCHIVE_ROOT must point at a persistent volume to archive chats.')
+    return str(root)
+
+
+def _current_segment(root):
+    """Return the name of the segment new blocks should be appended to"""
+    segments = sorted(name for name in os.listdir(root) if name.startswith('segment-'))
+    if segments:
+        latest = segments[-1]
+        if os.path.getsize(os.path.join(root, latest)) < SEGMENT_MAX_BYTES:
+            return latest
+        number = int(latest.split('-')[1].split('.')[0]) + 1
+    else:
+        number = 1
+    return f'segment-{number:06d}.jsonl.gz'
+
+
+def _append_block(root, block):
+    """Append ``block`` to the current segment and return ``(segment, offset)``.
+
+    Writers hold an exclusive lock on the segment from reading its end to
+    the fsync, so concurrent runs never record the same offset.
+    """
+    while True:
+        segment = _current_segment(root)
+        with open(os.path.join(root, segment), 'ab') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            offset = handle.seek(0, os.SEEK_END)
+            if offset >= SEGMENT_MAX_BYTES:
+                # Another writer filled it while we waited; roll over
+                continue
+            handle.write(block)
+            handle.flush()
+            os.fsync(handle.fileno())
+        if offset == 0:
+            # Make the new segment's directory entry durable too
+            directory = os.open(root, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        return segment, offset
+
+
+def archive_room(chat_room):
+    """Move every live message in ``chat_room`` into cold storage.
+
+    The messages are appended to the current segment as one gzip member,
+    read back to confirm they landed, an index row records where, and only
+    then are the rows deleted. The room stays locked throughout so two runs
+    cannot archive it twice. Returns the number of messages archived.
+    """
+    root = get_archive_root()
+    with transaction.atomic():
+        ChatRoom.objects.select_for_update().filter(id=chat_room.id).first()
+        messages = list(
+            Message.objects.filter(chat_room=chat_room)
+            .order_by('id')
+            .values('id', 'sender_id', 'content', 'timestamp')
+        )
+        if not messages:
+            return 0
+
+        payload = ''.join(json.dumps({
+            'id': message['id'],
+            'sender_id': message['sender_id'],
+            'content': message['content'],
+            'timestamp': message['timestamp'].isoformat(),
+        }) + '\n' for message in messages).encode('utf-8')
+        block = gzip.compress(payload)
+
+        os.makedirs(root, exist_ok=True)
+        segment, offset = _append_block(root, block)
+        ids = [message['id'] for message in messages]
+        try:
+            written = [row['id'] for row in _load_block(segment, offset, len(block))]
+        except (OSError, EOFError, ValueError) as e:
+            raise ArchiveWriteFailed(f'{segment}@{offset}: {e}') from e
+        if written != ids:
+            raise ArchiveWriteFailed(f'{segment}@{offset}: block does not match chat room {chat_room.id}')
+
+        ChatArchive.objects.create(
+            chat_room=chat_room,
+            segment=segment,
+            offset=offset,
+            length=len(block),
+            message_count=len(messages),
+            first_message_id=messages[0]['id'],
+            last_message_id=messages[-1]['id'],
+        )
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            Message.objects.filter(id__in=ids[start:start + DELETE_BATCH_SIZE]).delete()
+
+    return len(messages)
+
+
+def archive_finished_rooms(limit=None):
+    """Archive rooms of done/cancelled appointments that still have live rows"""
+    rooms = ChatRoom.objects.filter(
+        appointment__status__in=ARCHIVABLE_STATUSES,
+        messages__isnull=False,
+    ).distinct().order_by('id')
+    if limit:
+        rooms = rooms[:limit]
+
+    room_count = message_count = 0
+    for chat_room in rooms:
+        archived = archive_room(chat_room)
+        if archived:
+            room_count += 1
+            message_count += archived
+    return room_count, message_count
+
+
+def _load_block(segment, offset, length):
+    """Read and decode one block straight from its segment"""
+    with open(os.path.join(get_archive_root(), segment), 'rb') as handle:
+        handle.seek(offset)
+        block = handle.read(length)
+    return tuple(json.loads(line) for line in gzip.decompress(block).decode('utf-8').splitlines())
+
+
+@lru_cache(maxsize=256)
+def _read_block(segment, offset, length):
+    return _load_block(segment, offset, length)
+
+
+def iter_archived_rows(archives):
+    """Yield ``(chat_room_id, row)`` for every message in a ``ChatArchive`` queryset, newest block first"""
+    blocks = archives.order_by('-last_message_id').values_list('chat_room_id', 'segment', 'offset', 'length')
+    for chat_room_id, segment, offset, length in blocks:
+        for row in reversed(_read_block(segment, offset, length)):
+            yield chat_room_id, row
+
+
+def load_archived_messages(chat_room_id, before_id=None, after_id=None):
+    """Return archived messages for a room as unsaved ``Message`` instances.
+
+    Only the blocks overlapping the requested id range are read.
+    """
+    archives = ChatArchive.objects.filter(chat_room_id=chat_room_id)
+    if before_id is not None:
+        archives = archives.filter(first_message_id__lt=before_id)
+    if after_id is not None:
+        archives = archives.filter(last_message_id__gt=after_id)
+
+    messages = []
+    for segment, offset, length in archives.order_by('first_message_id').values_list('segment', 'offset', 'length'):
+        for row in _read_block(segment, offset, length):
+            if before_id is not None and row['id'] >= before_id:
+                continue
+            if after_id is not None and row['id'] <= after_id:
+                continue
+            messages.append(Message(
+                id=row['id'],
+                chat_room_id=chat_room_id,
+                sender_id=row['sender_id'],
+                content=row['content'],
+                timestamp=datetime.fromisoformat(row['timestamp']),
+            ))
+    return messages
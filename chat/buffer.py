@@ -0,0 +1,138 @@
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.db import transaction
+
+from .models import Message
+from .sync import room_feed
+from .unread import record_new_messages
+
+logger = logging.getLogger(__name__)
+
+# Flush as soon as this many messages are pending...
+BUFFER_MAX_BATCH = 100
+# ...or once the oldest pending message has waited this long (seconds)
+BUFFER_FLUSH_INTERVAL = 0.25
+# A batch that keeps failing is written row by row after this many attempts,
+# and rows that still fail are logged and dropped
+BUFFER_MAX_ATTEMPTS = 3
+
+
+class MessageBuffer:
+    """Write-behind buffer that persists chat messages in batches.
+
+    Messages from every room are queued in arrival order and written with a
+    single ``bulk_create`` once the batch is full or the flush interval has
+    elapsed, so per-room ordering (by id) matches the order they were sent in.
+    Anything still pending is flushed on consumer disconnect and at shutdown.
+    A failed batch is retried from the front of the queue up to
+    ``max_attempts`` times, then written one row at a time so a single bad
+    row (say, for a room deleted with its appointment) is dropped on its own
+    instead of holding up every message behind it.
+    """
+
+    def __init__(self, max_batch=BUFFER_MAX_BATCH, flush_interval=BUFFER_FLUSH_INTERVAL,
+                 max_attempts=BUFFER_MAX_ATTEMPTS):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._pending = []
+        self._failures = 0
+        self._timer = None
+        self._flush_lock = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, appointment_id, chat_room_id, sender_id, content):
+        """Queue a message for persistence. Must be called from the event loop."""
+        self._pending.append((appointment_id, Message(
+            chat_room_id=chat_room_id,
+            sender_id=sender_id,
+            content=content
+        )))
+        if len(self._pending) >= self.max_batch:
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Write every pending message. Safe to call concurrently."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:len(batch)]
+                try:
+                    await database_sync_to_async(self._write)(batch)
+                except Exception:
+                    logger.exception("Failed to flush %d chat messages", len(batch))
+                    self._failures += 1
+                    if self._failures < self.max_attempts:
+                        # Put the batch back in front so ordering is preserved and retry later
+                        self._pending[:0] = _unsaved(batch)
+                        self._timer = asyncio.ensure_future(self._flush_later())
+                        return
+                    await database_sync_to_async(self._write_each)(_unsaved(batch))
+                self._failures = 0
+
+    def flush_sync(self):
+        """Write every pending message from synchronous code (e.g. at exit)."""
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:len(batch)]
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Failed to flush %d chat messages", len(batch))
+                self._write_each(_unsaved(batch))
+
+    @classmethod
+    def _write_each(cls, batch):
+        for item in batch:
+            try:
+                cls._write([item])
+            except Exception:
+                _, message = item
+                logger.exception(
+                    "Dropped chat message from user %s in room %s", message.sender_id, message.chat_room_id
+                )
+
+    @staticmethod
+    def _write(batch):
+        with transaction.atomic():
+            messages = Message.objects.bulk_create([message for _, message in batch])
+            record_new_messages(messages)
+        latest = {}
+        for appointment_id, message in batch:
+            if message.pk is not None:
+                latest[appointment_id] = max(latest.get(appointment_id, 0), message.pk)
+        for appointment_id, message_id in latest.items():
+            room_feed.publish(appointment_id, message_id)
+
+
+def _unsaved(batch):
+    # A rolled-back bulk_create may already have assigned primary keys
+    for _, message in batch:
+        message.pk = None
+        message._state.adding = True
+    return batch
+
+
+message_buffer = MessageBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    if len(message_buffer):
+        try:
+            message_buffer.flush_sync()
+        except Exception:
+            logger.exception("Failed to flush chat messages at shutdown")
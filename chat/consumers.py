@@ -1,9 +1,10 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message
-from appointments.models import Appointment
+from django.utils import timezone
+from .buffer import message_buffer
+from appointments.context import resolve_appointment_context
+from telemedicine.jsoncodec import dumps, loads
 
 User = get_user_model()
 
@@ -18,9 +19,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
             
-        # Verify user has access to this appointment
-        has_access = await self.check_user_access()
-        if not has_access:
+        # Verify user has access to this appointment and resolve it once
+        self.context = await self.resolve_context()
+        if self.context is None:
             await self.close()
             return
         
@@ -33,6 +34,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
     
     async def disconnect(self, close_code):
+        # Make sure everything this connection sent is persisted
+        await message_buffer.flush()
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -40,61 +44,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
     
     async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+        text_data_json = loads(text_data)
         message = text_data_json['message']
         
-        # Save message to database
-        await self.save_message(message)
+        # Queue message for batched persistence
+        self.save_message(message)
         
-        # Send message to room group
+        # Encode the outbound frame once; every recipient forwards it as-is
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': message,
-                'username': self.user.username,
-                'user_id': self.user.id,
-                'timestamp': await self.get_current_timestamp()
+                'text': dumps({
+                    'message': message,
+                    'username': self.user.username,
+                    'user_id': self.user.id,
+                    'timestamp': timezone.now().strftime('%Y-%m-%d %H:%M:%S')
+                })
             }
         )
     
     async def chat_message(self, event):
-        message = event['message']
-        username = event['username']
-        user_id = event['user_id']
-        timestamp = event['timestamp']
-        
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'username': username,
-            'user_id': user_id,
-            'timestamp': timestamp
-        }))
+        # Send pre-encoded message to WebSocket
+        await self.send(text_data=event['text'])
     
+    async def appointment_changed(self, event):
+        # Appointment was edited, cancelled or rescheduled - re-resolve
+        self.context = await self.resolve_context()
+        if self.context is None:
+            await self.close()
+
     @database_sync_to_async
-    def check_user_access(self):
+    def resolve_context(self):
         try:
-            appointment = Appointment.objects.get(id=self.appointment_id)
-            # Only allow doctor and patient from this appointment to access chat
-            return self.user == appointment.doctor or self.user == appointment.patient
-        except Appointment.DoesNotExist:
-            return False
+            return resolve_appointment_context(self.user, create_chat_room=True, id=self.appointment_id)
+        except ValueError:
+            return None
     
-    @database_sync_to_async
     def save_message(self, message):
-        try:
-            appointment = Appointment.objects.get(id=self.appointment_id)
-            chat_room, created = ChatRoom.objects.get_or_create(appointment=appointment)
-            Message.objects.create(
-                chat_room=chat_room,
-                sender=self.user,
-                content=message
-            )
-        except Appointment.DoesNotExist:
-            pass
-    
-    @database_sync_to_async
-    def get_current_timestamp(self):
-        from django.utils import timezone
-        return timezone.now().strftime('%Y-%m-%d %H:%M:%S')
\ No newline at end of file
+        message_buffer.add(self.context.appointment_id, self.context.chat_room_id, self.user.id, message)
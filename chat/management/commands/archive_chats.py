@@ -0,0 +1,18 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from chat.archive import archive_finished_rooms, get_archive_root
+
+class Command(BaseCommand):
+    help = 'Move chat history of done/cancelled appointments into compressed archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of rooms to archive')
+
+    def handle(self, *args, **options):
+        try:
+            rooms, messages = archive_finished_rooms(limit=options['limit'])
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {messages} messages from {rooms} rooms into {get_archive_root()}'
+        ))
@@ -9,6 +9,17 @@ class ChatRoom(models.Model):
         related_name='chat_room'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized pointer to the newest message, maintained on the write path
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    last_message_preview = models.CharField(max_length=100, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
@@ -31,6 +42,61 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Backs keyset pagination of a room's history by id
+            models.Index(fields=['chat_room', 'id'], name='chat_msg_room_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
+
+
+class ReadCursor(models.Model):
+    """How far a participant has read a room, plus their materialized unread count"""
+    chat_room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='read_cursors'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='chat_read_cursors'
+    )
+    last_read_message_id = models.BigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chat_room', 'user'], name='chat_read_cursor_room_user_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} read room {self.chat_room_id} up to {self.last_read_message_id}"
+
+
+class ChatArchive(models.Model):
+    """Index entry for a block of a room's messages moved to a cold segment file.
+
+    Each entry points at one gzip member inside an append-only segment, so a
+    room's archived history can be read without decompressing the whole file.
+    """
+    chat_room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='archives'
+    )
+    segment = models.CharField(max_length=100)
+    offset = models.BigIntegerField()
+    length = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['chat_room', 'first_message_id']
+
+    def __str__(self):
+        return f"Archive: room {self.chat_room_id} ({self.message_count} messages in {self.segment})"
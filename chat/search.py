@@ -0,0 +1,149 @@
+import re
+from datetime import datetime
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from .archive import iter_archived_rows
+from .models import ChatArchive, Message
+
+# Highlight markers used inside the database and swapped for <mark> after escaping
+_START, _STOP = '\x02', '\x03'
+
+SEARCH_LIMIT = 20
+
+# Characters of context kept either side of the first hit in an archived message
+ARCHIVE_SNIPPET_CONTEXT = 60
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_messages(user, query, appointment_id=None, limit=SEARCH_LIMIT):
+    """Ranked full-text search over the chat messages ``user`` may read.
+
+    Results are limited to appointments where the user is the doctor or the
+    patient, optionally narrowed to a single appointment. Uses SQLite FTS5
+    locally and a tsvector GIN index on PostgreSQL. Messages moved to the
+    chat archive are no longer in either index; they are scanned from their
+    archive blocks, newest first, to fill whatever the live hits leave of
+    ``limit``.
+    """
+    terms = _TERM_RE.findall(query or '')
+    if not terms:
+        return []
+
+    scope_sql = '(a.doctor_id = %s OR a.patient_id = %s)'
+    scope_params = [user.id, user.id]
+    if appointment_id is not None:
+        scope_sql += ' AND a.id = %s'
+        scope_params.append(appointment_id)
+
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        rows = _search_sqlite(terms, scope_sql, scope_params, limit)
+    elif vendor == 'postgresql':
+        rows = _search_postgresql(terms, scope_sql, scope_params, limit)
+    else:
+        rows = _search_fallback(terms, user, appointment_id, limit)
+    if len(rows) < limit:
+        rows = list(rows) + _search_archive(terms, user, appointment_id, limit - len(rows))
+
+    return [{
+        'id': message_id,
+        'appointment_id': appt_id,
+        'sender_id': sender_id,
+        'time': timestamp if isinstance(timestamp, str) else timestamp.strftime('%Y-%m-%d %H:%M'),
+        'snippet': escape(snippet).replace(_START, '<mark>').replace(_STOP, '</mark>'),
+    } for message_id, appt_id, sender_id, timestamp, snippet in rows]
+
+
+def _search_sqlite(terms, scope_sql, scope_params, limit):
+    # Quote every term so user input can't inject FTS5 query syntax
+    match = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+    sql = f"""
+        SELECT m.id, a.id, m.sender_id, strftime('%%Y-%%m-%%d %%H:%%M', m.timestamp),
+               snippet(chat_message_fts, 0, %s, %s, '...', 12)
+        FROM chat_message_fts
+        JOIN chat_message m ON m.id = chat_message_fts.rowid
+        JOIN chat_chatroom r ON r.id = m.chat_room_id
+        JOIN appointments_appointment a ON a.id = r.appointment_id
+        WHERE chat_message_fts MATCH %s AND {scope_sql}
+        ORDER BY bm25(chat_message_fts)
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_START, _STOP, match, *scope_params, limit])
+        return cursor.fetchall()
+
+
+def _search_postgresql(terms, scope_sql, scope_params, limit):
+    tsquery = ' & '.join(terms)
+    options = f'StartSel={_START}, StopSel={_STOP}, MaxWords=24, MinWords=8'
+    sql = f"""
+        SELECT m.id, a.id, m.sender_id, m.timestamp,
+               ts_headline('english', m.content, q, %s)
+        FROM chat_message m
+        JOIN chat_chatroom r ON r.id = m.chat_room_id
+        JOIN appointments_appointment a ON a.id = r.appointment_id,
+             to_tsquery('english', %s) q
+        WHERE to_tsvector('english', m.content) @@ q AND {scope_sql}
+        ORDER BY ts_rank(to_tsvector('english', m.content), q) DESC, m.id DESC
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [options, tsquery, *scope_params, limit])
+        return cursor.fetchall()
+
+
+def _search_fallback(terms, user, appointment_id, limit):
+    messages = Message.objects.filter(
+        chat_room__appointment__doctor=user
+    ) | Message.objects.filter(
+        chat_room__appointment__patient=user
+    )
+    if appointment_id is not None:
+        messages = messages.filter(chat_room__appointment_id=appointment_id)
+    for term in terms:
+        messages = messages.filter(content__icontains=term)
+    return [
+        (message_id, appt_id, sender_id, timestamp, content[:200])
+        for message_id, appt_id, sender_id, timestamp, content in messages.order_by('-id').values_list(
+            'id', 'chat_room__appointment_id', 'sender_id', 'timestamp', 'content'
+        )[:limit]
+    ]
+
+
+def _archive_snippet(content, pattern):
+    match = pattern.search(content)
+    start = max(match.start() - ARCHIVE_SNIPPET_CONTEXT, 0)
+    end = min(match.end() + ARCHIVE_SNIPPET_CONTEXT, len(content))
+    snippet = pattern.sub(lambda hit: f'{_START}{hit.group(0)}{_STOP}', content[start:end])
+    return ('...' if start else '') + snippet + ('...' if end < len(content) else '')
+
+
+def _search_archive(terms, user, appointment_id, limit):
+    archives = ChatArchive.objects.filter(
+        Q(chat_room__appointment__doctor=user) | Q(chat_room__appointment__patient=user)
+    )
+    if appointment_id is not None:
+        archives = archives.filter(chat_room__appointment_id=appointment_id)
+    appointments = dict(archives.values_list('chat_room_id', 'chat_room__appointment_id').distinct())
+    if not appointments:
+        return []
+
+    # Whole-word, case-insensitive matches on every term, as the indexes do
+    wanted = {term.lower() for term in terms}
+    pattern = re.compile(r'\b(?:%s)\b' % '|'.join(re.escape(term) for term in wanted), re.IGNORECASE | re.UNICODE)
+    rows = []
+    for chat_room_id, row in iter_archived_rows(archives):
+        if not wanted <= {word.lower() for word in _TERM_RE.findall(row['content'])}:
+            continue
+        rows.append((
+            row['id'],
+            appointments[chat_room_id],
+            row['sender_id'],
+            datetime.fromisoformat(row['timestamp']).strftime('%Y-%m-%d %H:%M'),
+            _archive_snippet(row['content'], pattern),
+        ))
+        if len(rows) >= limit:
+            break
+    return rows
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import ChatRoom
+from .unread import ensure_read_cursors
+
+
+@receiver(post_save, sender=ChatRoom)
+def create_read_cursors(sender, instance, created, **kwargs):
+    """Give both participants a read cursor so unread counts can be bumped in place"""
+    if created:
+        ensure_read_cursors(instance, instance.appointment)
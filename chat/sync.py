@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+from django.core.handlers.asgi import ASGIRequest
+
+# How long a sync request may be parked waiting for a new message
+SYNC_MAX_WAIT = 25
+
+# Under WSGI a parked request holds a whole worker, so long-polls are cut to this
+WSGI_MAX_WAIT = 3
+
+
+def max_wait(request, timeout):
+    """How long ``request`` may be parked: ``timeout`` under ASGI, at most WSGI_MAX_WAIT under WSGI"""
+    return timeout if isinstance(request, ASGIRequest) else min(timeout, WSGI_MAX_WAIT)
+
+
+class RoomFeed:
+    """Tracks the newest message id per appointment chat and wakes parked
+    long-poll requests when a new message is written.
+
+    The feed is process-local. Writers that live in another worker are picked
+    up when a request finds nothing new here, or a parked request times out,
+    and re-checks the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._waiters = {}
+
+    def latest(self, appointment_id):
+        """Return the newest known message id, or None if not yet seen"""
+        return self._latest.get(int(appointment_id))
+
+    def prime(self, appointment_id, message_id):
+        """Seed the newest message id from the database"""
+        with self._lock:
+            key = int(appointment_id)
+            self._latest[key] = max(self._latest.get(key) or 0, message_id or 0)
+
+    def publish(self, appointment_id, message_id):
+        """Record a new message and wake every request parked on the room"""
+        key = int(appointment_id)
+        with self._lock:
+            self._latest[key] = max(self._latest.get(key) or 0, message_id)
+            waiters = self._waiters.pop(key, ())
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def wait(self, appointment_id, cursor, timeout=SYNC_MAX_WAIT):
+        """Park until the room has a message newer than ``cursor``.
+
+        Returns True when woken by a new message, False on timeout.
+        """
+        key = int(appointment_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            if (self._latest.get(key) or 0) > cursor:
+                return True
+            self._waiters.setdefault(key, set()).add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(key)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[key]
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+room_feed = RoomFeed()
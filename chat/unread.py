@@ -0,0 +1,84 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import ChatRoom, Message, ReadCursor
+
+PREVIEW_LENGTH = ChatRoom._meta.get_field('last_message_preview').max_length
+
+
+def ensure_read_cursors(chat_room, appointment):
+    """Create the doctor's and patient's cursors for a new room"""
+    ReadCursor.objects.bulk_create([
+        ReadCursor(chat_room=chat_room, user_id=user_id)
+        for user_id in {appointment.doctor_id, appointment.patient_id}
+    ], ignore_conflicts=True)
+
+
+def record_new_messages(messages):
+    """Advance each room's last-message pointer and bump the other
+    participant's unread count for freshly saved messages.
+
+    Call inside the transaction that wrote the messages so the counters
+    commit together with them.
+    """
+    latest = {}
+    unread = Counter()
+    for message in messages:
+        if message.pk is None:
+            continue
+        current = latest.get(message.chat_room_id)
+        if current is None or message.pk > current.pk:
+            latest[message.chat_room_id] = message
+        unread[message.chat_room_id, message.sender_id] += 1
+
+    for chat_room_id, message in latest.items():
+        ChatRoom.objects.filter(
+            Q(last_message_id__isnull=True) | Q(last_message_id__lt=message.pk),
+            id=chat_room_id,
+        ).update(
+            last_message_id=message.pk,
+            last_message_sender_id=message.sender_id,
+            last_message_preview=message.content[:PREVIEW_LENGTH],
+            last_message_at=message.timestamp,
+        )
+
+    for (chat_room_id, sender_id), count in unread.items():
+        ReadCursor.objects.filter(chat_room_id=chat_room_id).exclude(user_id=sender_id).update(
+            unread_count=F('unread_count') + count
+        )
+
+
+def mark_read(chat_room_id, user_id, message_id):
+    """Move a participant's cursor forward to ``message_id``"""
+    if not message_id:
+        return
+    with transaction.atomic():
+        cursor, _ = ReadCursor.objects.select_for_update().get_or_create(
+            chat_room_id=chat_room_id,
+            user_id=user_id
+        )
+        if message_id <= cursor.last_read_message_id:
+            return
+        # Recount rather than zero out: messages may have landed past message_id
+        cursor.unread_count = Message.objects.filter(
+            chat_room_id=chat_room_id,
+            id__gt=message_id
+        ).exclude(sender_id=user_id).count()
+        cursor.last_read_message_id = message_id
+        cursor.save(update_fields=['last_read_message_id', 'unread_count', 'updated_at'])
+
+
+def with_chat_summary(appointments, user):
+    """Annotate an Appointment queryset with ``unread_count`` for ``user`` and
+    join the chat room's last-message fields, so the whole list is one query.
+    """
+    unread = ReadCursor.objects.filter(
+        chat_room__appointment=OuterRef('pk'),
+        user=user
+    ).values('unread_count')[:1]
+    return appointments.select_related('chat_room').annotate(
+        unread_count=Coalesce(Subquery(unread), Value(0))
+    )
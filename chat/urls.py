@@ -7,4 +7,7 @@ urlpatterns = [
     path('start/<int:doctor_id>/<int:patient_id>/', views.start_chat, name='start_chat'),
     path('send-message/', views.send_message_ajax, name='send_message_ajax'),
     path('get-messages/<int:appointment_id>/', views.get_messages_ajax, name='get_messages_ajax'),
+    path('history/<int:appointment_id>/', views.get_history_ajax, name='get_history_ajax'),
+    path('search/', views.search_messages_ajax, name='search_messages_ajax'),
+    path('sync/<int:appointment_id>/', views.sync_messages, name='sync_messages'),
 ]
\ No newline at end of file
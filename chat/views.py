@@ -1,9 +1,39 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Max
+from telemedicine.jsoncodec import JsonResponse
+from channels.db import database_sync_to_async
 from appointments.models import Appointment
 from .models import ChatRoom, Message
+from .sync import SYNC_MAX_WAIT, max_wait, room_feed
+from .search import search_messages
+from .archive import load_archived_messages
+from .unread import mark_read, record_new_messages, with_chat_summary
+
+# Number of messages rendered on the room page and returned per history page
+HISTORY_PAGE_SIZE = 50
+
+def get_history_page(chat_room_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """Return up to ``limit`` messages older than ``before_id`` (oldest first)
+    and whether even older messages exist.
+
+    Falls through to archived history once the live rows run out.
+    """
+    messages = Message.objects.filter(chat_room_id=chat_room_id)
+    if before_id is not None:
+        messages = messages.filter(id__lt=before_id)
+    page = list(messages.order_by('-id')[:limit + 1])
+    if len(page) <= limit:
+        oldest_id = page[-1].id if page else before_id
+        archived = load_archived_messages(chat_room_id, before_id=oldest_id)
+        page.extend(reversed(archived[-(limit + 1 - len(page)):]))
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return page, has_more
 
 @login_required
 def chat_room(request, appointment_id):
@@ -17,9 +47,11 @@ def chat_room(request, appointment_id):
     # Get or create chat room
     chat_room, created = ChatRoom.objects.get_or_create(appointment=appointment)
     
-    # Get existing messages
-    messages_list = Message.objects.filter(chat_room=chat_room).order_by('timestamp')
-    last_message_id = messages_list.last().id if messages_list.exists() else 0
+    # Only the most recent window is rendered; older history is backfilled on scroll
+    messages_list, has_more = get_history_page(chat_room.id)
+    last_message_id = messages_list[-1].id if messages_list else 0
+    first_message_id = messages_list[0].id if messages_list else 0
+    mark_read(chat_room.id, request.user.id, last_message_id)
     
     # Determine the other participant
     if request.user == appointment.doctor:
@@ -36,6 +68,8 @@ def chat_room(request, appointment_id):
         'other_user': other_user,
         'user_role': user_role,
         'last_message_id': last_message_id,
+        'first_message_id': first_message_id,
+        'has_more': has_more,
     }
     
     return render(request, 'chat/chat_room_ajax.html', context)
@@ -66,25 +100,38 @@ def start_chat(request, doctor_id, patient_id):
         messages.error(request, "Error starting chat.")
         return redirect('dashboard_redirect')
 
+def chat_partner(appointment, user):
+    """Chat list entry for an appointment annotated by ``with_chat_summary``"""
+    # Reverse one-to-one raises an AttributeError subclass when no room exists yet
+    chat_room = getattr(appointment, 'chat_room', None)
+    return {
+        'user': user,
+        'appointment': appointment,
+        'unread_count': appointment.unread_count,
+        'last_message_preview': chat_room.last_message_preview if chat_room else '',
+        'last_message_sender_id': chat_room.last_message_sender_id if chat_room else None,
+        'last_message_at': chat_room.last_message_at if chat_room else None,
+    }
+
 @login_required
 def chat_list(request):
     """Show available chat partners for doctors and patients"""
     if request.user.role == 'doctor':
         # Get patients from scheduled appointments
-        appointments = Appointment.objects.filter(
+        appointments = with_chat_summary(Appointment.objects.filter(
             doctor=request.user, 
             status__in=['scheduled', 'rescheduled']
-        ).select_related('patient')
-        chat_partners = [{'user': appt.patient, 'appointment': appt} for appt in appointments]
+        ).select_related('patient'), request.user)
+        chat_partners = [chat_partner(appt, appt.patient) for appt in appointments]
         title = "Chat with Patients"
         
     elif request.user.role == 'patient':
         # Get doctors from scheduled appointments
-        appointments = Appointment.objects.filter(
+        appointments = with_chat_summary(Appointment.objects.filter(
             patient=request.user, 
             status__in=['scheduled', 'rescheduled']
-        ).select_related('doctor')
-        chat_partners = [{'user': appt.doctor, 'appointment': appt} for appt in appointments]
+        ).select_related('doctor'), request.user)
+        chat_partners = [chat_partner(appt, appt.doctor) for appt in appointments]
         title = "Chat with Doctors"
         
     else:
@@ -110,11 +157,14 @@ def send_message_ajax(request):
                 return JsonResponse({'success': False, 'error': 'Access denied'})
             
             chat_room, created = ChatRoom.objects.get_or_create(appointment=appointment)
-            message = Message.objects.create(
-                chat_room=chat_room,
-                sender=request.user,
-                content=message_content
-            )
+            with transaction.atomic():
+                message = Message.objects.create(
+                    chat_room=chat_room,
+                    sender=request.user,
+                    content=message_content
+                )
+                record_new_messages([message])
+            room_feed.publish(appointment.id, message.id)
             
             return JsonResponse({'success': True, 'message_id': message.id})
         except Exception as e:
@@ -132,18 +182,132 @@ def get_messages_ajax(request, appointment_id):
         chat_room, created = ChatRoom.objects.get_or_create(appointment=appointment)
         last_id = int(request.GET.get('last_id', 0))
         
-        messages = Message.objects.filter(
+        messages = load_archived_messages(chat_room.id, after_id=last_id)
+        messages += Message.objects.filter(
             chat_room=chat_room,
             id__gt=last_id
         ).order_by('timestamp')
+        if messages:
+            mark_read(chat_room.id, request.user.id, messages[-1].id)
         
-        messages_data = [{
-            'id': msg.id,
-            'content': msg.content,
-            'sender_id': msg.sender.id,
-            'time': msg.timestamp.strftime('%H:%M')
-        } for msg in messages]
-        
-        return JsonResponse({'messages': messages_data})
+        return JsonResponse({'messages': serialize_messages(messages)})
     except Exception as e:
         return JsonResponse({'messages': []})
+
+@login_required
+def get_history_ajax(request, appointment_id):
+    """Keyset-paginated history: ``?before=<oldest loaded message id>``"""
+    participants = Appointment.objects.filter(id=appointment_id).values_list('doctor_id', 'patient_id').first()
+    if participants is None or request.user.id not in participants:
+        return JsonResponse({'messages': [], 'has_more': False})
+
+    try:
+        before_id = int(request.GET['before']) if request.GET.get('before') else None
+    except ValueError:
+        return JsonResponse({'messages': [], 'has_more': False})
+
+    chat_room_id = ChatRoom.objects.filter(appointment_id=appointment_id).values_list('id', flat=True).first()
+    if chat_room_id is None:
+        return JsonResponse({'messages': [], 'has_more': False})
+
+    page, has_more = get_history_page(chat_room_id, before_id)
+    return JsonResponse({'messages': serialize_messages(page), 'has_more': has_more})
+
+@login_required
+def search_messages_ajax(request):
+    """Full-text search: ``?q=<terms>[&appointment_id=<id>]``"""
+    query = request.GET.get('q', '').strip()
+    appointment_id = request.GET.get('appointment_id')
+    try:
+        appointment_id = int(appointment_id) if appointment_id else None
+    except ValueError:
+        return JsonResponse({'results': []})
+
+    return JsonResponse({'results': search_messages(request.user, query, appointment_id)})
+
+def serialize_messages(messages):
+    return [{
+        'id': msg.id,
+        'content': msg.content,
+        'sender_id': msg.sender_id,
+        'time': msg.timestamp.strftime('%H:%M')
+    } for msg in messages]
+
+@database_sync_to_async
+def _get_participants(appointment_id):
+    return Appointment.objects.filter(id=appointment_id).values_list('doctor_id', 'patient_id').first()
+
+@database_sync_to_async
+def _get_latest_message_id(appointment_id):
+    latest = Message.objects.filter(chat_room__appointment_id=appointment_id).aggregate(latest=Max('id'))['latest']
+    return latest or 0
+
+@database_sync_to_async
+def _get_messages_after(appointment_id, cursor):
+    messages = Message.objects.filter(
+        chat_room__appointment_id=appointment_id,
+        id__gt=cursor
+    ).order_by('id')
+    return serialize_messages(messages)
+
+@database_sync_to_async
+def _mark_read(appointment_id, user_id, message_id):
+    chat_room_id = ChatRoom.objects.filter(appointment_id=appointment_id).values_list('id', flat=True).first()
+    if chat_room_id is not None:
+        mark_read(chat_room_id, user_id, message_id)
+
+async def _refresh_latest(appointment_id):
+    """Newest message id in the database, passed on to this worker's feed"""
+    latest = await _get_latest_message_id(appointment_id)
+    if latest > (room_feed.latest(appointment_id) or 0):
+        room_feed.publish(appointment_id, latest)
+    else:
+        room_feed.prime(appointment_id, latest)
+    return room_feed.latest(appointment_id)
+
+async def sync_messages(request, appointment_id):
+    """Cursor-based incremental sync with optional long-polling.
+
+    ``?cursor=<last seen message id>&wait=1`` parks the request until a new
+    message lands in the room, for a few seconds at most under WSGI.
+    Returns 304 when there is nothing new.
+    """
+    is_authenticated = await database_sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    participants = await _get_participants(appointment_id)
+    if participants is None or request.user.id not in participants:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    try:
+        cursor = int(request.GET.get('cursor', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    wait = request.GET.get('wait') in ('1', 'true')
+
+    # The feed only hears about this worker's writes, so confirm "nothing new"
+    # against the database before answering 304 or parking the request
+    latest = room_feed.latest(appointment_id)
+    if latest is None or latest <= cursor:
+        latest = await _refresh_latest(appointment_id)
+
+    if latest <= cursor and wait:
+        if await room_feed.wait(appointment_id, cursor, timeout=max_wait(request, SYNC_MAX_WAIT)):
+            latest = room_feed.latest(appointment_id)
+        else:
+            # Timed out - pick up messages written by other workers
+            latest = await _refresh_latest(appointment_id)
+
+    if latest <= cursor:
+        return HttpResponse(status=304)
+
+    messages_data = await _get_messages_after(appointment_id, cursor)
+    if not messages_data:
+        return HttpResponse(status=304)
+    await _mark_read(appointment_id, request.user.id, messages_data[-1]['id'])
+
+    return JsonResponse({
+        'messages': messages_data,
+        'cursor': messages_data[-1]['id'],
+    })
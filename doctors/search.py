@@ -0,0 +1,128 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from appointments.slots import SEARCH_HORIZON_DAYS, slot_index
+from .models import DoctorProfile
+
+# Rebuilt this often so doctors added or edited in other processes show up
+DIRECTORY_TTL = 300
+
+MAX_RESULTS = 100
+
+DoctorEntry = namedtuple('DoctorEntry', ['doctor_id', 'name', 'hospital_id', 'hospital_name', 'specialization'])
+SearchResult = namedtuple('SearchResult', ['doctor', 'earliest'])
+
+
+def normalize_specialization(value):
+    return ' '.join((value or '').split()).casefold()
+
+
+class DoctorDirectory:
+    """In-memory index of doctors by specialization.
+
+    Search ranks the matching doctors by earliest free slot from
+    ``appointments.slots.slot_index``, warmed in bulk for the whole
+    candidate set, so a query costs no per-doctor queries.
+    """
+
+    def __init__(self, ttl=DIRECTORY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_specialization = None
+        self._loaded_at = 0.0
+
+    def _build(self):
+        index = {}
+        profiles = DoctorProfile.objects.filter(user__role='doctor', user__is_active=True).values_list(
+            'user_id', 'user__first_name', 'user__last_name', 'user__username',
+            'user__hospital_id', 'user__hospital__name', 'specialization'
+        )
+        for user_id, first_name, last_name, username, hospital_id, hospital_name, specialization in profiles:
+            entry = DoctorEntry(
+                doctor_id=user_id,
+                name=f'{first_name} {last_name}'.strip() or username,
+                hospital_id=hospital_id,
+                hospital_name=hospital_name,
+                specialization=specialization,
+            )
+            index.setdefault(normalize_specialization(specialization), []).append(entry)
+        return index
+
+    def _index(self):
+        with self._lock:
+            index = self._by_specialization
+            if index is not None and time.monotonic() - self._loaded_at <= self.ttl:
+                return index
+        index = self._build()
+        with self._lock:
+            self._by_specialization = index
+            self._loaded_at = time.monotonic()
+        return index
+
+    def invalidate(self):
+        with self._lock:
+            self._by_specialization = None
+
+    def specializations(self):
+        """Distinct specializations as entered, sorted for display"""
+        return sorted({entries[0].specialization for entries in self._index().values()}, key=str.casefold)
+
+    def doctors(self, specialization, hospital_ids=None):
+        entries = self._index().get(normalize_specialization(specialization), [])
+        if hospital_ids:
+            hospital_ids = set(hospital_ids)
+            entries = [entry for entry in entries if entry.hospital_id in hospital_ids]
+        return entries
+
+    def search(self, specialization, hospital_ids=None, start=None, end=None, limit=20):
+        """Doctors with ``specialization`` ranked by earliest free slot in [start, end].
+
+        ``start`` defaults to now and ``end`` to the slot search horizon.
+        Doctors with no free slot in range are left out.
+        """
+        entries = self.doctors(specialization, hospital_ids)
+        if not entries:
+            return []
+        now = timezone.localtime().replace(tzinfo=None)
+        start = max(start, now) if start else now
+        end = end or start.date() + timedelta(days=SEARCH_HORIZON_DAYS)
+
+        slot_index.warm([entry.doctor_id for entry in entries])
+        results = []
+        for entry in entries:
+            earliest = slot_index.first_free_slot(entry.doctor_id, after=start, until=end)
+            if earliest is not None:
+                results.append(SearchResult(entry, earliest))
+        return heapq.nsmallest(limit, results, key=lambda result: (result.earliest, result.doctor.doctor_id))
+
+
+directory = DoctorDirectory()
+
+
+def search_params(query):
+    """Parse search arguments from a QueryDict. Returns None if they are invalid."""
+    specialization = query.get('specialization', '').strip()
+    if not specialization:
+        return None
+    try:
+        hospital_ids = [int(value) for value in query.getlist('hospital') if value]
+        limit = min(int(query.get('limit', 20)), MAX_RESULTS)
+        start = parse_date(query['start']) if query.get('start') else None
+        end = parse_date(query['end']) if query.get('end') else None
+    except ValueError:
+        return None
+    if (query.get('start') and start is None) or (query.get('end') and end is None):
+        return None
+    return {
+        'specialization': specialization,
+        'hospital_ids': hospital_ids or None,
+        'start': datetime.combine(start, datetime.min.time()) if start else None,
+        'end': end,
+        'limit': limit,
+    }
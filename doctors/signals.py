@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import DoctorProfile
+from .search import directory
+
+
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=DoctorProfile)
+def refresh_directory_for_profile(sender, instance, **kwargs):
+    directory.invalidate()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def refresh_directory_for_user(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login, which the directory does not hold
+    if instance.role == 'doctor' and update_fields != frozenset(['last_login']):
+        directory.invalidate()
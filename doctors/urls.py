@@ -4,4 +4,5 @@ from . import views
 urlpatterns = [
     path('manage-availability/', views.manage_availability, name='manage_availability'),
     path('reschedule/<int:appointment_id>/', views.reschedule_appointment, name='reschedule_appointment'),
+    path('search/', views.search_doctors, name='search_doctors'),
 ]
\ No newline at end of file
@@ -2,9 +2,14 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
+from appointments.booking import BookingConflict, reschedule
 from appointments.models import Appointment
 from users.models import User
 from hospitals.models import Hospital
+from notifications.models import Notification
+from notifications.stream import appointment_notifications, publish
+from telemedicine.jsoncodec import JsonResponse
+from .search import directory, search_params
 
 @login_required
 def manage_availability(request):
@@ -27,20 +32,17 @@ def reschedule_appointment(request, appointment_id):
         new_date = request.POST.get('date')
         new_time = request.POST.get('time')
         
-        # Store original time if not already stored
-        if not appointment.original_date:
-            appointment.original_date = appointment.date
-            appointment.original_time = appointment.time
-        
-        # Update appointment
-        appointment.date = new_date
-        appointment.time = new_time
-        appointment.modified_by_doctor = True
-        appointment.status = 'rescheduled'
-        appointment.save()
-        
-        messages.success(request, 'Appointment rescheduled successfully!')
-        return redirect('dashboard_redirect')
+        try:
+            reschedule(appointment, new_date, new_time)
+        except ValueError:
+            messages.error(request, 'Please enter a valid date and time.')
+        except BookingConflict as e:
+            messages.error(request, str(e))
+        else:
+            publish(appointment_notifications(appointment, Notification.Kind.APPOINTMENT_RESCHEDULED, actor=request.user))
+            messages.success(request, 'Appointment rescheduled successfully!')
+            return redirect('dashboard_redirect')
+        appointment.refresh_from_db()
     
     return render(request, 'doctors/reschedule_appointment.html', {
         'appointment': appointment
@@ -64,4 +66,26 @@ def hospital_doctors(request):
         'hospitals': hospitals,
         'doctors': doctors,
         'selected_hospital_id': int(selected_hospital_id) if selected_hospital_id else None
-    })
\ No newline at end of file
+    })
+
+@login_required
+def search_doctors(request):
+    """JSON doctor search: ``?specialization=&hospital=<id>&hospital=<id>&start=&end=&limit=``"""
+    if request.user.role not in ['admin', 'superadmin']:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    params = search_params(request.GET)
+    if params is None:
+        return JsonResponse({'error': 'Invalid search'}, status=400)
+    results = directory.search(**params)
+    return JsonResponse({'results': [
+        {
+            'doctor_id': result.doctor.doctor_id,
+            'name': result.doctor.name,
+            'hospital_id': result.doctor.hospital_id,
+            'hospital': result.doctor.hospital_name,
+            'specialization': result.doctor.specialization,
+            'date': result.earliest.date(),
+            'time': result.earliest.strftime('%H:%M'),
+        }
+        for result in results
+    ]})
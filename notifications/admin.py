@@ -1,3 +1,13 @@
 from django.contrib import admin
+from .models import EmailDeadLetter, Notification
 
-# Register your models here.
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'message', 'created_at', 'read_at', 'digested_at')
+    list_filter = ('kind',)
+    raw_id_fields = ('user', 'appointment', 'appointment_request')
+
+@admin.register(EmailDeadLetter)
+class EmailDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'attempts', 'last_error', 'last_attempt_at')
+    raw_id_fields = ('user',)
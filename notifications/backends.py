@@ -0,0 +1,51 @@
+import logging
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .stream import publish, reminder_notifications
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REMINDER_BACKEND = 'notifications.backends.NotificationBackend'
+
+
+class BaseReminderBackend:
+    """Delivers due appointment reminders.
+
+    ``send`` gets every reminder that came due on one tick of the scheduler,
+    as a list of ``notifications.reminders.Reminder``.
+    """
+
+    def send(self, reminders):
+        raise NotImplementedError
+
+
+class LoggingBackend(BaseReminderBackend):
+    def send(self, reminders):
+        for reminder in reminders:
+            logger.info(
+                "Reminder: appointment %s (doctor %s, patient %s) starts at %s, in %d minutes",
+                reminder.appointment_id, reminder.doctor_id, reminder.patient_id,
+                reminder.starts_at, reminder.minutes_before
+            )
+
+
+class NotificationBackend(BaseReminderBackend):
+    """Stores reminders as ``Notification`` rows and streams them to the users' open pages"""
+
+    def send(self, reminders):
+        publish(reminder_notifications(reminders))
+
+
+class LocMemBackend(BaseReminderBackend):
+    """Keeps reminders in ``LocMemBackend.outbox``, for development and tests"""
+
+    outbox = []
+
+    def send(self, reminders):
+        LocMemBackend.outbox.extend(reminders)
+
+
+def get_backend(path=None):
+    return import_string(path or getattr(settings, 'REMINDER_BACKEND', DEFAULT_REMINDER_BACKEND))()
@@ -0,0 +1,72 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from telemedicine.jsoncodec import dumps, loads
+from .stream import catch_up, latest_id, mark_read, serialize, user_group
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """Streams a user's notifications to every page they have open.
+
+    Connect with ``?after=<id>`` to first receive everything since that
+    notification. Live events can overlap the catch-up, so clients drop
+    ids at or below the highest one they have seen.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = user_group(self.user.id)
+        # Join before reading the backlog so nothing published in between is lost
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            cursor = int(query.get('after', [''])[0])
+        except ValueError:
+            cursor = None
+        await self.send_backlog(cursor)
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def send_backlog(self, cursor):
+        if cursor is None:
+            await self.send(text_data=dumps({'type': 'cursor', 'id': await self.get_latest_id()}))
+            return
+        missed = await self.get_backlog(cursor)
+        if missed is None:
+            # Too far behind to replay; the page should reload its state
+            await self.send(text_data=dumps({'type': 'resync', 'id': await self.get_latest_id()}))
+            return
+        for notification in missed:
+            await self.send(text_data=dumps(serialize(notification)))
+
+    async def receive(self, text_data):
+        try:
+            data = loads(text_data)
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+        if data.get('type') == 'read' and isinstance(data.get('up_to'), int):
+            await database_sync_to_async(mark_read)(self.user.id, data['up_to'])
+
+    async def notification_event(self, event):
+        # Pre-encoded once by the publisher
+        await self.send(text_data=event['text'])
+
+    @database_sync_to_async
+    def get_backlog(self, cursor):
+        return catch_up(self.user.id, cursor)
+
+    @database_sync_to_async
+    def get_latest_id(self):
+        return latest_id(self.user.id)
@@ -0,0 +1,212 @@
+import logging
+import random
+import smtplib
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+from django.utils import timezone
+
+from users.models import User
+from .models import EmailDeadLetter, Notification
+
+logger = logging.getLogger(__name__)
+
+# Each run sends at most one digest per user; run it once per window
+DIGEST_WINDOW = 15 * 60
+
+# Users handled per round of queries; each round ends with one update and one insert
+DIGEST_BATCH_USERS = 200
+
+# A digest lists at most this many notifications and counts the rest
+DIGEST_MAX_ITEMS = 50
+
+# Transient SMTP failures are retried this many times in all, waiting
+# EMAIL_RETRY_BACKOFF seconds before the second attempt and doubling after that
+EMAIL_MAX_ATTEMPTS = 4
+EMAIL_RETRY_BACKOFF = 1.0
+
+DigestReport = namedtuple('DigestReport', ['users', 'sent', 'skipped', 'dead_lettered'])
+
+
+def is_transient(error):
+    """Whether a failed send is worth retrying: dropped connections, socket errors and 4xx replies"""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # SMTPException subclasses OSError, so rule out the rest of it before checking for socket errors
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+
+class PooledSender:
+    """Sends messages one at a time over a single reused connection.
+
+    Transient failures reopen the connection and retry with exponential
+    backoff; ``send`` returns the last error, or None once the message is
+    accepted. Works with any email backend, so the locmem and console
+    backends can stand in for SMTP. ``attempts`` counts the tries the
+    last message took.
+    """
+
+    def __init__(self, connection=None, max_attempts=EMAIL_MAX_ATTEMPTS, backoff=EMAIL_RETRY_BACKOFF, sleep=time.sleep):
+        self.connection = connection or get_connection(fail_silently=False)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.sleep = sleep
+        self.attempts = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.connection.close()
+
+    def send(self, message):
+        message.connection = self.connection
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            self.attempts = attempt
+            try:
+                # No-op while open; reconnects after a failure. An open connection is
+                # not closed by send_messages, so it is reused for the next message
+                self.connection.open()
+                if self.connection.send_messages([message]):
+                    return None
+                return 'Message was not accepted'
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                if not is_transient(e):
+                    return error
+                self.connection.close()
+            if attempt < self.max_attempts:
+                self.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.8, 1.2))
+        return error
+
+
+class DigestRenderer:
+    """Builds digest emails, loading the templates once per run"""
+
+    def __init__(self):
+        self.text_template = get_template('notifications/email/digest.txt')
+        self.html_template = get_template('notifications/email/digest.html')
+        self.from_email = settings.DEFAULT_FROM_EMAIL
+
+    def render(self, user, notifications):
+        count = len(notifications)
+        context = {
+            'user': user,
+            'name': user.get_full_name() or user.username,
+            'notifications': notifications[:DIGEST_MAX_ITEMS],
+            'more': max(count - DIGEST_MAX_ITEMS, 0),
+        }
+        message = EmailMultiAlternatives(
+            subject=f'You have {count} new update{"s" if count != 1 else ""} from Telemedicine',
+            body=self.text_template.render(context),
+            from_email=self.from_email,
+            to=[user.email],
+        )
+        message.attach_alternative(self.html_template.render(context), 'text/html')
+        return message
+
+
+def _dead_letter(user, message, notification_ids, error, attempts):
+    return EmailDeadLetter(
+        user=user,
+        to=message.to[0],
+        subject=message.subject,
+        body=message.body,
+        html_body=next((content for content, mimetype in message.alternatives if mimetype == 'text/html'), ''),
+        notification_ids=notification_ids,
+        attempts=attempts,
+        last_error=error,
+        last_attempt_at=timezone.now(),
+    )
+
+
+def send_digests(connection=None, now=None, batch_users=DIGEST_BATCH_USERS, sender=None):
+    """Email every user one digest of their unread notifications not yet digested.
+
+    Users are processed ``batch_users`` at a time with a fixed number of
+    queries per batch, and every message goes over one connection.
+    Notifications already read in the app are marked digested without
+    being sent. A message that still fails after its retries goes to
+    ``EmailDeadLetter``.
+    """
+    now = now or timezone.now()
+    pending = Notification.objects.filter(digested_at__isnull=True, created_at__lte=now)
+    renderer = DigestRenderer()
+    sender = sender or PooledSender(connection)
+    users_seen = sent = skipped = dead_lettered = 0
+    last_user_id = 0
+    with sender:
+        while True:
+            user_ids = list(
+                pending.filter(user_id__gt=last_user_id).order_by('user_id')
+                .values_list('user_id', flat=True).distinct()[:batch_users]
+            )
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+            users = User.objects.in_bulk(user_ids)
+            by_user = {}
+            for notification in pending.filter(user_id__in=user_ids).order_by('user_id', 'id'):
+                by_user.setdefault(notification.user_id, []).append(notification)
+
+            digested = []
+            dead_letters = []
+            for user_id, notifications in by_user.items():
+                users_seen += 1
+                user = users[user_id]
+                digested.extend(notification.id for notification in notifications)
+                unread = [notification for notification in notifications if notification.read_at is None]
+                if not unread or not user.email or not user.is_active:
+                    skipped += 1
+                    continue
+                message = renderer.render(user, unread)
+                error = sender.send(message)
+                if error is None:
+                    sent += 1
+                else:
+                    logger.warning("Digest for user %s failed: %s", user_id, error)
+                    dead_letters.append(_dead_letter(
+                        user, message, [notification.id for notification in unread], error, sender.attempts
+                    ))
+            dead_lettered += len(dead_letters)
+            Notification.objects.filter(id__in=digested).update(digested_at=now)
+            EmailDeadLetter.objects.bulk_create(dead_letters)
+    return DigestReport(users_seen, sent, skipped, dead_lettered)
+
+
+def retry_dead_letters(connection=None, sender=None):
+    """Try every dead-lettered digest again. Returns (sent, still_failing)."""
+    sender = sender or PooledSender(connection)
+    delivered = []
+    failed = []
+    with sender:
+        for letter in EmailDeadLetter.objects.order_by('id').iterator():
+            message = EmailMultiAlternatives(
+                subject=letter.subject,
+                body=letter.body,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[letter.to],
+            )
+            if letter.html_body:
+                message.attach_alternative(letter.html_body, 'text/html')
+            error = sender.send(message)
+            if error is None:
+                delivered.append(letter.id)
+            else:
+                letter.attempts += sender.attempts
+                letter.last_error = error
+                letter.last_attempt_at = timezone.now()
+                failed.append(letter)
+    EmailDeadLetter.objects.filter(id__in=delivered).delete()
+    EmailDeadLetter.objects.bulk_update(failed, ['attempts', 'last_error', 'last_attempt_at'])
+    return len(delivered), len(failed)
@@ -0,0 +1,28 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+from notifications.reminders import REMINDER_TICK_INTERVAL, ReminderScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Send appointment reminders as they come due. Run one instance; it picks up "
+        "appointment changes from the web workers over the channel layer, and re-reads "
+        "upcoming appointments every minute in case a change did not arrive"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tick', type=float, default=REMINDER_TICK_INTERVAL, help='Seconds between clock ticks')
+
+    def handle(self, *args, **options):
+        scheduler = ReminderScheduler()
+        self.stdout.write(
+            f'Sending reminders {", ".join(str(m) for m in scheduler.offsets)} minutes before appointments '
+            f'with {type(scheduler.backend).__name__}'
+        )
+        try:
+            asyncio.run(scheduler.run(get_channel_layer(), tick_interval=options['tick']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,40 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from notifications.digest import DIGEST_WINDOW, retry_dead_letters, send_digests
+
+
+class Command(BaseCommand):
+    help = (
+        "Email each user a digest of their unread notifications over one SMTP connection. "
+        "Messages that keep failing are kept in EmailDeadLetter"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-dead-letters', action='store_true', help='Resend dead-lettered digests instead')
+        parser.add_argument(
+            '--loop', type=int, nargs='?', const=DIGEST_WINDOW, default=None, metavar='SECONDS',
+            help=f'Keep running, sending digests every SECONDS (default {DIGEST_WINDOW})'
+        )
+        parser.add_argument('--backend', help='Email backend to use instead of EMAIL_BACKEND')
+
+    def handle(self, *args, **options):
+        while True:
+            connection = get_connection(options['backend'], fail_silently=False)
+            if options['retry_dead_letters']:
+                sent, failed = retry_dead_letters(connection)
+                self.stdout.write(f'Resent {sent} dead-lettered digests, {failed} still failing')
+            else:
+                report = send_digests(connection)
+                self.stdout.write(
+                    f'{report.users} users: {report.sent} digests sent, {report.skipped} skipped, '
+                    f'{report.dead_lettered} dead-lettered'
+                )
+            if options['loop'] is None:
+                break
+            try:
+                time.sleep(options['loop'])
+            except KeyboardInterrupt:
+                break
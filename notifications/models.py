@@ -1,3 +1,87 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+from appointments.models import Appointment, AppointmentRequest
+
+
+class Notification(models.Model):
+    """One event shown to one user, streamed live and kept for catch-up"""
+
+    class Kind(models.TextChoices):
+        APPOINTMENT_CANCELLED = "appointment_cancelled", "Appointment cancelled"
+        APPOINTMENT_RESCHEDULED = "appointment_rescheduled", "Appointment rescheduled"
+        APPOINTMENT_DONE = "appointment_done", "Appointment done"
+        APPOINTMENT_REMINDER = "appointment_reminder", "Appointment reminder"
+        REQUEST_APPROVED = "request_approved", "Request approved"
+        REQUEST_MODIFIED = "request_modified", "Request modified"
+        REQUEST_REJECTED = "request_rejected", "Request rejected"
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='notifications'
+    )
+    kind = models.CharField(max_length=30, choices=Kind.choices)
+    message = models.CharField(max_length=255)
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='notifications'
+    )
+    appointment_request = models.ForeignKey(
+        AppointmentRequest,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='notifications'
+    )
+    # What a page needs to update in place, e.g. the appointment's new status and time
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    # Set once the email digest has dealt with it: sent, skipped as already read, or dead-lettered
+    digested_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Backs catch-up from a client's cursor
+            models.Index(fields=['user', 'id'], name='notif_user_id_idx'),
+            # Only notifications still waiting for a digest
+            models.Index(
+                fields=['user', 'id'],
+                condition=models.Q(digested_at__isnull=True),
+                name='notif_digest_pending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.message}"
+
+
+class EmailDeadLetter(models.Model):
+    """A digest email that failed permanently or ran out of retries, kept for inspection and resending"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    notification_ids = models.JSONField(default=list, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.to}: {self.subject}"
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import date as date_cls, datetime, time as time_cls
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from appointments.models import Appointment
+from .backends import get_backend
+from .wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+
+# Only appointments still to happen get reminders
+REMINDER_STATUSES = (Appointment.Status.SCHEDULED, Appointment.Status.RESCHEDULED)
+
+# Minutes before the start of an appointment that a reminder goes out
+DEFAULT_REMINDER_OFFSETS = (24 * 60, 15)
+
+# Reminders are loaded into the wheel this many seconds at a time, the next
+# window being loaded once the current one has this long left to run
+REMINDER_WINDOW = 6 * 60 * 60
+REMINDER_LOAD_AHEAD = 5 * 60
+
+REMINDER_TICK_INTERVAL = 1
+
+# The loaded window is re-read this often, so bookings and moves that never
+# reached the scheduler (e.g. over the process-local memory channel layer)
+# are still armed in time
+REMINDER_RESYNC_INTERVAL = 60
+
+# Channel layer group a scheduler running in another process listens on
+REMINDER_GROUP = 'appointment_reminders'
+# Group memberships expire on most channel layers, so the listener re-joins this often
+REMINDER_GROUP_REFRESH = 60 * 60
+
+Reminder = namedtuple('Reminder', ['appointment_id', 'doctor_id', 'patient_id', 'starts_at', 'minutes_before'])
+
+
+def reminder_offsets():
+    return tuple(getattr(settings, 'APPOINTMENT_REMINDER_OFFSETS', DEFAULT_REMINDER_OFFSETS))
+
+
+def _starts_at(day, start):
+    """Epoch seconds of an appointment's start, from its local date and time"""
+    if isinstance(day, str):
+        day = date_cls.fromisoformat(day)
+    if isinstance(start, str):
+        start = time_cls.fromisoformat(start)
+    return int(timezone.make_aware(datetime.combine(day, start)).timestamp())
+
+
+def _local(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.get_current_timezone()).replace(tzinfo=None)
+
+
+def _starting_between(start, end):
+    """Q for appointments starting in [start, end), both epoch seconds"""
+    start, end = _local(start), _local(end)
+    return (
+        (Q(date__gt=start.date()) | Q(date=start.date(), time__gte=start.time()))
+        & (Q(date__lt=end.date()) | Q(date=end.date(), time__lt=end.time()))
+    )
+
+
+class ReminderScheduler:
+    """Fires appointment reminders from a timing wheel.
+
+    Upcoming appointments are loaded a window at a time, one query per
+    window, and each of their reminders is armed as a timer keyed by
+    ``(appointment_id, minutes_before)``. Saves and deletes re-arm or cancel
+    one appointment's timers through ``appointment_changed``, fed by the
+    model signals in ``notifications.signals``. Since those pushes can be
+    lost between processes, the part of the window still to come is also
+    re-read every ``resync_interval`` seconds. Due reminders are checked
+    against the current appointment in one query and handed to the
+    delivery backend.
+    """
+
+    def __init__(self, backend=None, offsets=None, window=REMINDER_WINDOW, now=None,
+                 resync_interval=REMINDER_RESYNC_INTERVAL):
+        self.backend = backend or get_backend()
+        self.offsets = tuple(sorted(offsets or reminder_offsets()))
+        self.window = window
+        self.resync_interval = resync_interval
+        now = int(time.time() if now is None else now)
+        self._lock = threading.Lock()
+        self.wheel = TimingWheel(now)
+        # Reminders due before this are in the wheel; later ones are loaded as the clock gets close
+        self.loaded_until = now
+        self.synced_at = now
+
+    def _arm(self, appointment_id, starts_at, since, until):
+        for minutes in self.offsets:
+            due = starts_at - minutes * 60
+            if since <= due < until:
+                self.wheel.schedule((appointment_id, minutes), due, starts_at)
+
+    def _disarm(self, appointment_id):
+        for minutes in self.offsets:
+            self.wheel.cancel((appointment_id, minutes))
+
+    def _due_between(self, since, until):
+        return list(Appointment.objects.filter(
+            _starting_between(since + self.offsets[0] * 60, until + self.offsets[-1] * 60),
+            status__in=REMINDER_STATUSES
+        ).order_by().values_list('id', 'date', 'time'))
+
+    def load_window(self, until):
+        """Arm every reminder due between ``loaded_until`` and ``until``"""
+        since = self.loaded_until
+        appointments = self._due_between(since, until)
+        with self._lock:
+            for appointment_id, day, start in appointments:
+                self._arm(appointment_id, _starts_at(day, start), since, until)
+            self.loaded_until = until
+        return len(appointments)
+
+    def resync(self):
+        """Re-arm every reminder still to come in the loaded window from the table.
+
+        Timers left behind by appointments that moved away are dropped by
+        ``dispatch`` when they come due.
+        """
+        until = self.loaded_until
+        appointments = self._due_between(self.wheel.now + 1, until)
+        with self._lock:
+            for appointment_id, day, start in appointments:
+                self._arm(appointment_id, _starts_at(day, start), self.wheel.now + 1, until)
+        return len(appointments)
+
+    def appointment_changed(self, appointment_id, day=None, start=None, status=None):
+        """Cancel an appointment's timers and re-arm them if it still needs reminding.
+
+        A deleted appointment is passed without ``day``, ``start`` or ``status``.
+        """
+        with self._lock:
+            self._disarm(appointment_id)
+            if status in REMINDER_STATUSES and day and start:
+                self._arm(appointment_id, _starts_at(day, start), self.wheel.now + 1, self.loaded_until)
+
+    def tick(self, now=None):
+        """Advance the clock to ``now``, loading ahead as needed, and send what came due"""
+        now = int(time.time() if now is None else now)
+        if now - self.synced_at >= self.resync_interval:
+            self.resync()
+            self.synced_at = now
+        while self.loaded_until < now + REMINDER_LOAD_AHEAD:
+            self.load_window(self.loaded_until + self.window)
+        with self._lock:
+            timers = self.wheel.advance(now)
+        return self.dispatch(timers) if timers else 0
+
+    def dispatch(self, timers):
+        # Drop reminders whose appointment moved or was cancelled after they were armed,
+        # in case the change never reached this scheduler
+        current = {
+            appointment_id: (doctor_id, patient_id, _starts_at(day, start))
+            for appointment_id, doctor_id, patient_id, day, start in Appointment.objects.filter(
+                id__in={timer.key[0] for timer in timers},
+                status__in=REMINDER_STATUSES
+            ).values_list('id', 'doctor_id', 'patient_id', 'date', 'time')
+        }
+        reminders = []
+        for timer in timers:
+            appointment_id, minutes = timer.key
+            appointment = current.get(appointment_id)
+            if appointment is None or appointment[2] != timer.payload:
+                continue
+            doctor_id, patient_id, starts_at = appointment
+            reminders.append(Reminder(
+                appointment_id=appointment_id,
+                doctor_id=doctor_id,
+                patient_id=patient_id,
+                starts_at=datetime.fromtimestamp(starts_at, tz=timezone.get_current_timezone()),
+                minutes_before=minutes,
+            ))
+        if reminders:
+            try:
+                self.backend.send(reminders)
+            except Exception:
+                logger.exception("Failed to deliver %d appointment reminders", len(reminders))
+        return len(reminders)
+
+    def handle_event(self, event):
+        self.appointment_changed(event['appointment_id'], event.get('date'), event.get('time'), event.get('status'))
+
+    async def _listen(self, channel_layer):
+        channel = await channel_layer.new_channel()
+        joined_at = None
+        try:
+            while True:
+                if joined_at is None or time.monotonic() - joined_at > REMINDER_GROUP_REFRESH:
+                    await channel_layer.group_add(REMINDER_GROUP, channel)
+                    joined_at = time.monotonic()
+                try:
+                    event = await asyncio.wait_for(channel_layer.receive(channel), REMINDER_GROUP_REFRESH)
+                except asyncio.TimeoutError:
+                    continue
+                if event.get('type') == 'reminders.changed':
+                    self.handle_event(event)
+        finally:
+            await channel_layer.group_discard(REMINDER_GROUP, channel)
+
+    async def run(self, channel_layer=None, tick_interval=REMINDER_TICK_INTERVAL):
+        """Tick forever, taking changes from other processes over ``channel_layer``"""
+        global running
+        running = self
+        listener = asyncio.ensure_future(self._listen(channel_layer)) if channel_layer is not None else None
+        try:
+            while True:
+                await database_sync_to_async(self.tick)()
+                await asyncio.sleep(tick_interval)
+        finally:
+            running = None
+            if listener is not None:
+                listener.cancel()
+
+
+# The scheduler running in this process, if any
+running = None
+
+
+def publish_change(appointment_id, day=None, start=None, status=None):
+    """Pass an appointment change to the scheduler, in this process or over the channel layer"""
+    event = {
+        'type': 'reminders.changed',
+        'appointment_id': appointment_id,
+        # Strings, so the event survives the channel layer's serializer
+        'date': str(day) if day else None,
+        'time': str(start) if start else None,
+        'status': status,
+    }
+    if running is not None:
+        running.handle_event(event)
+        return
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(REMINDER_GROUP, event)
@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from appointments.models import Appointment
+from .reminders import publish_change
+
+
+@receiver(post_save, sender=Appointment)
+def rearm_reminders(sender, instance, **kwargs):
+    transaction.on_commit(lambda: publish_change(instance.id, instance.date, instance.time, instance.status))
+
+
+@receiver(post_delete, sender=Appointment)
+def cancel_reminders(sender, instance, **kwargs):
+    appointment_id = instance.id
+    transaction.on_commit(lambda: publish_change(appointment_id))
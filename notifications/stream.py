@@ -0,0 +1,162 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from telemedicine.jsoncodec import dumps
+from users.models import User
+from .models import Notification
+
+# A reconnecting client that missed more than this is told to reload instead
+NOTIFICATION_CATCHUP_LIMIT = 200
+
+APPOINTMENT_MESSAGES = {
+    Notification.Kind.APPOINTMENT_CANCELLED: "Your appointment with {other} on {when} was cancelled.",
+    Notification.Kind.APPOINTMENT_RESCHEDULED: "Your appointment with {other} was moved to {when}.",
+    Notification.Kind.APPOINTMENT_DONE: "Your appointment with {other} on {when} is done.",
+    Notification.Kind.APPOINTMENT_REMINDER: "Reminder: your appointment with {other} is on {when}.",
+}
+
+REQUEST_MESSAGES = {
+    Notification.Kind.REQUEST_APPROVED: "Dr. {doctor} approved the appointment request for {when}.",
+    Notification.Kind.REQUEST_MODIFIED: "Dr. {doctor} proposed {when} instead of the requested time.",
+    Notification.Kind.REQUEST_REJECTED: "Dr. {doctor} declined the appointment request for {when}.",
+}
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+def _name(user):
+    return user.get_full_name() or user.username
+
+
+def _when(day, start):
+    return f'{day} at {str(start)[:5]}'
+
+
+def appointment_notifications(appointment, kind, actor=None):
+    """Unsaved notifications telling the doctor and patient, other than ``actor``, about ``appointment``"""
+    when = _when(appointment.date, appointment.time)
+    data = {'status': appointment.status, 'date': str(appointment.date), 'time': str(appointment.time)[:5]}
+    recipients = [
+        (appointment.patient_id, f'Dr. {_name(appointment.doctor)}'),
+        (appointment.doctor_id, _name(appointment.patient)),
+    ]
+    return [
+        Notification(
+            user_id=user_id,
+            kind=kind,
+            message=APPOINTMENT_MESSAGES[kind].format(other=other, when=when)[:255],
+            appointment=appointment,
+            data=data,
+        )
+        for user_id, other in recipients
+        if actor is None or user_id != actor.id
+    ]
+
+
+def reminder_notifications(reminders):
+    """Unsaved notifications for the doctor and patient of each due ``notifications.reminders.Reminder``"""
+    users = User.objects.in_bulk({r.doctor_id for r in reminders} | {r.patient_id for r in reminders})
+    notifications = []
+    for reminder in reminders:
+        starts_at = timezone.localtime(reminder.starts_at)
+        when = _when(starts_at.date(), starts_at.time())
+        data = {
+            'date': str(starts_at.date()),
+            'time': starts_at.strftime('%H:%M'),
+            'minutes_before': reminder.minutes_before,
+        }
+        for user_id, other in (
+            (reminder.patient_id, f'Dr. {_name(users[reminder.doctor_id])}'),
+            (reminder.doctor_id, _name(users[reminder.patient_id])),
+        ):
+            notifications.append(Notification(
+                user_id=user_id,
+                kind=Notification.Kind.APPOINTMENT_REMINDER,
+                message=APPOINTMENT_MESSAGES[Notification.Kind.APPOINTMENT_REMINDER].format(other=other, when=when)[:255],
+                appointment_id=reminder.appointment_id,
+                data=data,
+            ))
+    return notifications
+
+
+def request_notifications(appointment_request, kind, appointment=None):
+    """Unsaved notifications telling the patient, and whoever sent it, how a request was handled"""
+    if kind == Notification.Kind.REQUEST_MODIFIED:
+        day, start = appointment_request.approved_date, appointment_request.approved_time
+    else:
+        day, start = appointment_request.requested_date, appointment_request.requested_time
+    message = REQUEST_MESSAGES[kind].format(doctor=_name(appointment_request.doctor), when=_when(day, start))[:255]
+    data = {'status': appointment_request.status, 'date': str(day), 'time': str(start)[:5]}
+    if appointment is not None:
+        data['appointment_id'] = appointment.id
+    return [
+        Notification(
+            user_id=user_id,
+            kind=kind,
+            message=message,
+            appointment=appointment,
+            appointment_request=appointment_request,
+            data=data,
+        )
+        for user_id in dict.fromkeys([appointment_request.patient_id, appointment_request.requested_by_id])
+    ]
+
+
+def serialize(notification):
+    return {
+        'type': 'notification',
+        'id': notification.id,
+        'kind': notification.kind,
+        'message': notification.message,
+        'appointment_id': notification.appointment_id,
+        'request_id': notification.appointment_request_id,
+        'data': notification.data,
+        'created_at': notification.created_at,
+    }
+
+
+def _fan_out(notifications):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    group_send = async_to_sync(channel_layer.group_send)
+    for notification in notifications:
+        # Encoded once here; the consumer forwards the frame as-is
+        group_send(user_group(notification.user_id), {
+            'type': 'notification_event',
+            'text': dumps(serialize(notification)),
+        })
+
+
+def publish(notifications):
+    """Save ``notifications`` in one insert and push them to their users once committed"""
+    if not notifications:
+        return []
+    created = Notification.objects.bulk_create(notifications)
+    transaction.on_commit(lambda: _fan_out(created))
+    return created
+
+
+def catch_up(user_id, cursor):
+    """Notifications for ``user_id`` after id ``cursor``, oldest first, or None if too many were missed"""
+    missed = list(
+        Notification.objects.filter(user_id=user_id, id__gt=cursor)
+        .order_by('id')[:NOTIFICATION_CATCHUP_LIMIT + 1]
+    )
+    if len(missed) > NOTIFICATION_CATCHUP_LIMIT:
+        return None
+    return missed
+
+
+def latest_id(user_id):
+    return Notification.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def mark_read(user_id, up_to):
+    return Notification.objects.filter(user_id=user_id, id__lte=up_to, read_at__isnull=True).update(
+        read_at=timezone.now()
+    )
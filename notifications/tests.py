@@ -0,0 +1,145 @@
+import smtplib
+from datetime import date, datetime, time, timezone as dt_timezone
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend as LocMemEmailBackend
+from django.test import TestCase, override_settings
+
+from appointments.models import Appointment
+from hospitals.models import Hospital
+from users.models import User
+from .digest import PooledSender, is_transient, retry_dead_letters, send_digests
+from .models import EmailDeadLetter, Notification
+from .reminders import ReminderScheduler
+
+
+class FlakyBackend(LocMemEmailBackend):
+    """locmem backend that raises the queued errors for a recipient before accepting their mail"""
+
+    def __init__(self, failures=None, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures or {}
+        self.sent = 0
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+    def send_messages(self, messages):
+        errors = self.failures.get(messages[0].to[0])
+        if errors:
+            raise errors.pop(0)
+        self.sent += 1
+        return super().send_messages(messages)
+
+
+def no_sleep(seconds):
+    pass
+
+
+class ListBackend:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, reminders):
+        self.sent.extend(reminders)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class DigestTests(TestCase):
+    def setUp(self):
+        self.hospital = Hospital.objects.create(
+            name='General', address='1 Main St', contact_email='general@example.com', phone_number='555'
+        )
+        self.users = User.objects.bulk_create([
+            User(username=f'patient{i}', email=f'patient{i}@example.com', role='patient', hospital=self.hospital)
+            for i in range(3)
+        ])
+        Notification.objects.bulk_create([
+            Notification(user=user, kind=Notification.Kind.APPOINTMENT_REMINDER, message=f'Reminder {n}')
+            for user in self.users for n in range(2)
+        ])
+
+    def message(self, to='patient0@example.com'):
+        return EmailMessage('Subject', 'Body', 'from@example.com', [to])
+
+    def test_is_transient(self):
+        self.assertTrue(is_transient(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient(ConnectionRefusedError()))
+        self.assertTrue(is_transient(smtplib.SMTPDataError(451, b'Try again later')))
+        self.assertFalse(is_transient(smtplib.SMTPDataError(550, b'Mailbox unavailable')))
+        self.assertFalse(is_transient(smtplib.SMTPNotSupportedError()))
+        self.assertFalse(is_transient(smtplib.SMTPException('Unexpected reply')))
+
+    def test_sender_reuses_one_connection(self):
+        connection = FlakyBackend()
+        with PooledSender(connection, sleep=no_sleep) as sender:
+            for i in range(3):
+                self.assertIsNone(sender.send(self.message(f'patient{i}@example.com')))
+        self.assertEqual(len(mail.outbox), 3)
+        # All three went over this connection, which was only closed at the end
+        self.assertEqual(connection.sent, 3)
+        self.assertEqual(connection.closed, 1)
+
+    def test_transient_failure_is_retried(self):
+        connection = FlakyBackend({'patient0@example.com': [smtplib.SMTPDataError(451, b'Try again later')]})
+        waits = []
+        with PooledSender(connection, sleep=waits.append) as sender:
+            self.assertIsNone(sender.send(self.message()))
+            self.assertEqual(sender.attempts, 2)
+        # Closed to reconnect after the failure, then once at the end
+        self.assertEqual(connection.closed, 2)
+        self.assertEqual(len(waits), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_permanent_failure_is_dead_lettered(self):
+        connection = FlakyBackend({'patient1@example.com': [smtplib.SMTPDataError(550, b'Mailbox unavailable')]})
+        report = send_digests(sender=PooledSender(connection, sleep=no_sleep))
+
+        self.assertEqual((report.users, report.sent, report.dead_lettered), (3, 2, 1))
+        letter = EmailDeadLetter.objects.get()
+        self.assertEqual(letter.to, 'patient1@example.com')
+        self.assertEqual(letter.attempts, 1)
+        self.assertIn('SMTPDataError', letter.last_error)
+        self.assertEqual(len(letter.notification_ids), 2)
+
+        sent, failed = retry_dead_letters(sender=PooledSender(FlakyBackend(), sleep=no_sleep))
+        self.assertEqual((sent, failed), (1, 0))
+        self.assertFalse(EmailDeadLetter.objects.exists())
+
+    def test_send_digests_is_idempotent(self):
+        first = send_digests()
+        second = send_digests()
+        self.assertEqual(first.sent, 3)
+        self.assertEqual(second.users, 0)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(Notification.objects.filter(digested_at__isnull=True).exists())
+
+
+class ReminderSchedulerTests(TestCase):
+    def setUp(self):
+        self.hospital = Hospital.objects.create(
+            name='General', address='1 Main St', contact_email='general@example.com', phone_number='555'
+        )
+        self.doctor, self.patient = User.objects.bulk_create([
+            User(username='dr_reminder', role='doctor', hospital=self.hospital),
+            User(username='patient_reminder', role='patient', hospital=self.hospital),
+        ])
+        self.now = int(datetime(2030, 1, 1, 9, 0, tzinfo=dt_timezone.utc).timestamp())
+
+    def test_resync_arms_appointments_it_was_not_told_about(self):
+        backend = ListBackend()
+        scheduler = ReminderScheduler(backend=backend, offsets=(15,), now=self.now, resync_interval=60)
+        scheduler.tick(self.now)
+        # Booked by another process whose change never reached the scheduler
+        appointment, = Appointment.objects.bulk_create([Appointment(
+            doctor=self.doctor, patient=self.patient, hospital=self.hospital, date=date(2030, 1, 1), time=time(9, 30)
+        )])
+        scheduler.tick(self.now + 30)
+        self.assertNotIn((appointment.id, 15), scheduler.wheel)
+        scheduler.tick(self.now + 60)
+        self.assertIn((appointment.id, 15), scheduler.wheel)
+
+        self.assertEqual(scheduler.tick(self.now + 15 * 60), 1)
+        self.assertEqual([reminder.appointment_id for reminder in backend.sent], [appointment.id])
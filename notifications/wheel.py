@@ -0,0 +1,104 @@
+from collections import namedtuple
+
+Timer = namedtuple('Timer', ['key', 'due', 'payload'])
+
+
+class TimingWheel:
+    """Hierarchical timing wheel over integer ticks.
+
+    Level 0 has one bucket per tick; each level above has buckets as wide
+    as the whole level below it. A timer goes into the lowest level whose
+    span still reaches its due tick and cascades down a level as the clock
+    gets close, so scheduling and cancelling are O(1) and advancing the
+    clock only touches buckets that come due. Timers beyond the top level
+    wait in an overflow list until the top level wraps around.
+    """
+
+    def __init__(self, now, slots=(60, 60, 24)):
+        self.slots = slots
+        # Ticks covered by one bucket on each level
+        self.units = []
+        unit = 1
+        for size in slots:
+            self.units.append(unit)
+            unit *= size
+        self.span = unit
+        self.now = now
+        self._levels = [[{} for _ in range(size)] for size in slots]
+        self._overflow = {}
+        self._expired = {}
+        # key -> (bucket holding it, Timer)
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _bucket(self, due):
+        if due <= self.now:
+            return self._expired
+        for level, unit in enumerate(self.units):
+            size = self.slots[level]
+            # Buckets on this level start at the current bucket's boundary
+            if due < self.now - self.now % unit + unit * size:
+                return self._levels[level][due // unit % size]
+        return self._overflow
+
+    def schedule(self, key, due, payload=None):
+        """Arm a timer for tick ``due``, replacing any timer already under ``key``"""
+        self.cancel(key)
+        timer = Timer(key, due, payload)
+        bucket = self._bucket(due)
+        bucket[key] = timer
+        self._timers[key] = (bucket, timer)
+
+    def cancel(self, key):
+        """Disarm ``key``. Returns the cancelled Timer, or None if there was none."""
+        entry = self._timers.pop(key, None)
+        if entry is None:
+            return None
+        bucket, timer = entry
+        del bucket[key]
+        return timer
+
+    def _reinsert(self, bucket):
+        timers = list(bucket.values())
+        bucket.clear()
+        for timer in timers:
+            target = self._bucket(timer.due)
+            target[timer.key] = timer
+            self._timers[timer.key] = (target, timer)
+
+    def advance(self, now):
+        """Move the clock to tick ``now`` and return the timers that came due, earliest first"""
+        due = []
+        while self.now < now:
+            if not self._timers:
+                self.now = now
+                break
+            self.now += 1
+            # Cascade from the top so timers can fall through several levels in one tick
+            if self.now % self.span == 0:
+                self._reinsert(self._overflow)
+            for level in range(len(self.slots) - 1, 0, -1):
+                unit = self.units[level]
+                if self.now % unit == 0:
+                    self._reinsert(self._levels[level][self.now // unit % self.slots[level]])
+            bucket = self._levels[0][self.now % self.slots[0]]
+            if bucket:
+                self._reinsert(bucket)
+            if self._expired:
+                due.extend(self._pop_expired())
+        if self._expired:
+            due.extend(self._pop_expired())
+        due.sort(key=lambda timer: timer.due)
+        return due
+
+    def _pop_expired(self):
+        timers = list(self._expired.values())
+        for timer in timers:
+            del self._timers[timer.key]
+        self._expired.clear()
+        return timers
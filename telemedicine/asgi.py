@@ -13,6 +13,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from chat.routing import websocket_urlpatterns as chat_websocket_urlpatterns
 from calls.routing import websocket_urlpatterns as call_websocket_urlpatterns
+from notifications.routing import websocket_urlpatterns as notification_websocket_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telemedicine.settings')
 
@@ -20,7 +21,7 @@ application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter(
-            chat_websocket_urlpatterns + call_websocket_urlpatterns
+            chat_websocket_urlpatterns + call_websocket_urlpatterns + notification_websocket_urlpatterns
         )
     ),
 })
@@ -0,0 +1,523 @@
+"""
+Channel layers for running more than one ASGI worker.
+
+UnixSocketChannelLayer shares groups and channels between worker processes
+on a single host over a Unix domain socket, without Redis.
+
+One process on the host runs a small hub that owns group membership and
+routes frames. Every worker keeps one connection to the hub per event loop.
+Process-specific channels (``specific.<id>!...``) are routed straight to the
+owning connection, and group_send payloads are pickled once by the sender
+and forwarded as opaque bytes.
+
+The hub is started automatically by whichever worker first fails to
+connect (guarded by an flock so only one process can own the socket), or
+can be run on its own with ``python -m telemedicine.channel_layers``.
+
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'telemedicine.channel_layers.UnixSocketChannelLayer',
+            'CONFIG': {'path': '/run/telemedicine/channels.sock'},
+        },
+    }
+
+ShardedRedisChannelLayer and ShardedRedisPubSubChannelLayer are the
+production profiles. They spread groups such as ``chat_<id>`` and
+``video_call_<token>`` over several Redis instances on a consistent-hash
+ring, so adding an instance only moves about 1/N of the keys.
+"""
+
+import asyncio
+import bisect
+import fcntl
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import random
+import string
+import struct
+import tempfile
+import threading
+import time
+import types
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+try:
+    from channels_redis.core import RedisChannelLayer
+    from channels_redis.pubsub import RedisPubSubChannelLayer, RedisPubSubLoopLayer
+    from channels_redis.utils import _wrap_close
+except ImportError:
+    RedisChannelLayer = RedisPubSubChannelLayer = RedisPubSubLoopLayer = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), 'telemedicine-channels.sock')
+
+_HEADER = struct.Struct('!I')
+
+# Wait for the socket to drain once this many bytes are buffered
+WRITE_BUFFER_HIGH_WATER = 64 * 1024
+
+
+def _encode_frame(*fields):
+    body = pickle.dumps(fields, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(body)) + body
+
+
+async def _read_frame(reader):
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    return pickle.loads(await reader.readexactly(length))
+
+
+def _owner_of(channel):
+    """Routing key for a channel: the prefix before ``!`` for specific channels"""
+    if '!' in channel:
+        return channel[:channel.index('!')]
+    return None
+
+
+class ChannelHub:
+    """Routes frames between worker connections and owns group membership"""
+
+    def __init__(self, group_expiry=86400):
+        self.group_expiry = group_expiry
+        self.clients = {}
+        self.groups = {}
+        self.listeners = {}
+
+    async def handle_client(self, reader, writer):
+        prefix = None
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                op = frame[0]
+                if op == 'hello':
+                    prefix = frame[1]
+                    self.clients[prefix] = writer
+                elif op == 'send':
+                    self.route(frame[1], frame[2], frame[3])
+                elif op == 'group_send':
+                    self.route_group(frame[1], frame[2], frame[3])
+                elif op == 'group_add':
+                    self.groups.setdefault(frame[1], {})[frame[2]] = time.time()
+                elif op == 'group_discard':
+                    members = self.groups.get(frame[1])
+                    if members is not None:
+                        members.pop(frame[2], None)
+                        if not members:
+                            del self.groups[frame[1]]
+                elif op == 'listen':
+                    listeners = self.listeners.setdefault(frame[1], [])
+                    if prefix not in listeners:
+                        listeners.append(prefix)
+                elif op == 'flush':
+                    self.groups.clear()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # A reconnect may already have replaced this writer
+            if prefix is not None and self.clients.get(prefix) is writer:
+                self._forget(prefix)
+            writer.close()
+
+    def _forget(self, prefix):
+        del self.clients[prefix]
+        for group in list(self.groups):
+            members = self.groups[group]
+            for channel in [channel for channel in members if _owner_of(channel) == prefix]:
+                del members[channel]
+            if not members:
+                del self.groups[group]
+        for channel in list(self.listeners):
+            listeners = self.listeners[channel]
+            if prefix in listeners:
+                listeners.remove(prefix)
+            if not listeners:
+                del self.listeners[channel]
+
+    def route(self, channel, expires, payload):
+        owner = _owner_of(channel)
+        if owner is None:
+            # Normal channel - hand it to one of the processes receiving on it
+            listeners = self.listeners.get(channel)
+            if not listeners:
+                return
+            owner = listeners[0]
+            listeners.append(listeners.pop(0))
+        writer = self.clients.get(owner)
+        if writer is not None and not writer.is_closing():
+            writer.write(_encode_frame('deliver', channel, expires, payload))
+
+    def route_group(self, group, expires, payload):
+        members = self.groups.get(group)
+        if not members:
+            return
+        cutoff = time.time() - self.group_expiry
+        for channel, added in list(members.items()):
+            if added < cutoff:
+                del members[channel]
+                continue
+            self.route(channel, expires, payload)
+
+    async def serve(self, path, started=None):
+        server = await asyncio.start_unix_server(self.handle_client, path=path)
+        os.chmod(path, 0o600)
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+
+def _start_hub_thread(path, group_expiry):
+    """Run a hub on a daemon thread with its own event loop"""
+    started = threading.Event()
+    hub = ChannelHub(group_expiry=group_expiry)
+
+    def run():
+        asyncio.run(hub.serve(path, started))
+
+    threading.Thread(target=run, name='channel-hub', daemon=True).start()
+    started.wait(5)
+    return hub
+
+
+class _HubConnection:
+    """One connection to the hub, bound to the event loop that opened it"""
+
+    def __init__(self, layer, prefix):
+        self.layer = layer
+        self.prefix = prefix
+        self.queues = {}
+        self.memberships = set()
+        self.listening = set()
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def open(self):
+        try:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.layer.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not self.layer.autostart or not self.layer.start_hub():
+                # Someone else owns the hub lock; give them a moment to bind
+                await asyncio.sleep(0.05)
+            self.reader, self.writer = await asyncio.open_unix_connection(self.layer.path)
+
+        # Replay state so a restarted hub learns about us again
+        self.writer.write(_encode_frame('hello', self.prefix))
+        for group, channel in self.memberships:
+            self.writer.write(_encode_frame('group_add', group, channel))
+        for channel in self.listening:
+            self.writer.write(_encode_frame('listen', channel))
+        self.reader_task = asyncio.ensure_future(self._read_loop(self.reader))
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                _, channel, expires, payload = await _read_frame(reader)
+                self.deliver(channel, expires, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Lost connection to channel hub at %s", self.layer.path)
+            if self.writer is not None:
+                self.writer.close()
+            asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        # Keep retrying so consumers blocked in receive() come back on their own
+        delay = 0.05
+        while not self.connected and self.layer._connections.get(asyncio.get_running_loop()) is self:
+            try:
+                await self.open()
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2)
+
+    def deliver(self, channel, expires, payload):
+        queue = self.queue_for(channel)
+        if queue.full():
+            # Remote senders can't be told; drop like group_send does
+            return False
+        queue.put_nowait((expires, payload))
+        return True
+
+    def queue_for(self, channel):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue(maxsize=self.layer.get_capacity(channel))
+        return queue
+
+    async def write(self, *fields):
+        if not self.connected:
+            await self.open()
+        self.writer.write(_encode_frame(*fields))
+        if self.writer.transport.get_write_buffer_size() > WRITE_BUFFER_HIGH_WATER:
+            await self.writer.drain()
+
+    async def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+        if self.connected:
+            # Flush anything still buffered before letting go of the socket
+            try:
+                await self.writer.drain()
+                self.writer.close()
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """Channel layer shared by all worker processes on one host"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path=DEFAULT_SOCKET_PATH,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        autostart=True,
+        **kwargs,
+    ):
+        super().__init__(
+            expiry=expiry,
+            capacity=capacity,
+            channel_capacity=channel_capacity,
+            **kwargs,
+        )
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.autostart = autostart
+        self.client_id = uuid.uuid4().hex[:16]
+        self._connections = {}
+        self._connection_ids = itertools.count(1)
+        self._hub_lock_file = None
+
+    # Hub ownership
+
+    def start_hub(self):
+        """Start a hub in this process if no other process holds the lock"""
+        if self._hub_lock_file is not None:
+            return True
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        # We hold the lock, so any socket file left behind is stale
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._hub_lock_file = lock_file
+        _start_hub_thread(self.path, self.group_expiry)
+        return True
+
+    # Per-loop connections
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is None:
+            prefix = f'specific.{self.client_id}.{next(self._connection_ids)}'
+            connection = self._connections[loop] = _HubConnection(self, prefix)
+            _close_with_loop(self, loop)
+        if not connection.connected:
+            await connection.open()
+        return connection
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+
+        connection = await self._connection()
+        expires = time.time() + self.expiry
+        payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        if _owner_of(channel) == connection.prefix:
+            # Our own channel - skip the hub round trip
+            if not connection.deliver(channel, expires, payload):
+                raise ChannelFull(channel)
+            return
+        await connection.write('send', channel, expires, payload)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        connection = await self._connection()
+        if _owner_of(channel) is None and channel not in connection.listening:
+            connection.listening.add(channel)
+            await connection.write('listen', channel)
+
+        queue = connection.queue_for(channel)
+        while True:
+            expires, payload = await queue.get()
+            if expires >= time.time():
+                return pickle.loads(payload)
+
+    async def new_channel(self, prefix='specific.'):
+        connection = await self._connection()
+        return '%s!%s' % (
+            connection.prefix,
+            ''.join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    async def flush(self):
+        connection = await self._connection()
+        connection.queues.clear()
+        connection.memberships.clear()
+        await connection.write('flush')
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.pop(loop, None)
+        if connection is not None:
+            await connection.close()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        connection = await self._connection()
+        connection.memberships.add((group, channel))
+        await connection.write('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        connection = await self._connection()
+        connection.memberships.discard((group, channel))
+        await connection.write('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        connection = await self._connection()
+        payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        await connection.write('group_send', group, time.time() + self.expiry, payload)
+
+
+def _close_with_loop(layer, loop):
+    """Drop a loop's hub connection when that loop closes.
+
+    async_to_sync() runs each call on a short-lived loop, so connections
+    opened there must not outlive it.
+    """
+    original_close = loop.close
+
+    def close(self, *args, **kwargs):
+        connection = layer._connections.pop(loop, None)
+        if connection is not None and not loop.is_running():
+            loop.run_until_complete(connection.close())
+        self.close = original_close
+        return self.close(*args, **kwargs)
+
+    loop.close = types.MethodType(close, loop)
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes mapping keys to shard indexes"""
+
+    def __init__(self, nodes, replicas=128):
+        points = []
+        for index, node in enumerate(nodes):
+            for replica in range(replicas):
+                points.append((self._hash(f'{node}#{replica}'), index))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    @staticmethod
+    def _hash(value):
+        if isinstance(value, str):
+            value = value.encode('utf8')
+        return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+
+    def get(self, key):
+        position = bisect.bisect(self._hashes, self._hash(key))
+        if position == len(self._hashes):
+            position = 0
+        return self._indexes[position]
+
+
+def _host_key(host):
+    # Shard identity must not depend on list order, or reordering hosts would reshuffle keys
+    if isinstance(host, dict):
+        return host.get('address') or host.get('host') or repr(sorted(host.items()))
+    return str(host)
+
+
+if RedisChannelLayer is not None:
+
+    class ShardedRedisChannelLayer(RedisChannelLayer):
+        """RedisChannelLayer that places channels and groups on a hash ring"""
+
+        def __init__(self, hosts=None, replicas=128, **kwargs):
+            super().__init__(hosts=hosts, **kwargs)
+            self.ring = HashRing([_host_key(host) for host in self.hosts], replicas)
+
+        def consistent_hash(self, value):
+            if self.ring_size == 1:
+                return 0
+            return self.ring.get(value)
+
+    class _ShardedPubSubLoopLayer(RedisPubSubLoopLayer):
+        def __init__(self, *args, ring=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.ring = ring
+
+        def _get_shard(self, channel_or_group_name):
+            if len(self._shards) == 1:
+                return self._shards[0]
+            return self._shards[self.ring.get(channel_or_group_name)]
+
+    class ShardedRedisPubSubChannelLayer(RedisPubSubChannelLayer):
+        """Redis pub/sub layer (one PUBLISH per group_send) on a hash ring"""
+
+        def __init__(self, *args, hosts=None, replicas=128, **kwargs):
+            super().__init__(*args, hosts=hosts, **kwargs)
+            self._ring = HashRing([_host_key(host) for host in (hosts or ['redis://localhost:6379'])], replicas)
+
+        def _get_layer(self):
+            loop = asyncio.get_running_loop()
+            layer = self._layers.get(loop)
+            if layer is None:
+                layer = self._layers[loop] = _ShardedPubSubLoopLayer(
+                    *self._args,
+                    ring=self._ring,
+                    channel_layer=self,
+                    **self._kwargs,
+                )
+                _wrap_close(self, loop)
+            return layer
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the Unix socket channel hub')
+    parser.add_argument('--path', default=DEFAULT_SOCKET_PATH)
+    parser.add_argument('--group-expiry', type=int, default=86400)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    layer = UnixSocketChannelLayer(path=args.path, group_expiry=args.group_expiry)
+    if not layer.start_hub():
+        parser.exit(1, f'Another process already runs the hub for {args.path}\n')
+    logger.info("Channel hub listening on %s", args.path)
+    threading.Event().wait()
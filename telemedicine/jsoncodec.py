@@ -0,0 +1,59 @@
+"""
+Pluggable JSON codec. Uses orjson when it is installed and falls back to
+the standard library otherwise, with the same output types either way.
+Anything orjson refuses to encode (integers wider than 64 bits, say) is
+handed to the standard library, so both paths accept the same objects.
+"""
+
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse as DjangoJsonResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_django_encoder = DjangoJSONEncoder()
+
+if orjson is not None:
+    # Hand datetimes back to DjangoJSONEncoder so output matches Django's format,
+    # and turn int (etc.) dict keys into strings as json.dumps does
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        try:
+            return orjson.dumps(obj, default=_django_encoder.default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            return json.dumps(obj, cls=DjangoJSONEncoder).encode('utf-8')
+
+    def dumps(obj):
+        return dumps_bytes(obj).decode('utf-8')
+
+    loads = orjson.loads
+else:
+    def dumps(obj):
+        return json.dumps(obj, cls=DjangoJSONEncoder)
+
+    def dumps_bytes(obj):
+        return dumps(obj).encode('utf-8')
+
+    loads = json.loads
+
+
+class JsonResponse(DjangoJsonResponse):
+    """Drop-in ``django.http.JsonResponse`` that encodes with the fast codec"""
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        if encoder is DjangoJSONEncoder and not json_dumps_params:
+            content = dumps_bytes(data)
+        else:
+            content = json.dumps(data, cls=encoder, **(json_dumps_params or {}))
+        HttpResponse.__init__(self, content=content, **kwargs)
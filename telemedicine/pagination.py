@@ -0,0 +1,118 @@
+"""
+Keyset pagination for list views.
+
+A page is fetched by seeking past the sort key of the last row shown
+instead of counting an offset, so every page costs one indexed range scan
+no matter how deep it is. The ordering must end in a unique column
+(normally ``id``) and every key must be non-null, so that each row has a
+distinct position and no row is skipped or repeated when rows are added
+between requests.
+"""
+
+import base64
+import binascii
+import datetime
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .jsoncodec import dumps, loads
+
+DEFAULT_PAGE_SIZE = 50
+
+Page = namedtuple('Page', ['object_list', 'next_cursor', 'previous_cursor'])
+
+
+def _encode(values):
+    # isoformat keeps microseconds, which DjangoJSONEncoder would cut to milliseconds
+    values = [value.isoformat() if isinstance(value, (datetime.date, datetime.time)) else value for value in values]
+    return base64.urlsafe_b64encode(dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode(cursor, fields):
+    """Values of ``cursor`` converted by each of ``fields``, or None if it is malformed"""
+    try:
+        values = loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(fields):
+        return None
+    try:
+        values = [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, TypeError):
+        return None
+    if any(value is None for value in values):
+        return None
+    return values
+
+
+def _seek(ordering, values, backwards=False):
+    """Q for rows after ``values`` in ``ordering``, or before them if ``backwards``"""
+    condition = Q(pk__in=[])
+    equal = Q()
+    for key, value in zip(ordering, values):
+        field = key.lstrip('-')
+        descending = key.startswith('-') != backwards
+        condition |= equal & Q(**{f'{field}__{"lt" if descending else "gt"}': value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+def _reverse(ordering):
+    return [key[1:] if key.startswith('-') else f'-{key}' for key in ordering]
+
+
+class KeysetPaginator:
+    """Pages through ``queryset`` in ``ordering``, e.g. ``('-date', '-time', '-id')``.
+
+    ``page`` takes the ``after`` or ``before`` cursor from the request and
+    returns a ``Page`` whose cursors link to the neighbouring pages; a
+    cursor is None at either end. A cursor that does not decode, or whose
+    values are not valid for their fields, gives the first page.
+    """
+
+    def __init__(self, queryset, ordering, per_page=DEFAULT_PAGE_SIZE):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+
+    def _fields(self):
+        opts = self.queryset.model._meta
+        return [opts.pk if key.lstrip('-') == 'pk' else opts.get_field(key.lstrip('-')) for key in self.ordering]
+
+    def cursor(self, obj):
+        return _encode([getattr(obj, key.lstrip('-')) for key in self.ordering])
+
+    def page(self, after=None, before=None):
+        backwards = False
+        queryset = self.queryset.order_by(*self.ordering)
+        values = _decode(after, self._fields()) if after else None
+        if values is None and before:
+            values = _decode(before, self._fields())
+            backwards = values is not None
+            if backwards:
+                queryset = self.queryset.order_by(*_reverse(self.ordering))
+        if values is not None:
+            queryset = queryset.filter(_seek(self.ordering, values, backwards))
+
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, values is not None
+        return Page(
+            rows,
+            self.cursor(rows[-1]) if rows and has_next else None,
+            self.cursor(rows[0]) if rows and has_previous else None,
+        )
+
+
+def paginate(request, queryset, ordering, per_page=DEFAULT_PAGE_SIZE):
+    """The page of ``queryset`` asked for by ``?after=`` or ``?before=`` on ``request``"""
+    return KeysetPaginator(queryset, ordering, per_page).page(
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
@@ -100,11 +100,45 @@ WSGI_APPLICATION = 'telemedicine.wsgi.application'
 ASGI_APPLICATION = 'telemedicine.asgi.application'
 
 # Channels
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# CHANNEL_LAYER=unix shares groups between several ASGI workers on one host
+# over a Unix domain socket. CHANNEL_LAYER=redis / redis-pubsub shard groups
+# over every instance in REDIS_URLS (see telemedicine/channel_layers.py)
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'memory')
+REDIS_URLS = [url.strip() for url in os.environ.get('REDIS_URLS', 'redis://localhost:6379').split(',') if url.strip()]
+
+if CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'telemedicine.channel_layers.ShardedRedisChannelLayer',
+            'CONFIG': {
+                'hosts': REDIS_URLS,
+            },
+        },
+    }
+elif CHANNEL_LAYER == 'redis-pubsub':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'telemedicine.channel_layers.ShardedRedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': REDIS_URLS,
+            },
+        },
+    }
+elif CHANNEL_LAYER == 'unix':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'telemedicine.channel_layers.UnixSocketChannelLayer',
+            'CONFIG': {
+                'path': os.environ.get('CHANNEL_SOCKET_PATH', '/tmp/telemedicine-channels.sock'),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 # Database - Use Railway PostgreSQL or SQLite locally
 if os.environ.get('DATABASE_URL'):
@@ -166,6 +200,26 @@ MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Compressed chat history of finished appointments (see chat/archive.py). The
+# archived rows are deleted, so outside DEBUG this must be set to a persistent
+# volume; the container disk is wiped on every deploy
+CHAT_ARCHIVE_ROOT = os.environ.get('CHAT_ARCHIVE_ROOT') or (BASE_DIR / 'chat_archive' if DEBUG else None)
+
+# Email, used for notification digests (see notifications/digest.py). Mail
+# goes to the console unless EMAIL_HOST or EMAIL_BACKEND is set
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'False') == 'True'
+EMAIL_TIMEOUT = 30
+EMAIL_BACKEND = os.environ.get(
+    'EMAIL_BACKEND',
+    'django.core.mail.backends.smtp.EmailBackend' if 'EMAIL_HOST' in os.environ
+    else 'django.core.mail.backends.console.EmailBackend'
+)
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'Telemedicine <no-reply@localhost>')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/stable/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
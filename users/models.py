@@ -25,6 +25,14 @@ class User(AbstractUser):
         help_text="The hospital this user belongs to (required for Admin, Doctor, Patient)",
     )
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Keyset pagination of the user lists in users.views, newest first
+            models.Index(fields=['date_joined', 'id'], name='user_joined_id_idx'),
+            models.Index(fields=['role', 'date_joined', 'id'], name='user_role_joined_idx'),
+            models.Index(fields=['role', 'hospital', 'date_joined', 'id'], name='user_role_hospital_joined_idx'),
+        ]
+
     def is_superadmin(self):
         return self.role == self.Roles.SUPERADMIN
 
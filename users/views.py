@@ -6,6 +6,14 @@ from .models import User
 from .forms import AdminCreationForm
 from hospitals.models import Hospital
 from appointments.models import Appointment, AppointmentRequest
+from chat.unread import with_chat_summary
+from doctors.search import directory, search_params
+from notifications.stream import latest_id as latest_notification_id
+from telemedicine.pagination import DEFAULT_PAGE_SIZE, paginate
+
+# Newest first; the trailing id makes each position unique for the keyset cursors
+APPOINTMENT_ORDERING = ('-date', '-time', '-id')
+USER_ORDERING = ('-date_joined', '-id')
 
 def is_superadmin(user):
     return getattr(user, 'role', None) == 'superadmin'
@@ -46,23 +54,35 @@ def dashboard_redirect(request):
     if role == 'doctor':
         pending_requests = AppointmentRequest.objects.filter(doctor=user, status='pending')
         # Get patients from scheduled appointments
-        scheduled_appointments = Appointment.objects.filter(doctor=user, status__in=['scheduled', 'rescheduled'])
-        available_patients = [appt.patient for appt in scheduled_appointments]
+        scheduled_appointments = with_chat_summary(
+            Appointment.objects.filter(doctor=user, status__in=['scheduled', 'rescheduled']).select_related('patient'), user
+        )
+        available_patients = []
+        for appt in scheduled_appointments:
+            appt.patient.unread_count = appt.unread_count
+            available_patients.append(appt.patient)
         return render(request, 'dashboards/doctor_dashboard.html', {
             'appointments_today': Appointment.objects.filter(doctor=user, date=today, status__in=['scheduled', 'rescheduled']).order_by('time'),
             'total_appointments': Appointment.objects.filter(doctor=user, status='done').count(),
             'pending_requests': pending_requests,
             'pending_requests_count': pending_requests.count(),
             'available_patients': available_patients,
+            'notification_cursor': latest_notification_id(user.id),
         })
 
     if role == 'patient':
         # Get doctors from scheduled appointments
-        scheduled_appointments = Appointment.objects.filter(patient=user, status__in=['scheduled', 'rescheduled'])
-        available_doctors = [appt.doctor for appt in scheduled_appointments]
+        scheduled_appointments = with_chat_summary(
+            Appointment.objects.filter(patient=user, status__in=['scheduled', 'rescheduled']).select_related('doctor'), user
+        )
+        available_doctors = []
+        for appt in scheduled_appointments:
+            appt.doctor.unread_count = appt.unread_count
+            available_doctors.append(appt.doctor)
         return render(request, 'dashboards/patient_dashboard.html', {
             'upcoming_appointments': Appointment.objects.filter(patient=user, date__gte=today).order_by('date', 'time'),
             'available_doctors': available_doctors,
+            'notification_cursor': latest_notification_id(user.id),
         })
 
     if getattr(user, 'is_superuser', False):
@@ -70,6 +90,16 @@ def dashboard_redirect(request):
     
     return redirect('login')
 
+def visible_appointments(user):
+    """Appointments ``user`` may list, by role"""
+    if user.role == 'superadmin':
+        return Appointment.objects.all()
+    if user.role == 'admin':
+        return Appointment.objects.filter(hospital=user.hospital)
+    if user.role == 'doctor':
+        return Appointment.objects.filter(doctor=user)
+    return Appointment.objects.filter(patient=user)
+
 @login_required
 def doctor_list(request):
     user = request.user
@@ -81,7 +111,8 @@ def doctor_list(request):
     else:
         doctors = User.objects.filter(role='doctor', hospital=user.hospital)
         
-    return render(request, 'users/doctor_list.html', {'doctors': doctors})
+    page = paginate(request, doctors.select_related('doctor_profile', 'hospital'), USER_ORDERING)
+    return render(request, 'users/doctor_list.html', {'doctors': page.object_list, 'page': page})
 
 @login_required
 def patient_list(request):
@@ -94,28 +125,25 @@ def patient_list(request):
     else:
         patients = User.objects.filter(role='patient', hospital=user.hospital)
         
-    return render(request, 'users/patient_list.html', {'patients': patients})
+    page = paginate(request, patients.select_related('patient_profile'), USER_ORDERING)
+    return render(request, 'users/patient_list.html', {'patients': page.object_list, 'page': page})
 
 @login_required
 def appointment_list(request):
     user = request.user
     today = timezone.now().date()
     
-    if user.role == 'superadmin':
-        appointments = Appointment.objects.all()
-        completed_appointments = None
-    elif user.role == 'admin':
-        appointments = Appointment.objects.filter(hospital=user.hospital)
-        completed_appointments = None
-    elif user.role == 'doctor':
-        appointments = Appointment.objects.filter(doctor=user)
-        completed_appointments = Appointment.objects.filter(doctor=user, status='done').order_by('-date', '-time')
-    else: # Patient
-        appointments = Appointment.objects.filter(patient=user)
-        completed_appointments = None
+    page = paginate(request, visible_appointments(user).select_related('patient', 'doctor'), APPOINTMENT_ORDERING)
+    completed_appointments = None
+    if user.role == 'doctor':
+        # Latest few only; the full history pages through the ledger above
+        completed_appointments = Appointment.objects.filter(doctor=user, status='done').select_related(
+            'patient'
+        ).order_by(*APPOINTMENT_ORDERING)[:DEFAULT_PAGE_SIZE]
         
     return render(request, 'users/appointment_list.html', {
-        'appointments': appointments.order_by('-date', '-time'),
+        'appointments': page.object_list,
+        'page': page,
         'completed_appointments': completed_appointments,
         'today': today
     })
@@ -123,8 +151,8 @@ def appointment_list(request):
 @login_required
 @user_passes_test(is_superadmin)
 def manage_users(request):
-    users = User.objects.all().order_by('-date_joined')
-    return render(request, 'users/manage_users.html', {'users': users})
+    page = paginate(request, User.objects.all(), USER_ORDERING)
+    return render(request, 'users/manage_users.html', {'users': page.object_list, 'page': page})
 
 @login_required
 @user_passes_test(is_superadmin)
@@ -267,6 +295,12 @@ def hospital_doctors(request):
         selected_hospital = get_object_or_404(Hospital, id=selected_hospital_id)
         doctors = User.objects.filter(role='doctor', hospital=selected_hospital)
     
+    # Cross-hospital search: doctors ranked by earliest free slot
+    search_results = None
+    search = search_params(request.GET) if request.GET.get('specialization') else None
+    if search is not None:
+        search_results = directory.search(**search)
+    
     # Get admin's sent requests
     admin_requests = AppointmentRequest.objects.filter(requested_by=request.user).order_by('-created_at')
     
@@ -274,7 +308,11 @@ def hospital_doctors(request):
         'hospitals': hospitals,
         'doctors': doctors,
         'admin_requests': admin_requests,
-        'selected_hospital_id': int(selected_hospital_id) if selected_hospital_id else None
+        'selected_hospital_id': int(selected_hospital_id) if selected_hospital_id else None,
+        'specializations': directory.specializations(),
+        'search': search,
+        'search_hospital_ids': (search['hospital_ids'] or []) if search else [],
+        'search_results': search_results,
     })
 
 @login_required